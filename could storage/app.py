@@ -1,27 +1,73 @@
-from flask import Flask, render_template, request, redirect, url_for, session, send_file, jsonify
-from user_manager import UserManager
-from file_manager import FileManager
+from flask import Flask, Response, g, render_template, request, redirect, url_for, session, send_file, jsonify
+from file_manager import SORT_KEYS as FILE_SORT_KEYS
+from http_ranges import MultipartRanges, RangeNotSatisfiable, etag_matches, parse_range, quote_etag
+from upload_sessions import UploadError
+from utils import ensure_download_dir
+from web_common import (MAX_PAGE_SIZE, PAGE_SIZE, SECRET_KEY, THUMB_HEADERS, THUMB_PENDING_HEADERS, THUMB_PLACEHOLDER,
+                        admin_file_delta, admin_file_row, blob_store, bulk_files, content_disposition, file_manager,
+                        format_timestamp, not_modified, preview_source, storage, thumb_url, thumbnailer,
+                        upload_manager, user_manager, weak_etag)
+from email.utils import formatdate
+import metrics
+import json
+import mimetypes
 import os
+import time
 
 app = Flask(__name__)
-app.secret_key = 'super_secret_key_change_this'
+app.secret_key = SECRET_KEY
+# Let a fronting nginx/Apache serve file bodies directly when configured to (X-Sendfile)
+app.use_x_sendfile = os.getenv("USE_X_SENDFILE") == "1"
+app.jinja_env.filters['timestamp'] = format_timestamp
 
-user_manager = UserManager()
-file_manager = FileManager()
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    """Time to response headers per route; streamed bodies (downloads, SSE) are not included."""
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.registry.histogram('web_request_seconds', 'Time to response headers, by route', route=route,
+                                   method=request.method, status=response.status_code).observe(time.perf_counter() - start)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Local scrapers only; the numbers reveal traffic patterns
+    if request.remote_addr not in metrics.LOCAL_ADDRESSES:
+        return "Not Found", 404
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+def page_args(sort_keys, default_sort: str, default_order: str = 'asc'):
+    """Reads sort, order, page token ("after") and page size from the query string."""
+    sort = request.args.get('sort', default_sort)
+    if sort not in sort_keys:
+        sort = default_sort
+    descending = request.args.get('order', default_order) == 'desc'
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    return sort, descending, request.args.get('after'), limit
 
 @app.route('/')
 def index():
     if 'user_id' in session:
         user_id = int(session['user_id'])
         query = request.args.get('q')
+        sort, descending, after, limit = page_args(FILE_SORT_KEYS, 'uploaded', 'desc')
         
         if query:
-            files = file_manager.search_files(query, user_id)
+            # Best matches first; only the top page is shown
+            files = [{"code": code, "name": name} for code, name, _ in file_manager.search_files(query, user_id, limit)]
+            next_page = None
         else:
-            files = file_manager.get_user_files(user_id)
+            files, next_page = file_manager.list_files(user_id, "/", sort, descending, after, limit)
+        files = [dict(f, thumb=thumb_url(f["code"])) for f in files]
             
         is_admin = user_manager.is_admin(user_id)
-        return render_template('index.html', files=files, is_admin=is_admin, query=query)
+        return render_template('index.html', files=files, is_admin=is_admin, query=query,
+                               sort=sort, order='desc' if descending else 'asc', next_page=next_page, paged=bool(after))
     return render_template('index.html')
 
 @app.route('/admin')
@@ -34,41 +80,76 @@ def admin():
         return "Access Denied: Admins only."
         
     query = request.args.get('q')
+    # The page is current as of this cursor; the live feed picks up from here
+    _, cursor = file_manager.get_changes(None)
+    sort, descending, after, limit = page_args(FILE_SORT_KEYS, 'uploaded', 'desc')
+    next_users = next_page = None
     if query:
-        users = user_manager.search_users(query)
-        files = file_manager.search_files(query, None) # None = Admin search
+        users = user_manager.search_users(query, limit)
+        files = [{"code": code, "name": name, "owner": owner}
+                 for code, name, owner in file_manager.search_files(query, None, limit)] # None = Admin search
     else:
-        users = user_manager.get_all_users()
-        files = file_manager.get_all_files()
-    
-    # Create a mapping of User ID -> Username for display
-    # users is a list of (uid, username)
-    user_map = {str(uid): username for uid, username in user_manager.get_all_users()}
+        users, next_users = user_manager.list_users(cursor=request.args.get('users_after'), limit=limit)
+        files, next_page = file_manager.list_files(None, sort=sort, descending=descending, cursor=after, limit=limit)
+    files = [admin_file_row(f) for f in files]
         
-    return render_template('admin.html', users=users, files=files, query=query, user_map=user_map)
+    return render_template('admin.html', users=users, files=files, query=query, cursor=cursor,
+                           sort=sort, order='desc' if descending else 'asc', next_page=next_page,
+                           next_users=next_users, paged=bool(after))
 
-@app.route('/api/admin/files')
-def api_admin_files():
+def admin_file_page() -> dict:
+    """One page of all files for the admin API, plus the change cursor it is current as of."""
+    _, cursor = file_manager.get_changes(None)
+    sort, descending, after, limit = page_args(FILE_SORT_KEYS, 'uploaded', 'desc')
+    files, next_page = file_manager.list_files(None, sort=sort, descending=descending, cursor=after, limit=limit)
+    return {"files": [admin_file_row(f) for f in files], "next": next_page, "cursor": cursor}
+
+def admin_required():
     if 'user_id' not in session:
         return jsonify({"error": "Unauthorized"}), 401
-    
-    user_id = int(session['user_id'])
-    if not user_manager.is_admin(user_id):
+    if not user_manager.is_admin(int(session['user_id'])):
         return jsonify({"error": "Forbidden"}), 403
+    return None
 
-    files = file_manager.get_all_files()
-    user_map = {str(uid): username for uid, username in user_manager.get_all_users()}
-    
-    data = []
-    for code, name, owner in files:
-        data.append({
-            "code": code,
-            "name": name,
-            "owner": owner,
-            "owner_name": user_map.get(str(owner), "Unknown")
-        })
-    
-    return jsonify(data)
+# Pages through all files (?sort=name|uploaded|size&order=asc|desc&limit=N&after=<next from the
+# previous page>). With ?cursor=<cursor from a previous response> it instead returns only the
+# files added, renamed or deleted since then.
+@app.route('/api/admin/files')
+def api_admin_files():
+    denied = admin_required()
+    if denied:
+        return denied
+    if 'cursor' in request.args:
+        return jsonify(admin_file_delta(request.args['cursor']))
+    return jsonify(admin_file_page())
+
+# The same deltas pushed as Server-Sent Events; each event id is a cursor, so a
+# reconnecting EventSource resumes where it left off via Last-Event-ID.
+@app.route('/api/admin/files/stream')
+def api_admin_files_stream():
+    denied = admin_required()
+    if denied:
+        return denied
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+
+    def events(cursor):
+        while True:
+            delta = admin_file_delta(cursor)
+            if delta["reset"] or delta["upserts"] or delta["deletes"]:
+                cursor = delta["cursor"]
+                yield f"id: {cursor}\ndata: {json.dumps(delta)}\n\n"
+            if not file_manager.wait_changes(cursor, timeout=15):
+                yield ": keepalive\n\n"
+
+    return Response(events(cursor), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+# Moves, copies, deletes or tags many of the user's files in one request; see bulk_files
+@app.route('/api/files/bulk', methods=['POST'])
+def api_files_bulk():
+    if 'user_id' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    body, status = bulk_files(int(session['user_id']), request.get_json(silent=True))
+    return jsonify(body), status
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -98,21 +179,151 @@ def upload():
         return "No selected file"
 
     if file:
-        from utils import ensure_download_dir, get_save_path
         ensure_download_dir()
         
-        save_path = get_save_path(file.filename)
-        file.save(save_path)
+        with blob_store.ingest() as out:
+            file.save(out)
         
-        file_manager.save_file_record(str(save_path), int(session['user_id']), file.filename)
+        file_manager.save_file_record(str(out.path), int(session['user_id']), file.filename,
+                                      sha256=out.hexdigest(), size=out.size, file_name=file.filename)
         return redirect(url_for('index'))
 
+# Chunked uploads: POST /upload/init, PUT /upload/<id>/<n> for each chunk, POST /upload/<id>/finalize.
+# GET /upload/<id> lists the chunks already received so an interrupted upload can resume.
+@app.route('/upload/init', methods=['POST'])
+def upload_init():
+    if 'user_id' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    data = request.get_json(silent=True) or {}
+    name = data.get("name")
+    size = data.get("size")
+    if not name or not isinstance(size, int):
+        return jsonify({"error": "name and size are required"}), 400
+    try:
+        upload = upload_manager.create(int(session['user_id']), name, size, data.get("sha256"))
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"upload_id": upload.id, "chunk_size": upload.chunk_size, "chunk_count": upload.chunk_count})
+
+@app.route('/upload/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    if 'user_id' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    upload = upload_manager.get(upload_id, int(session['user_id']))
+    if upload is None:
+        return jsonify({"error": "Unknown or expired upload"}), 404
+    return jsonify({"chunk_size": upload.chunk_size, "chunk_count": upload.chunk_count, "received": sorted(upload.received)})
+
+@app.route('/upload/<upload_id>/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    if 'user_id' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    upload = upload_manager.get(upload_id, int(session['user_id']))
+    if upload is None:
+        return jsonify({"error": "Unknown or expired upload"}), 404
+    try:
+        # request.stream is read in small blocks, so a chunk never sits in memory whole
+        upload_manager.write_chunk(upload, index, request.stream, request.headers.get('X-Chunk-SHA256'))
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"received": len(upload.received)})
+
+@app.route('/upload/<upload_id>/finalize', methods=['POST'])
+def upload_finalize(upload_id):
+    if 'user_id' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    user_id = int(session['user_id'])
+    upload = upload_manager.get(upload_id, user_id)
+    if upload is None:
+        return jsonify({"error": "Unknown or expired upload"}), 404
+
+    try:
+        save_path, digest = upload_manager.finalize(upload, blob_store)
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 400
+    code = file_manager.save_file_record(str(save_path), user_id, upload.file_name,
+                                         sha256=digest, size=upload.size, file_name=upload.file_name)
+    return jsonify({"code": code, "sha256": digest})
+
 @app.route('/download/<code>')
 def download(code):
     path = file_manager.get_file_path(code)
-    if path and os.path.exists(path):
-        return send_file(path, as_attachment=True)
-    return "File not found"
+    if not (path and os.path.exists(path)):
+        return "File not found"
+
+    etag = file_manager.get_content_hash(code)
+    download_name = file_manager.get_download_name(code)
+    stat = os.stat(path)
+    size = stat.st_size
+    content_type = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    # Several ranges need a multipart body, which send_file does not produce
+    if etag and range_header and ',' in range_header and (not if_range or etag_matches(if_range, etag)):
+        # The same conditional handling send_file gives the other responses
+        headers = {
+            'ETag': quote_etag(etag),
+            'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+            'Accept-Ranges': 'bytes',
+            'Content-Disposition': content_disposition(download_name),
+        }
+        if not_modified(request.headers, etag, stat.st_mtime):
+            return Response(status=304, headers=headers)
+        try:
+            ranges = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+        if ranges and len(ranges) > 1:
+            body = MultipartRanges(path, ranges, size, content_type)
+            headers['Content-Length'] = str(body.content_length)
+            return Response(body, status=206, content_type=body.content_type, headers=headers)
+
+    # Single ranges, If-None-Match / If-Modified-Since (304) and If-Range are handled by
+    # send_file's conditional mode; full bodies go out through wsgi.file_wrapper (sendfile).
+    # Absolute, since send_file resolves relative paths against the app's source directory, not the working directory.
+    # No download_name: send_file fails on names with line breaks, so content_disposition() sets the header
+    if etag:
+        response = send_file(os.path.abspath(path), mimetype=content_type, etag=etag, conditional=True)
+        response.headers['Content-Disposition'] = content_disposition(download_name)
+        return response
+    # Not hashed yet: a weak ETag, good for 304s; send_file never sees it, since If-Range only takes a strong one
+    validator = weak_etag(stat)
+    headers = {'ETag': f'W/{quote_etag(validator)}'}
+    if not_modified(request.headers, validator, stat.st_mtime):
+        return Response(status=304, headers=headers)
+    response = send_file(os.path.abspath(path), mimetype=content_type, etag=False, conditional=True)
+    response.headers.update(headers, **{'Content-Disposition': content_disposition(download_name)})
+    return response
+
+# A small JPEG preview of an image or video file, built on first request if the bot has not built it yet
+@app.route('/thumb/<code>')
+def thumbnail(code):
+    source = preview_source(code)
+    if source is None:
+        return "No preview", 404
+    if source[1] is None:
+        # The file is still being hashed; previews are keyed by its hash
+        return Response(THUMB_PLACEHOLDER, status=202, mimetype='image/svg+xml', headers=THUMB_PENDING_HEADERS)
+    etag = f"{source[1]}-{thumbnailer.cache.size}"
+    headers = dict(THUMB_HEADERS, ETag=quote_etag(etag))
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers=headers)
+    future = thumbnailer.submit(*source)
+    if not future.done():
+        return Response(THUMB_PLACEHOLDER, status=202, mimetype='image/svg+xml', headers=THUMB_PENDING_HEADERS)
+    path = future.result()
+    if path is None:
+        return "No preview", 404
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        # Evicted from the cache just now
+        return Response(THUMB_PLACEHOLDER, status=202, mimetype='image/svg+xml', headers=THUMB_PENDING_HEADERS)
+    return Response(data, mimetype='image/jpeg', headers=headers)
 
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
@@ -0,0 +1,500 @@
+"""ASGI version of the web app (Starlette + uvicorn), with the same routes and templates as app.py.
+
+Request and response bodies are streamed on the event loop. Disk reads and
+writes happen in worker threads one block at a time, so a slow client only
+ever holds a socket, never a thread. Run it with `python asgi_app.py`; see
+WEB_PORT and WEB_WORKERS. app.py stays as the Flask version for development.
+"""
+import asyncio
+import json
+import mimetypes
+import os
+import time
+from email.utils import formatdate
+from urllib.parse import urlencode
+
+import anyio
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from file_manager import SORT_KEYS as FILE_SORT_KEYS
+import metrics
+from http_ranges import (MultipartRanges, RangeNotSatisfiable, etag_matches, iter_file_range, parse_range,
+                         quote_etag)
+from upload_sessions import UploadError
+from utils import ensure_download_dir
+from web_common import (MAX_PAGE_SIZE, PAGE_SIZE, SECRET_KEY, THUMB_HEADERS, THUMB_PENDING_HEADERS, THUMB_PLACEHOLDER,
+                        admin_file_delta, admin_file_row, blob_store, bulk_files, content_disposition, file_manager,
+                        format_timestamp, not_modified, preview_source, thumb_url, thumbnailer, upload_manager,
+                        user_manager, weak_etag)
+
+templates = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")),
+                        autoescape=select_autoescape())
+templates.filters['timestamp'] = format_timestamp
+SSE_POLL = 0.5  # Seconds between checks for new changes on an admin live feed
+
+
+def url_for(name: str, **values) -> str:
+    """Flask-style url_for for the shared templates: arguments that are not path parameters become the query string."""
+    for route in routes:
+        if route.name == name:
+            params = {key: values.pop(key) for key in list(values) if key in route.param_convertors}
+            path = route.url_path_for(name, **params)
+            query = urlencode({key: value for key, value in values.items() if value is not None})
+            return f"{path}?{query}" if query else str(path)
+    raise LookupError(f"No route named {name!r}")
+
+
+def render_template(request: Request, name: str, **context) -> HTMLResponse:
+    html = templates.get_template(name).render(session=request.session, url_for=url_for, **context)
+    return HTMLResponse(html)
+
+
+def page_args(request: Request, sort_keys, default_sort: str, default_order: str = 'asc'):
+    """Reads sort, order, page token ("after") and page size from the query string."""
+    args = request.query_params
+    sort = args.get('sort', default_sort)
+    if sort not in sort_keys:
+        sort = default_sort
+    descending = args.get('order', default_order) == 'desc'
+    try:
+        limit = int(args.get('limit', PAGE_SIZE))
+    except ValueError:
+        limit = PAGE_SIZE
+    return sort, descending, args.get('after'), min(max(limit, 1), MAX_PAGE_SIZE)
+
+
+def session_user(request: Request):
+    user_id = request.session.get('user_id')
+    return int(user_id) if user_id is not None else None
+
+
+def admin_required(request: Request):
+    user_id = session_user(request)
+    if user_id is None:
+        return JSONResponse({"error": "Unauthorized"}, 401)
+    if not user_manager.is_admin(user_id):
+        return JSONResponse({"error": "Forbidden"}, 403)
+    return None
+
+
+class BodyReader:
+    """Blocking file-like view of a request body, for code running in a worker thread.
+
+    Each read() pulls just enough of the body from the event loop, so upload
+    code written for file objects can stream without buffering the body.
+    """
+
+    def __init__(self, request: Request):
+        self._chunks = request.stream()
+        self._buffer = bytearray()
+        self._done = False
+
+    async def _next(self) -> bytes:
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            self._done = True
+            return b""
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._done and (size < 0 or len(self._buffer) < size):
+            self._buffer += anyio.from_thread.run(self._next)
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+async def index(request: Request):
+    user_id = session_user(request)
+    if user_id is None:
+        return render_template(request, 'index.html')
+    query = request.query_params.get('q')
+    sort, descending, after, limit = page_args(request, FILE_SORT_KEYS, 'uploaded', 'desc')
+
+    # The manager's lock can be held for a whole batch of writes, so listings run in the threadpool
+    def load():
+        if query:
+            # Best matches first; only the top page is shown
+            files = [{"code": code, "name": name}
+                     for code, name, _ in file_manager.search_files(query, user_id, limit)]
+            next_page = None
+        else:
+            files, next_page = file_manager.list_files(user_id, "/", sort, descending, after, limit)
+        return [dict(f, thumb=thumb_url(f["code"])) for f in files], next_page
+
+    files, next_page = await run_in_threadpool(load)
+
+    return render_template(request, 'index.html', files=files, is_admin=user_manager.is_admin(user_id), query=query,
+                           sort=sort, order='desc' if descending else 'asc', next_page=next_page, paged=bool(after))
+
+
+async def admin(request: Request):
+    user_id = session_user(request)
+    if user_id is None:
+        return RedirectResponse(url_for('index'), 302)
+    if not user_manager.is_admin(user_id):
+        return HTMLResponse("Access Denied: Admins only.")
+
+    query = request.query_params.get('q')
+    users_after = request.query_params.get('users_after')
+    sort, descending, after, limit = page_args(request, FILE_SORT_KEYS, 'uploaded', 'desc')
+
+    def load():
+        # The page is current as of this cursor; the live feed picks up from here
+        _, cursor = file_manager.get_changes(None)
+        next_users = next_page = None
+        if query:
+            users = user_manager.search_users(query, limit)
+            files = [{"code": code, "name": name, "owner": owner}
+                     for code, name, owner in file_manager.search_files(query, None, limit)]  # None = Admin search
+        else:
+            users, next_users = user_manager.list_users(cursor=users_after, limit=limit)
+            files, next_page = file_manager.list_files(None, sort=sort, descending=descending, cursor=after,
+                                                       limit=limit)
+        return cursor, users, next_users, [admin_file_row(f) for f in files], next_page
+
+    cursor, users, next_users, files, next_page = await run_in_threadpool(load)
+
+    return render_template(request, 'admin.html', users=users, files=files, query=query, cursor=cursor,
+                           sort=sort, order='desc' if descending else 'asc', next_page=next_page,
+                           next_users=next_users, paged=bool(after))
+
+
+async def api_admin_files(request: Request):
+    denied = admin_required(request)
+    if denied:
+        return denied
+    if 'cursor' in request.query_params:
+        return JSONResponse(await run_in_threadpool(admin_file_delta, request.query_params['cursor']))
+    sort, descending, after, limit = page_args(request, FILE_SORT_KEYS, 'uploaded', 'desc')
+
+    def load():
+        _, cursor = file_manager.get_changes(None)
+        files, next_page = file_manager.list_files(None, sort=sort, descending=descending, cursor=after, limit=limit)
+        return {"files": [admin_file_row(f) for f in files], "next": next_page, "cursor": cursor}
+
+    return JSONResponse(await run_in_threadpool(load))
+
+
+async def wait_changes(cursor, timeout: float) -> bool:
+    """FileManager.wait_changes without holding a threadpool thread for the whole wait.
+
+    Each check is a quick call in the threadpool and the loop sleeps in between,
+    so open admin tabs cannot use up the threads downloads and uploads need.
+    """
+    deadline = time.monotonic() + timeout
+    while not await run_in_threadpool(file_manager.wait_changes, cursor, 0):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(remaining, SSE_POLL))
+    return True
+
+
+async def api_admin_files_stream(request: Request):
+    denied = admin_required(request)
+    if denied:
+        return denied
+    cursor = request.headers.get('Last-Event-ID') or request.query_params.get('cursor')
+
+    async def events(cursor):
+        while True:
+            delta = await run_in_threadpool(admin_file_delta, cursor)
+            if delta["reset"] or delta["upserts"] or delta["deletes"]:
+                cursor = delta["cursor"]
+                yield f"id: {cursor}\ndata: {json.dumps(delta)}\n\n"
+            if not await wait_changes(cursor, 15):
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(events(cursor), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+# Moves, copies, deletes or tags many of the user's files in one request; see app.bulk_files
+async def api_files_bulk(request: Request):
+    user_id = session_user(request)
+    if user_id is None:
+        return JSONResponse({"error": "Unauthorized"}, 401)
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    body, status = await run_in_threadpool(bulk_files, user_id, data)
+    return JSONResponse(body, status)
+
+
+async def login(request: Request):
+    form = await request.form()
+    user_id = form.get('user_id')
+    if user_manager.validate_web_login(user_id, form.get('password')):
+        request.session['user_id'] = user_id
+        return RedirectResponse(url_for('index'), 302)
+    return HTMLResponse("Invalid credentials. <a href='/'>Try again</a>")
+
+
+async def logout(request: Request):
+    request.session.pop('user_id', None)
+    return RedirectResponse(url_for('index'), 302)
+
+
+async def upload(request: Request):
+    user_id = session_user(request)
+    if user_id is None:
+        return RedirectResponse(url_for('index'), 302)
+
+    form = await request.form()
+    file = form.get('file')
+    if file is None or isinstance(file, str):
+        return HTMLResponse("No file part")
+    if not file.filename:
+        return HTMLResponse("No selected file")
+
+    def store():
+        ensure_download_dir()
+        with blob_store.ingest() as out:
+            # The form parser has already spooled the part to a temporary file
+            while block := file.file.read(1024 * 1024):
+                out.write(block)
+        file_manager.save_file_record(str(out.path), user_id, file.filename,
+                                      sha256=out.hexdigest(), size=out.size, file_name=file.filename)
+
+    await run_in_threadpool(store)
+    await form.close()
+    return RedirectResponse(url_for('index'), 302)
+
+
+# Chunked uploads: POST /upload/init, PUT /upload/<id>/<n> for each chunk, POST /upload/<id>/finalize.
+# GET /upload/<id> lists the chunks already received so an interrupted upload can resume.
+async def upload_init(request: Request):
+    user_id = session_user(request)
+    if user_id is None:
+        return JSONResponse({"error": "Unauthorized"}, 401)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        data = {}
+    name = data.get("name")
+    size = data.get("size")
+    if not name or not isinstance(size, int):
+        return JSONResponse({"error": "name and size are required"}, 400)
+    try:
+        upload = await run_in_threadpool(upload_manager.create, user_id, name, size, data.get("sha256"))
+    except UploadError as e:
+        return JSONResponse({"error": str(e)}, 400)
+    return JSONResponse({"upload_id": upload.id, "chunk_size": upload.chunk_size, "chunk_count": upload.chunk_count})
+
+
+async def upload_status(request: Request):
+    user_id = session_user(request)
+    if user_id is None:
+        return JSONResponse({"error": "Unauthorized"}, 401)
+
+    # Reads the session's files when another worker process created or advanced it
+    upload = await run_in_threadpool(upload_manager.get, request.path_params['upload_id'], user_id)
+    if upload is None:
+        return JSONResponse({"error": "Unknown or expired upload"}, 404)
+    return JSONResponse({"chunk_size": upload.chunk_size, "chunk_count": upload.chunk_count,
+                         "received": sorted(upload.received)})
+
+
+async def upload_chunk(request: Request):
+    user_id = session_user(request)
+    if user_id is None:
+        return JSONResponse({"error": "Unauthorized"}, 401)
+
+    upload = await run_in_threadpool(upload_manager.get, request.path_params['upload_id'], user_id)
+    if upload is None:
+        return JSONResponse({"error": "Unknown or expired upload"}, 404)
+    try:
+        # The body is pulled from the socket as write_chunk reads it, so a chunk never sits in memory whole
+        await run_in_threadpool(upload_manager.write_chunk, upload, request.path_params['index'],
+                                BodyReader(request), request.headers.get('X-Chunk-SHA256'))
+    except UploadError as e:
+        return JSONResponse({"error": str(e)}, 400)
+    return JSONResponse({"received": len(upload.received)})
+
+
+async def upload_finalize(request: Request):
+    user_id = session_user(request)
+    if user_id is None:
+        return JSONResponse({"error": "Unauthorized"}, 401)
+
+    upload = await run_in_threadpool(upload_manager.get, request.path_params['upload_id'], user_id)
+    if upload is None:
+        return JSONResponse({"error": "Unknown or expired upload"}, 404)
+
+    try:
+        save_path, digest = await run_in_threadpool(upload_manager.finalize, upload, blob_store)
+    except UploadError as e:
+        return JSONResponse({"error": str(e)}, 400)
+    code = await run_in_threadpool(file_manager.save_file_record, str(save_path), user_id, upload.file_name,
+                                   sha256=digest, size=upload.size, file_name=upload.file_name)
+    return JSONResponse({"code": code, "sha256": digest})
+
+
+async def download(request: Request):
+    code = request.path_params['code']
+
+    # Takes the manager's lock, which a batch of writes can hold for a while, and stats the file: not on the event loop
+    def locate():
+        path = file_manager.get_file_path(code)
+        if not path:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return path, stat, file_manager.get_content_hash(code), file_manager.get_download_name(code)
+
+    found = await run_in_threadpool(locate)
+    if found is None:
+        return HTMLResponse("File not found")
+    path, stat, etag, download_name = found
+    size = stat.st_size
+    content_type = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    # Until an old file is hashed in the background, a weak ETag; If-Range below only takes the strong one
+    validator = etag or weak_etag(stat)
+    headers = {
+        'ETag': quote_etag(etag) if etag else f'W/{quote_etag(validator)}',
+        'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': content_disposition(download_name),
+    }
+
+    if not_modified(request.headers, validator, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    ranges = None
+    # A range is only served if the client's copy (If-Range) is still current
+    if range_header and (not if_range or (etag and etag_matches(if_range, etag))):
+        try:
+            ranges = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={'Content-Range': f'bytes */{size}'})
+
+    # Sync iterators are advanced in the threadpool one block at a time
+    if ranges and len(ranges) > 1:
+        body = MultipartRanges(path, ranges, size, content_type)
+        headers['Content-Length'] = str(body.content_length)
+        return StreamingResponse(iter(body), 206, headers, media_type=body.content_type)
+    if ranges:
+        start, end = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        headers['Content-Length'] = str(end - start + 1)
+        return StreamingResponse(iter_file_range(path, start, end), 206, headers, media_type=content_type)
+    headers['Content-Length'] = str(size)
+    return StreamingResponse(iter_file_range(path, 0, size - 1), 200, headers, media_type=content_type)
+
+
+# A small JPEG preview of an image or video file, built on first request if the bot has not built it yet
+async def thumbnail(request: Request):
+    # Checks the file on disk, so not on the event loop
+    source = await run_in_threadpool(preview_source, request.path_params['code'])
+    if source is None:
+        return HTMLResponse("No preview", 404)
+    if source[1] is None:
+        # The file is still being hashed; previews are keyed by its hash
+        return Response(THUMB_PLACEHOLDER, 202, THUMB_PENDING_HEADERS, media_type='image/svg+xml')
+    etag = f"{source[1]}-{thumbnailer.cache.size}"
+    headers = dict(THUMB_HEADERS, ETag=quote_etag(etag))
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status_code=304, headers=headers)
+    # The first call scans the preview cache, and every one stats the preview file
+    future = await run_in_threadpool(thumbnailer.submit, *source)
+    if not future.done():
+        return Response(THUMB_PLACEHOLDER, 202, THUMB_PENDING_HEADERS, media_type='image/svg+xml')
+    path = future.result()
+    if path is None:
+        return HTMLResponse("No preview", 404)
+    try:
+        data = await anyio.Path(path).read_bytes()
+    except FileNotFoundError:
+        # Evicted from the cache just now
+        return Response(THUMB_PLACEHOLDER, 202, THUMB_PENDING_HEADERS, media_type='image/svg+xml')
+    return Response(data, headers=headers, media_type='image/jpeg')
+
+
+async def metrics_endpoint(request: Request):
+    # Local scrapers only, as in app.py; with several WEB_WORKERS each scrape sees one worker's numbers
+    if request.client is None or request.client.host not in metrics.LOCAL_ADDRESSES:
+        return Response("Not Found", 404)
+    return Response(metrics.registry.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+class RequestTimer:
+    """ASGI middleware recording time to response headers per route, like app.py's after_request hook."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = None
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start" and status is None:
+                status = message["status"]
+                self.record(scope, status, start)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            if status is None:
+                self.record(scope, 500, start)  # Failed before sending anything
+
+    @staticmethod
+    def record(scope, status: int, start: float):
+        route = scope.get("route")  # Set by the router once a route matched
+        metrics.registry.histogram('web_request_seconds', 'Time to response headers, by route',
+                                   route=getattr(route, 'path', 'unmatched'), method=scope["method"],
+                                   status=status).observe(time.perf_counter() - start)
+
+
+routes = [
+    Route('/', index, name='index'),
+    Route('/admin', admin, name='admin'),
+    Route('/api/admin/files', api_admin_files, name='api_admin_files'),
+    Route('/api/admin/files/stream', api_admin_files_stream, name='api_admin_files_stream'),
+    Route('/api/files/bulk', api_files_bulk, methods=['POST'], name='api_files_bulk'),
+    Route('/login', login, methods=['POST'], name='login'),
+    Route('/logout', logout, name='logout'),
+    Route('/upload', upload, methods=['POST'], name='upload'),
+    Route('/upload/init', upload_init, methods=['POST'], name='upload_init'),
+    Route('/upload/{upload_id}', upload_status, methods=['GET'], name='upload_status'),
+    Route('/upload/{upload_id}/{index:int}', upload_chunk, methods=['PUT'], name='upload_chunk'),
+    Route('/upload/{upload_id}/finalize', upload_finalize, methods=['POST'], name='upload_finalize'),
+    Route('/download/{code}', download, name='download'),
+    Route('/thumb/{code}', thumbnail, name='thumbnail'),
+    Route('/metrics', metrics_endpoint, name='metrics_endpoint'),
+]
+
+# Same secret as the Flask app; the cookie formats differ, so a login does not carry over between the two
+app = Starlette(routes=routes, middleware=[Middleware(RequestTimer),
+                                           Middleware(SessionMiddleware, secret_key=SECRET_KEY)])
+metrics.start_sampler_from_env()
+
+if __name__ == '__main__':
+    import uvicorn
+
+    # Each worker is a separate process with its own storage; they stay in step via storage_service's sync, and
+    # upload sessions and admin feed cursors live on disk, so any worker can serve any request
+    uvicorn.run("asgi_app:app", host=os.getenv("WEB_HOST", "0.0.0.0"), port=int(os.getenv("WEB_PORT", "5001")),
+                workers=int(os.getenv("WEB_WORKERS", "1")), log_level="warning")
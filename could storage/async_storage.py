@@ -0,0 +1,152 @@
+import asyncio
+import functools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import metrics
+
+
+def queued(fn, histogram: metrics.Histogram):
+    """Wraps `fn` to record how long it waited for an executor thread before starting."""
+    submitted = time.perf_counter()
+
+    def run():
+        histogram.observe(time.perf_counter() - submitted)
+        return fn()
+    return run
+
+
+def deliver(results: list):
+    """Hands a batch of (future, result, error) back on the event loop that is waiting for them."""
+    for future, result, error in results:
+        if future.cancelled():
+            continue
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+class SerialExecutor:
+    """Runs calls one at a time on a single thread, in the order they were submitted.
+
+    Unlike a one-thread ThreadPoolExecutor, results go back to the event loop
+    in batches: a burst of short calls costs one loop wake-up instead of one
+    per call, which is most of their overhead under load.
+    """
+
+    BATCH = 32  # results per hand-back, so the first calls of a long burst are not held back
+
+    def __init__(self, name: str):
+        self._calls = deque()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn) -> asyncio.Future:
+        """Queues `fn()`; the returned future belongs to the running event loop."""
+        if self._closed:
+            raise RuntimeError("cannot schedule new calls after shutdown")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._calls.append((loop, future, fn))
+        self._wake.set()
+        return future
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            loop, results = None, []
+            while self._calls:
+                call = self._calls.popleft()
+                if call is None:
+                    self._flush(loop, results)
+                    return
+                if call[0] is not loop or len(results) >= self.BATCH:
+                    self._flush(loop, results)
+                    loop, results = call[0], []
+                try:
+                    results.append((call[1], call[2](), None))
+                except BaseException as e:
+                    results.append((call[1], None, e))
+            self._flush(loop, results)
+
+    @staticmethod
+    def _flush(loop, results: list):
+        if results:
+            try:
+                loop.call_soon_threadsafe(deliver, results)
+            except RuntimeError:
+                pass  # The loop has closed; nobody is waiting for these any more
+
+    def shutdown(self):
+        """Runs the calls already queued, then stops the thread."""
+        self._closed = True
+        self._calls.append(None)
+        self._wake.set()
+        self._thread.join()
+
+
+class AsyncProxy:
+    """Awaitable view of a manager: every method call goes through `run` (AsyncStorage.run or run_io)."""
+
+    def __init__(self, target, run):
+        self._target = target
+        self._run = run
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            return await self._run(attr, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+
+class AsyncStorage:
+    """Async facade over FileManager and UserManager for the bot's handlers.
+
+    Metadata calls run one at a time on a dedicated storage thread, so they
+    see and apply changes in the same order as the old inline calls did, but
+    without stalling the event loop (see SerialExecutor). Bulk file reads and writes use a separate
+    small pool so a large file never queues behind metadata work or vice versa.
+    """
+
+    def __init__(self, file_manager, user_manager, state_store=None, io_workers: int = 4):
+        self.executor = SerialExecutor("storage")
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="storage-io")
+        # Time from submitting a call to a thread picking it up; high values mean the pool is the bottleneck
+        self.waits = metrics.registry.histogram("storage_queue_wait_seconds", "Time calls wait for a storage thread",
+                                                pool="storage")
+        self.io_waits = metrics.registry.histogram("storage_queue_wait_seconds", "Time calls wait for a storage thread",
+                                                   pool="io")
+        self.files = AsyncProxy(file_manager, self.run)
+        self.users = AsyncProxy(user_manager, self.run)
+        # Conversation state is independent of the managers, so it does not queue behind them
+        self.states = AsyncProxy(state_store, self.run_io) if state_store is not None else None
+
+    async def run(self, fn, *args, **kwargs):
+        """Runs a function that reads or writes manager state on the storage thread."""
+        return await self.executor.submit(queued(functools.partial(fn, *args, **kwargs), self.waits))
+
+    async def run_io(self, fn, *args, **kwargs):
+        """Runs blocking file I/O that does not touch manager state."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_executor, queued(functools.partial(fn, *args, **kwargs), self.io_waits))
+
+    async def read_bytes(self, path) -> bytes:
+        return await self.run_io(Path(path).read_bytes)
+
+    async def read_text(self, path, encoding: str = "utf-8") -> str:
+        return await self.run_io(Path(path).read_text, encoding=encoding)
+
+    def shutdown(self):
+        self.executor.shutdown()
+        self.io_executor.shutdown(wait=True)
@@ -0,0 +1 @@
+"""Performance benchmarks. Run modules from the `could storage` directory with `python -m benchmarks.<name>`."""
@@ -0,0 +1,174 @@
+"""Bot handler flows from main.py replayed on a synthetic dataset.
+
+Each flow is what one user action sends the bot: commands, button presses,
+a prompt and its answer, or an attachment. Flows run one after another, in
+a seeded random order, through Application.process_update. Bot API calls
+are answered in process by FakeRequest, so the times cover the handlers
+and storage but no network. An upload counts until its background download
+and store have finished. Run from the `could storage` directory:
+
+    python -m benchmarks.bench_bot
+    python -m benchmarks.bench_bot --scale medium --ops 300 --output bot.json
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import sys
+import tempfile
+
+import httpx
+
+from benchmarks import datasets, results
+from benchmarks.bench_webhook import callback_update
+from benchmarks.fake_telegram import FakeRequest, FakeTelegram
+
+FLOWS = ("command.start", "browse.list_files", "browse.cd", "browse.cd_up", "browse.next_page", "browse.file",
+         "command.search", "note.save", "folder.mkdir", "file.rename", "file.delete", "file.upload",
+         "folder.delete")
+
+
+def message_update(user_id: int, message_id: int, text: str = None, document: dict = None) -> dict:
+    message = {"message_id": message_id, "date": 0, "chat": {"id": user_id, "type": "private"},
+               "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}}
+    if document is not None:
+        message["document"] = document
+    else:
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"message": message}
+
+
+class Flows:
+    """Builds the updates of each flow for a user, from the bot's current data."""
+
+    def __init__(self, bot, rng: random.Random):
+        self.bot = bot
+        self.rng = rng
+        self.ids = itertools.count(1)
+
+    def codes(self, user_id: int) -> list:
+        return [code for code, _, _ in self.bot.file_manager.get_user_files(user_id, "/")]
+
+    def folders(self, user_id: int) -> list:
+        return self.bot.user_manager.get_subfolders(user_id, "/")
+
+    def updates(self, flow: str, user_id: int) -> list:
+        encode = self.bot.callbacks.encode
+        rng = self.rng
+        message_id = next(self.ids)
+        if flow == "command.start":
+            return [message_update(user_id, message_id, "/start")]
+        if flow == "browse.list_files":
+            return [callback_update(user_id, encode("list_files"))]
+        if flow == "browse.cd":
+            folders = self.folders(user_id)
+            return [callback_update(user_id, encode("cd", rng.choice(folders)))] if folders else []
+        if flow == "browse.cd_up":
+            return [callback_update(user_id, encode("cd", ".."))]
+        if flow == "browse.next_page":
+            return [callback_update(user_id, encode("ls", self.bot.BOT_PAGE_SIZE))]
+        if flow == "browse.file":
+            codes = self.codes(user_id)
+            return [callback_update(user_id, encode("file", rng.choice(codes)))] if codes else []
+        if flow == "command.search":
+            return [message_update(user_id, message_id, f"/search {rng.choice(datasets.WORDS)}")]
+        if flow == "note.save":
+            return [message_update(user_id, message_id, " ".join(rng.sample(datasets.WORDS, 5)))]
+        if flow == "folder.mkdir":
+            return [callback_update(user_id, encode("mkdir_prompt")),
+                    message_update(user_id, message_id, f"new{message_id}")]
+        if flow == "file.rename":
+            codes = self.codes(user_id)
+            if not codes:
+                return []
+            return [callback_update(user_id, encode("rename_prompt", rng.choice(codes))),
+                    message_update(user_id, message_id, datasets.file_name(rng))]
+        if flow == "file.delete":
+            codes = self.codes(user_id)
+            if not codes:
+                return []
+            code = rng.choice(codes)
+            return [callback_update(user_id, encode("del_confirm", code)), callback_update(user_id, encode("del", code))]
+        if flow == "file.upload":
+            document = {"file_id": f"doc{message_id}", "file_unique_id": f"bench-{message_id}",
+                        "file_name": datasets.file_name(rng), "mime_type": "application/octet-stream"}
+            return [message_update(user_id, message_id, document=document)]
+        if flow == "folder.delete":
+            folders = self.folders(user_id)
+            if not folders:
+                return []
+            return [callback_update(user_id, encode("cd", rng.choice(folders))),
+                    callback_update(user_id, encode("del_folder_confirm")), callback_update(user_id, encode("del_folder"))]
+        raise ValueError(flow)
+
+
+async def replay(bot, dataset_dir: str, ops: int, seed: int) -> dict:
+    from telegram import Update
+
+    rng = random.Random(seed)
+    recorder = results.Recorder()
+    users = datasets.user_ids(datasets.load_manifest(dataset_dir))
+    fake = FakeTelegram()
+    application = bot.build_application("123:fake", request=FakeRequest(fake))
+    # Attachments are streamed from their file URLs by the bot's own client; the fake serves those too
+    bot.download_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake))
+    await application.initialize()
+    flows = Flows(bot, rng)
+    scheduler = bot.download_scheduler
+
+    plan = [flow for flow in FLOWS for _ in range(ops)]
+    rng.shuffle(plan)
+    for flow in plan:
+        user_id = rng.choice(users)
+        updates = [Update.de_json(dict(data, update_id=next(flows.ids)), application.bot)
+                   for data in flows.updates(flow, user_id)]
+        if not updates:
+            continue
+
+        async def run_flow():
+            for update in updates:
+                await application.process_update(update)
+            while scheduler.running or scheduler.queue_depth:  # Uploads finish in the background
+                await asyncio.sleep(0.001)
+        await recorder.measure_async(flow, run_flow())
+        # Start the next flow from the root folder, as a returning user would
+        await bot.storage.users.set_current_folder(user_id, "/")
+    await application.shutdown()
+    return recorder.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    datasets.add_arguments(parser)
+    parser.add_argument("--ops", type=int, default=200, help="runs of each flow")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    cwd = os.getcwd()
+    sys.path.insert(0, cwd)
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_dir = datasets.from_arguments(args, tmp)
+        work = os.path.join(tmp, "work")
+        os.mkdir(work)
+        datasets.install(dataset_dir, work)
+        os.chdir(work)  # main.py opens its databases in the working directory
+        try:
+            import main as bot
+            logging.getLogger().setLevel(logging.WARNING)  # Per-request logging would dominate the timings
+            summary = asyncio.run(replay(bot, dataset_dir, args.ops, args.seed))
+            bot.storage.shutdown()
+            bot.shared_storage.close()
+        finally:
+            os.chdir(cwd)
+        results.print_summary("bot", summary)
+        if output:
+            results.save(output, {"bot": summary}, datasets.load_manifest(dataset_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Concurrent download throughput: the Flask dev server (app.py) vs the ASGI app (asgi_app.py).
+
+Each server runs in its own process over the same temporary database and
+blob. The benchmark opens --clients concurrent downloads of one --size MB
+file. --slow of those clients read at only --slow-rate KB/s, the way phone
+users on bad connections do. It reports aggregate throughput and
+per-download times for the fast clients. Run from the `could storage`
+directory:
+
+    python -m benchmarks.bench_downloads
+    python -m benchmarks.bench_downloads --clients 64 --slow 32 --size 20 --workers 2
+
+Pass --url http://host:port/download/<code> to load-test an already running server instead.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+SERVERS = {
+    # The configuration `python app.py` runs, minus the debug reloader
+    "flask": "import app; app.app.run(host='127.0.0.1', port={port})",
+    "asgi": "import uvicorn; uvicorn.run('asgi_app:app', host='127.0.0.1', port={port}, workers={workers}, log_level='warning')",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare(size_mb: int) -> str:
+    """Stores one random file of `size_mb` MB in the current directory's database; returns its code."""
+    from blob_store import BlobStore
+    from storage_service import SharedStorage
+
+    storage = SharedStorage(sync_interval=0)
+    with BlobStore().ingest() as out:
+        for _ in range(size_mb):
+            out.write(os.urandom(1024 * 1024))
+    # Absolute, because Flask's send_file resolves relative paths against the source directory
+    code = storage.file_manager.save_file_record(str(out.path.resolve()), 1, "bench.bin",
+                                                 sha256=out.hexdigest(), size=out.size)
+    storage.file_manager.get_content_hash(code)
+    storage.close()
+    return code
+
+
+def start_server(kind: str, source_dir: str, workers: int) -> tuple:
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=source_dir, STORAGE_SYNC_INTERVAL="0")
+    proc = subprocess.Popen([sys.executable, "-c", SERVERS[kind].format(port=port, workers=workers)], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+
+async def fetch(client: httpx.AsyncClient, url: str, rate: float = None) -> tuple:
+    """Downloads `url`; returns (seconds, bytes). `rate` (bytes/s) throttles reading like a slow link."""
+    start = time.perf_counter()
+    received = 0
+    async with client.stream("GET", url) as response:
+        async for chunk in response.aiter_raw(64 * 1024):
+            received += len(chunk)
+            if rate:
+                await asyncio.sleep(len(chunk) / rate)
+    return time.perf_counter() - start, received
+
+
+async def load(url: str, clients: int, slow: int, slow_rate: float) -> dict:
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        slow_tasks = [asyncio.create_task(fetch(client, url, slow_rate)) for _ in range(slow)]
+        await asyncio.sleep(0.2)  # Let the slow clients take their connections first
+        start = time.perf_counter()
+        fast = await asyncio.gather(*(fetch(client, url) for _ in range(clients - slow)))
+        elapsed = time.perf_counter() - start
+        for task in slow_tasks:
+            task.cancel()
+        await asyncio.gather(*slow_tasks, return_exceptions=True)
+    times = sorted(seconds for seconds, _ in fast)
+    return {
+        "mb_per_s": sum(received for _, received in fast) / elapsed / 1e6,
+        "p50_s": statistics.median(times),
+        "max_s": times[-1],
+        "complete": sum(1 for _, received in fast if received) == len(fast),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="download URL of a running server (skips starting servers)")
+    parser.add_argument("--servers", nargs="+", choices=sorted(SERVERS), default=["flask", "asgi"])
+    parser.add_argument("--clients", type=int, default=32, help="concurrent downloads, slow ones included")
+    parser.add_argument("--slow", type=int, default=16, help="how many of the clients read slowly")
+    parser.add_argument("--slow-rate", type=float, default=256, help="KB/s read by each slow client")
+    parser.add_argument("--size", type=int, default=10, help="file size in MB")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the ASGI app")
+    args = parser.parse_args()
+    slow_rate = args.slow_rate * 1024
+
+    print(f"{args.clients} clients ({args.slow} reading at {args.slow_rate:g} KB/s), {args.size} MB file")
+    print(f"{'server':>8} {'MB/s':>8} {'p50 s':>8} {'max s':>8}")
+    if args.url:
+        r = asyncio.run(load(args.url, args.clients, args.slow, slow_rate))
+        print(f"{'url':>8} {r['mb_per_s']:>8.1f} {r['p50_s']:>8.2f} {r['max_s']:>8.2f}")
+        return
+
+    source_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # The servers open their databases and blobs in the working directory
+        sys.path.insert(0, source_dir)
+        try:
+            code = prepare(args.size)
+            for kind in args.servers:
+                proc, base = start_server(kind, source_dir, args.workers)
+                try:
+                    r = asyncio.run(load(f"{base}/download/{code}", args.clients, args.slow, slow_rate))
+                finally:
+                    proc.terminate()
+                    proc.wait()
+                print(f"{kind:>8} {r['mb_per_s']:>8.1f} {r['p50_s']:>8.2f} {r['max_s']:>8.2f}"
+                      + ("" if r["complete"] else "  (some downloads came back empty)"))
+        finally:
+            os.chdir(source_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Handler latency under mixed load: managers called inline on the event loop vs through AsyncStorage.
+
+Simulates concurrent bot users issuing a mix of folder views, `cd:` clicks,
+note saves and storage-free pings (which only measure how long the event
+loop is stalled), at several database sizes. Run from the `could storage`
+directory:
+
+    python -m benchmarks.bench_handler_latency
+    python -m benchmarks.bench_handler_latency --sizes 10000 100000 --store json
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from async_storage import AsyncStorage
+from file_manager import FileManager
+from metadata_store import JsonMetadataStore, SQLiteMetadataStore
+from user_manager import UserManager
+from benchmarks.bench_listing import make_records
+
+USERS = 200              # concurrently active users
+FILES_PER_OWNER = 50     # owners grow with the database, so folder sizes stay constant
+OPS_PER_USER = 50
+PAGE_SIZE = 20          # main.BOT_PAGE_SIZE
+MIX = [("view", 0.6), ("cd", 0.15), ("save", 0.1), ("ping", 0.15)]
+
+
+def build(size: int, store_kind: str):
+    records = make_records(size, max(USERS, size // FILES_PER_OWNER), 10)
+    if store_kind == "json":
+        store = JsonMetadataStore("file_db.json")
+    else:
+        store = SQLiteMetadataStore("file_db.sqlite3")
+    with store.transaction():
+        for code, record in records.items():
+            store.upsert(code, record)
+    fm = FileManager(store=store)
+    um = UserManager(background=False)
+    for uid in range(USERS):
+        um.register(uid, f"user{uid}")
+        um.create_folder(uid, "dir1")
+    return fm, um
+
+
+def view(fm, um, uid):
+    # One page of the folder, as the bot's file browser renders it
+    folder = um.get_current_folder(uid)
+    subfolders, total = um.page_subfolders(uid, folder, 0, PAGE_SIZE)
+    return subfolders, fm.page_files(uid, folder, 0, PAGE_SIZE - len(subfolders))
+
+
+def save_note(fm, um, uid, text):
+    return fm.save_file_record(f"notes/{uid}.txt", uid, text, um.get_current_folder(uid))
+
+
+async def user_session(mode: str, fm, um, storage, uid: int, rng: random.Random, latencies: dict, saved: list):
+    kinds, weights = zip(*MIX)
+    for _ in range(OPS_PER_USER):
+        kind = rng.choices(kinds, weights)[0]
+        start = time.perf_counter()
+        if kind == "ping":
+            await asyncio.sleep(0)
+        elif mode == "inline":
+            if kind == "view":
+                view(fm, um, uid)
+            elif kind == "cd":
+                um.set_current_folder(uid, rng.choice(["/", "/dir1"]))
+            else:
+                saved.append((save_note(fm, um, uid, "note"), uid))
+            await asyncio.sleep(0)
+        else:
+            if kind == "view":
+                await storage.run(view, fm, um, uid)
+            elif kind == "cd":
+                await storage.users.set_current_folder(uid, rng.choice(["/", "/dir1"]))
+            else:
+                saved.append((await storage.run(save_note, fm, um, uid, "note"), uid))
+        latencies.setdefault(kind, []).append(time.perf_counter() - start)
+
+
+def p99(values: list) -> float:
+    return statistics.quantiles(values, n=100)[98] if len(values) > 1 else values[0]
+
+
+async def run_mode(mode: str, fm, um) -> dict:
+    storage = AsyncStorage(fm, um) if mode == "async" else None
+    latencies, saved = {}, []
+    rng = random.Random(1)
+    await asyncio.gather(*(user_session(mode, fm, um, storage, uid, random.Random(rng.random()), latencies, saved)
+                           for uid in range(USERS)))
+    if storage:
+        storage.shutdown()
+    # Leave the folders as they were, so every round sees the same data
+    with fm.batch():
+        for code, uid in saved:
+            fm.delete_file(code, uid)
+    return latencies
+
+
+def main(sizes, store_kind: str, rounds: int):
+    print(f"{'records':>9} {'mode':>7} " + " ".join(f"{kind + ' p99 ms':>14}" for kind, _ in MIX))
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                fm, um = build(size, store_kind)
+                # Alternate the modes and keep each one's median round, as one run is at the mercy of the machine
+                p99s = {"inline": [], "async": []}
+                for _ in range(rounds):
+                    for mode, found in p99s.items():
+                        gc.collect()
+                        latencies = asyncio.run(run_mode(mode, fm, um))
+                        found.append({kind: p99(values) for kind, values in latencies.items()})
+                fm.store.close()
+                um.close()
+            finally:
+                os.chdir(cwd)
+        for mode, found in p99s.items():
+            row = " ".join(f"{statistics.median(r[kind] for r in found) * 1e3:>14.2f}" for kind, _ in MIX)
+            print(f"{size:>9} {mode:>7} {row}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 500_000])
+    parser.add_argument("--store", choices=["sqlite", "json"], default="sqlite")
+    parser.add_argument("--rounds", type=int, default=5, help="runs per mode; the median p99 is shown")
+    args = parser.parse_args()
+    main(args.sizes, args.store, args.rounds)
@@ -0,0 +1,68 @@
+"""Folder listing latency: indexed FileManager.get_user_files vs the old full scan.
+
+Run from the `could storage` directory:
+
+    python -m benchmarks.bench_listing
+    python -m benchmarks.bench_listing --sizes 10000 100000 --owners 500
+"""
+import argparse
+import random
+import time
+
+from file_manager import FileManager
+from metadata_store import MemoryMetadataStore
+
+
+def make_records(count: int, owners: int, folders_per_owner: int) -> dict:
+    rng = random.Random(count)
+    records = {}
+    for i in range(count):
+        owner = rng.randrange(owners)
+        folder = "/" if i % folders_per_owner == 0 else f"/dir{rng.randrange(folders_per_owner)}"
+        records[f"C{i:07d}"] = {
+            "path": f"downloads/file_{i}.bin",
+            "owner_id": owner,
+            "name": f"file_{i}.bin",
+            "folder": folder
+        }
+    return records
+
+
+def full_scan(db: dict, user_id: int, folder: str) -> list:
+    """The pre-index implementation of get_user_files."""
+    files = []
+    for code, record in db.items():
+        if isinstance(record, dict) and record.get("owner_id") == user_id:
+            if record.get("folder", "/") == folder:
+                files.append((code, record.get("name", "Unknown File"), "file"))
+    return files
+
+
+def time_per_call(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def run(sizes, owners: int, folders_per_owner: int, repeat: int):
+    print(f"{'records':>10} {'files/folder':>13} {'indexed (us)':>13} {'full scan (us)':>15}")
+    for size in sizes:
+        fm = FileManager(store=MemoryMetadataStore(make_records(size, owners, folders_per_owner)))
+        user_id, folder = 0, "/dir1"
+        listed = fm.get_user_files(user_id, folder)
+        assert listed == full_scan(fm.db, user_id, folder)
+
+        indexed = time_per_call(lambda: fm.get_user_files(user_id, folder), repeat)
+        scanned = time_per_call(lambda: full_scan(fm.db, user_id, folder), max(1, repeat // 100))
+        print(f"{size:>10} {len(listed):>13} {indexed * 1e6:>13.1f} {scanned * 1e6:>15.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--owners", type=int, default=1000)
+    parser.add_argument("--folders-per-owner", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+    run(args.sizes, args.owners, args.folders_per_owner, args.repeat)
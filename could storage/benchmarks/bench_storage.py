@@ -0,0 +1,104 @@
+"""FileManager and UserManager operations on a synthetic dataset.
+
+Opens the dataset as a first start would (importing file_db.json into
+SQLite), then times --ops calls of each operation for random users: saves,
+folder listings, searches, renames, deletes, folder changes, folder
+deletes and bulk moves, copies, tags and deletes of a user's files. Run from the `could storage` directory:
+
+    python -m benchmarks.bench_storage
+    python -m benchmarks.bench_storage --scale medium --ops 2000 --output storage.json
+"""
+import argparse
+import os
+import random
+import tempfile
+
+from benchmarks import datasets, results
+
+PAGE = 20  # entries per listing page, like the bot's keyboard
+
+
+def run(dataset_dir: str, ops: int, seed: int = 0) -> dict:
+    from file_manager import FileManager
+    from storage_service import delete_folder_tree
+    from user_manager import UserManager
+
+    rng = random.Random(seed)
+    recorder = results.Recorder()
+    manifest = datasets.load_manifest(dataset_dir)
+    users = datasets.user_ids(manifest)
+
+    fm = recorder.measure("open.file_manager_import", FileManager)
+    recorder.measure("open.file_manager", FileManager)  # From SQLite, as on every later start
+    um = recorder.measure("open.user_manager", UserManager, background=False)
+
+    folders = {uid: um.get_subfolders(uid, "/") for uid in users}
+    owned = [(code, record["owner_id"]) for code, record in fm.db.items()]
+    picked = rng.sample(owned, min(len(owned), 2 * ops))
+    renames, deletes = picked[:len(picked) // 2], picked[len(picked) // 2:]
+
+    for i in range(ops):
+        uid = rng.choice(users)
+        folder = rng.choice(["/"] + folders[uid])
+        word = rng.choice(datasets.WORDS)
+        recorder.measure("files.save", fm.save_file_record, f"downloads/bench/{i}", uid, datasets.file_name(rng),
+                         folder, sha256=f"{rng.getrandbits(256):064x}", size=rng.randrange(1 << 20))
+        recorder.measure("files.page", fm.page_files, uid, folder, 0, PAGE)
+        recorder.measure("files.list_by_upload", fm.list_files, uid, "/", "uploaded", True, None, 50)
+        recorder.measure("files.search_own", fm.search_files, word, uid)
+        recorder.measure("files.search_all", fm.search_files, word[:4], None, 50)
+        recorder.measure("users.page_subfolders", um.page_subfolders, uid, "/", 0, PAGE)
+        recorder.measure("users.cd", um.set_current_folder, uid, folder)
+        recorder.measure("users.mkdir", um.create_folder, uid, f"bench{i}")
+        um.set_current_folder(uid, "/")
+    for code, owner in renames:
+        recorder.measure("files.rename", fm.rename_file, code, datasets.file_name(rng), owner)
+    for code, owner in deletes:
+        recorder.measure("files.delete", fm.delete_file, code, owner)
+
+    # Folder deletes as the bot does them: the files in the subtree and the folders, one commit each
+    for uid in rng.sample(users, min(len(users), max(1, ops // 10))):
+        if folders[uid]:
+            recorder.measure("folder.delete", delete_folder_tree, fm, um, uid, rng.choice(folders[uid]))
+
+    # Bulk operations on everything a user owns, as from the bot's select mode or /api/files/bulk
+    for uid in rng.sample(users, min(len(users), max(1, ops // 10))):
+        codes = list(fm.index.by_owner.get(uid, ()))
+        folder = rng.choice(["/"] + um.get_subfolders(uid, "/"))
+        recorder.measure("bulk.tag", fm.tag_files, codes, uid, [rng.choice(datasets.WORDS)])
+        recorder.measure("bulk.move", fm.move_files, codes, uid, folder)
+        copies = recorder.measure("bulk.copy", fm.copy_files, codes, uid, "/")
+        recorder.measure("bulk.delete", fm.delete_files, copies, uid)
+
+    recorder.measure("users.compact", um.compact)
+    um.close()
+    fm.close()
+    return recorder.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    datasets.add_arguments(parser)
+    parser.add_argument("--ops", type=int, default=1000, help="calls of each operation")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_dir = datasets.from_arguments(args, tmp)
+        work = os.path.join(tmp, "work")
+        os.mkdir(work)
+        datasets.install(dataset_dir, work)
+        os.chdir(work)  # The managers open their files in the working directory
+        try:
+            summary = run(dataset_dir, args.ops, args.seed)
+        finally:
+            os.chdir(cwd)
+        results.print_summary("storage", summary)
+        if output:
+            results.save(output, {"storage": summary}, datasets.load_manifest(dataset_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Preview pipeline: building thumbnails of camera-sized photos, and serving a gallery page of them.
+
+Writes --images random JPEG photos of --width x --height pixels, builds
+their previews on a Thumbnailer with --workers processes, then requests a
+gallery page of /thumb/<code> URLs through the Flask test client: first
+with a cold browser cache, then revalidating with If-None-Match. Prints
+the bytes a gallery costs per item with previews and with the full files.
+Needs Pillow. Run from the `could storage` directory:
+
+    python -m benchmarks.bench_thumbnails
+    python -m benchmarks.bench_thumbnails --images 100 --workers 4 --output thumbs.json
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks import results
+
+
+def make_photo(index: int, width: int, height: int) -> bytes:
+    from PIL import Image
+
+    # Noise compresses about as badly as a real photo, so file sizes are realistic
+    image = Image.effect_noise((width, height), 40 + index % 20).convert("RGB")
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def run(app, images: int, width: int, height: int, workers: int) -> tuple:
+    recorder = results.Recorder()
+    app.thumbnailer.workers = workers
+    app.user_manager.register(1, "bench")
+    codes, full_bytes = [], 0
+    for i in range(images):
+        data = make_photo(i, width, height)
+        with app.blob_store.ingest() as out:
+            out.write(data)
+        full_bytes += out.size
+        codes.append(app.file_manager.save_file_record(str(out.path), 1, f"photo{i}.jpg", sha256=out.hexdigest(),
+                                                       size=out.size, file_name=f"photo{i}.jpg"))
+
+    # All at once, as when a user sends an album; the wall time shows what the pool parallelizes
+    start = time.perf_counter()
+    futures = [app.thumbnailer.submit(*app.preview_source(code)) for code in codes]
+    assert all(future.result() for future in futures), "some previews failed"
+    build_seconds = time.perf_counter() - start
+    recorder.add("build.per_image", build_seconds / images)
+
+    client = app.app.test_client()
+    etags, thumb_bytes = {}, 0
+    for code in codes:
+        response = recorder.measure("thumb.cached", client.get, f"/thumb/{code}")
+        assert response.status_code == 200, response.status_code
+        etags[code] = response.headers["ETag"]
+        thumb_bytes += len(response.data)
+    for code in codes:
+        response = recorder.measure("thumb.not_modified", client.get, f"/thumb/{code}",
+                                    headers={"If-None-Match": etags[code]})
+        assert response.status_code == 304, response.status_code
+    sizes = {"full_kb_per_item": full_bytes / images / 1024, "preview_kb_per_item": thumb_bytes / images / 1024,
+             "build_seconds": build_seconds}
+    return recorder.summary(), sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="preview worker processes")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        sys.exit("This benchmark needs Pillow (pip install Pillow)")
+
+    cwd = os.getcwd()
+    sys.path.insert(0, cwd)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # app.py opens its databases, blobs and previews in the working directory
+        try:
+            import app
+            summary, sizes = run(app, args.images, args.width, args.height, args.workers)
+            app.thumbnailer.close()
+            app.storage.close()
+        finally:
+            os.chdir(cwd)
+    results.print_summary("thumbnails", summary)
+    print(f"\n{args.images} images of {args.width}x{args.height} built in {sizes['build_seconds']:.2f}s "
+          f"with {args.workers} worker(s)")
+    print(f"Gallery bytes per item: {sizes['full_kb_per_item']:.0f} KB full size, "
+          f"{sizes['preview_kb_per_item']:.1f} KB as previews")
+    if output:
+        results.save(output, {"thumbnails": summary}, dict(sizes, images=args.images, width=args.width,
+                                                           height=args.height))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Sorted view cache with many users: hit rate and page latency of folder listings.
+
+Gives --users users --files files each, spread over --folders folders, then
+replays --requests first-page listings (page_files, as the bot's folder
+view does) for random users, folders and sorts. Each cache budget
+(--budgets, in codes) gets a warm-up pass and a measured pass, and prints
+its hit rate: once every view fits, every listing should be a hit. The
+first default budget is about what the old 128-view limit held.
+
+    python -m benchmarks.bench_view_cache
+    python -m benchmarks.bench_view_cache --users 20000 --budgets 100000 500000 --output views.json
+"""
+import argparse
+import os
+import random
+
+from benchmarks import results
+from file_manager import FileManager
+from metadata_store import MemoryMetadataStore
+from sorted_index import VIEW_CACHE_ENTRIES, SortedViews
+
+SORTS = ("name", "uploaded")
+
+
+def make_records(users: int, files: int, folders: int) -> dict:
+    rng = random.Random(users)
+    records = {}
+    for user in range(users):
+        for i in range(files):
+            records[f"U{user:06d}F{i:04d}"] = {
+                "path": f"downloads/{user}_{i}.bin",
+                "owner_id": user,
+                "name": f"file_{rng.randrange(10 ** 6)}.bin",
+                "folder": "/" if i % folders == 0 else f"/dir{i % folders}",
+                "uploaded_at": rng.random() * 1e9,
+            }
+    return records
+
+
+def replay(fm: FileManager, requests: list, recorder=None, name: str = ""):
+    for user, folder, sort in requests:
+        if recorder is None:
+            fm.page_files(user, folder, 0, 20, sort)
+        else:
+            recorder.measure(name, fm.page_files, user, folder, 0, 20, sort)
+
+
+def run(users: int, files: int, folders: int, requests: int, budgets: list) -> tuple:
+    fm = FileManager(store=MemoryMetadataStore(make_records(users, files, folders)), background=False)
+    rng = random.Random(0)
+    stream = []
+    for _ in range(requests):
+        folder = rng.randrange(folders)
+        stream.append((rng.randrange(users), "/" if folder == 0 else f"/dir{folder}", rng.choice(SORTS)))
+    recorder = results.Recorder()
+    rates = {}
+    for budget in budgets:
+        fm.views = SortedViews(fm.views.sort_keys, max_entries=budget)
+        replay(fm, stream)  # Warm-up
+        hits, misses = fm.views.hits, fm.views.misses
+        replay(fm, stream, recorder, f"page.budget_{budget}")
+        rates[budget] = (fm.views.hits - hits) / max(1, fm.views.hits - hits + fm.views.misses - misses)
+    fm.close()
+    return recorder.summary(), rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--files", type=int, default=40, help="files per user")
+    parser.add_argument("--folders", type=int, default=4, help="folders per user")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--budgets", type=int, nargs="+", help="view cache sizes, in codes")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    # 128 views of an average folder, as the old view-count limit kept, then the current default
+    budgets = args.budgets or [128 * args.files // args.folders, VIEW_CACHE_ENTRIES]
+
+    summary, rates = run(args.users, args.files, args.folders, args.requests, budgets)
+    results.print_summary("view_cache", summary)
+    views = args.users * args.folders * len(SORTS)
+    print(f"\n{args.users} users, {views} folder views of ~{args.files // args.folders} files")
+    for budget, rate in rates.items():
+        print(f"budget {budget:>9} codes: {rate:6.1%} of listings served from the cache")
+    if args.budgets is None and views * args.files // args.folders <= VIEW_CACHE_ENTRIES:
+        assert rates[VIEW_CACHE_ENTRIES] > 0.99, "every view fits the default budget, but listings missed"
+    if output:
+        results.save(output, {"view_cache": summary}, {"users": args.users, "files": args.files,
+                                                       "folders": args.folders, "requests": args.requests})
+
+
+if __name__ == "__main__":
+    main()
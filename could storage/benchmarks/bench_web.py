@@ -0,0 +1,111 @@
+"""Flask routes from app.py, called through the Flask test client on a synthetic dataset.
+
+Times logins, file listings and searches, the admin page and API, form and
+chunked uploads, and full, ranged and conditional downloads of uploaded
+files. The test client skips the network and the WSGI server, so the times
+are the app's own. Run from the `could storage` directory:
+
+    python -m benchmarks.bench_web
+    python -m benchmarks.bench_web --scale medium --ops 500 --output web.json
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+
+from benchmarks import datasets, results
+
+SESSIONS = 20            # logged-in users the requests are spread over
+UPLOAD_SIZE = 64 * 1024  # bytes per form upload
+CHUNKED_SIZE = 1 << 20   # bytes per chunked upload
+
+
+def login(app, user_id: int):
+    client = app.test_client()
+    response = client.post("/login", data={"user_id": str(user_id), "password": f"pw{user_id - datasets.FIRST_USER_ID}"})
+    assert response.status_code == 302, f"login failed for {user_id}"
+    return client
+
+
+def run(app, dataset_dir: str, ops: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    recorder = results.Recorder()
+    users = datasets.user_ids(datasets.load_manifest(dataset_dir))
+    admin = login(app.app, users[0])
+    clients = [(user_id, login(app.app, user_id)) for user_id in rng.sample(users, min(SESSIONS, len(users)))]
+    cursor = admin.get("/api/admin/files").get_json()["cursor"]
+
+    def timed(name: str, call, status: int = 200):
+        def request():
+            response = call()
+            response.get_data()  # Streamed bodies (downloads) are only produced while being read
+            return response
+        response = recorder.measure(name, request)
+        assert response.status_code == status, f"{name}: {response.status_code} {response.get_data()[:200]!r}"
+        return response
+
+    codes = []
+    for i in range(ops):
+        user_id, client = rng.choice(clients)
+        word = rng.choice(datasets.WORDS)
+        timed("login", lambda: app.app.test_client().post(
+            "/login", data={"user_id": str(user_id), "password": f"pw{user_id - datasets.FIRST_USER_ID}"}), 302)
+        timed("index", lambda: client.get("/"))
+        timed("index.search", lambda: client.get(f"/?q={word}"))
+        timed("index.by_size", lambda: client.get("/?sort=size&order=desc"))
+        timed("admin.page", lambda: admin.get("/admin"))
+        timed("admin.api_files", lambda: admin.get("/api/admin/files"))
+        cursor = timed("admin.api_changes", lambda: admin.get(f"/api/admin/files?cursor={cursor}")).get_json()["cursor"]
+
+        data = rng.randbytes(UPLOAD_SIZE)
+        timed("upload.form", lambda: client.post("/upload", data={"file": (io.BytesIO(data), f"web{i}.bin")},
+                                                 content_type="multipart/form-data"), 302)
+        if i % 10 == 0:
+            def chunked_upload():
+                payload = rng.randbytes(CHUNKED_SIZE)
+                session = client.post("/upload/init", json={"name": f"big{i}.bin", "size": len(payload)}).get_json()
+                size = session["chunk_size"]
+                for n in range(session["chunk_count"]):
+                    client.put(f"/upload/{session['upload_id']}/{n}", data=payload[n * size:(n + 1) * size])
+                return client.post(f"/upload/{session['upload_id']}/finalize")
+            codes.append((client, timed("upload.chunked", chunked_upload).get_json()["code"]))
+
+        if codes:
+            owner, code = rng.choice(codes)
+            etag = timed("download.full", lambda: owner.get(f"/download/{code}")).headers["ETag"]
+            timed("download.range", lambda: owner.get(f"/download/{code}", headers={"Range": "bytes=1000-65535"}), 206)
+            timed("download.not_modified", lambda: owner.get(f"/download/{code}", headers={"If-None-Match": etag}), 304)
+    return recorder.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    datasets.add_arguments(parser)
+    parser.add_argument("--ops", type=int, default=300, help="rounds of requests; one in ten adds a chunked upload")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    cwd = os.getcwd()
+    sys.path.insert(0, cwd)
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_dir = datasets.from_arguments(args, tmp)
+        work = os.path.join(tmp, "work")
+        os.mkdir(work)
+        datasets.install(dataset_dir, work)
+        os.chdir(work)  # app.py opens its databases and blobs in the working directory
+        try:
+            import app
+            summary = run(app, dataset_dir, args.ops, args.seed)
+            app.storage.close()
+        finally:
+            os.chdir(cwd)
+        results.print_summary("web", summary)
+        if output:
+            results.save(output, {"web": summary}, datasets.load_manifest(dataset_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""Replays a stream of Telegram updates against the bot in polling and webhook mode.
+
+Both modes run the real handlers from main.py against a local FakeTelegram
+server. Polling mode serves the updates through getUpdates. Webhook mode
+POSTs them to a WebhookServer and retries when it answers 503. Updates are
+injected at a fixed rate. Latency runs from injection to the last API call
+the bot makes for that update. Run from the `could storage` directory:
+
+    python -m benchmarks.bench_webhook --generate 3000 --rate 1000
+    python -m benchmarks.bench_webhook --updates recorded.jsonl --mode webhook
+
+Recorded streams come from running the bot with RECORD_UPDATES=<file>.
+Everything runs in one process, so absolute numbers include the harness's
+own overhead. Compare the modes against each other, not against production.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+
+from benchmarks.fake_telegram import FakeTelegram, SEND_METHODS
+
+USERS = 50
+FOLDERS = 5
+FILES_PER_FOLDER = 40
+RETRY_DELAY = 0.05  # seconds before re-POSTing an update the webhook refused (503)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    return {"callback_query": {
+        "id": "0", "chat_instance": "0", "data": data,
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "message": {"message_id": 0, "date": 0, "text": "menu", "chat": {"id": user_id, "type": "private"}},
+    }}
+
+
+def populate(main):
+    """Registers USERS users with FOLDERS folders of FILES_PER_FOLDER files each; returns {user_id: [codes]}."""
+    codes = {}
+    for user_id in range(1, USERS + 1):
+        main.user_manager.register(user_id, f"user{user_id}")
+        codes[user_id] = []
+        for f in range(FOLDERS):
+            main.user_manager.create_folder(user_id, f"dir{f}")
+            for n in range(FILES_PER_FOLDER):
+                codes[user_id].append(main.file_manager.save_file_record(
+                    f"bench/{user_id}/{f}/{n}", user_id, f"file{n}.txt", f"/dir{f}", size=n))
+    return codes
+
+
+def generate_stream(main, codes: dict, count: int, rng: random.Random) -> list:
+    """Folder browsing clicks from random users: listings, pages, cd in and out, file details."""
+    encode = main.callbacks.encode
+    actions = [
+        (0.30, lambda: encode("list_files")),
+        (0.20, lambda: encode("ls", rng.choice([0, main.BOT_PAGE_SIZE]))),
+        (0.20, lambda: encode("cd", f"/dir{rng.randrange(FOLDERS)}")),
+        (0.15, lambda: encode("cd", "..")),
+        (0.15, None),
+    ]
+    weights = [w for w, _ in actions]
+    stream = []
+    for _ in range(count):
+        user_id = rng.randint(1, USERS)
+        make = rng.choices(actions, weights)[0][1]
+        stream.append(callback_update(user_id, make() if make else encode("file", rng.choice(codes[user_id]))))
+    return stream
+
+
+def load_stream(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def chat_of(update: dict):
+    for key in ("callback_query", "message", "edited_message"):
+        if key in update:
+            message = update[key].get("message", update[key]) if key == "callback_query" else update[key]
+            return message.get("chat", {}).get("id")
+    return None
+
+
+class Tracker:
+    """Matches the bot's API calls to the updates that caused them.
+
+    Updates are renumbered so that callback query IDs and message IDs are
+    unique. answerCallbackQuery and editMessageText then identify the update
+    exactly. A plain message is matched to the next reply sent to its chat.
+    """
+
+    def __init__(self, stream: list):
+        self.updates = []
+        self.by_key = {}
+        self.waiting_chats = {}  # chat_id -> indexes of message updates with no reply yet, oldest first
+        for i, original in enumerate(stream):
+            update = json.loads(json.dumps(original))
+            update["update_id"] = i + 1
+            query = update.get("callback_query")
+            if query:
+                query["id"] = str(i + 1)
+                query.setdefault("message", {})["message_id"] = i + 1
+                self.by_key[("query", str(i + 1))] = i
+                self.by_key[("edit", chat_of(update), i + 1)] = i
+            self.updates.append(update)
+        self.sent = [None] * len(stream)
+        self.last_call = [None] * len(stream)
+        self.last_activity = time.perf_counter()
+
+    def inject(self, i: int):
+        self.sent[i] = time.perf_counter()
+        if "callback_query" not in self.updates[i]:
+            self.waiting_chats.setdefault(chat_of(self.updates[i]), []).append(i)
+
+    def on_call(self, method: str, params: dict, now: float):
+        self.last_activity = now
+        i = None
+        if method == "answerCallbackQuery":
+            i = self.by_key.get(("query", str(params.get("callback_query_id"))))
+        elif method == "editMessageText":
+            i = self.by_key.get(("edit", params.get("chat_id"), params.get("message_id")))
+        elif method in SEND_METHODS:
+            waiting = self.waiting_chats.get(params.get("chat_id"))
+            if waiting:
+                i = waiting.pop(0)
+        if i is not None:
+            self.last_call[i] = now
+
+    async def wait(self, quiet: float = 0.5, timeout: float = 120.0):
+        """Waits until every update has had a reply and the bot has gone quiet."""
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            now = time.perf_counter()
+            if None not in self.sent and now - self.last_activity > quiet and \
+                    all(t is not None for t, s in zip(self.last_call, self.sent) if s is not None):
+                return
+            await asyncio.sleep(0.05)
+
+    def results(self) -> dict:
+        latencies = [done - sent for sent, done in zip(self.sent, self.last_call) if done is not None]
+        if not latencies:
+            return {"updates": len(self.updates), "answered": 0}
+        first, last = min(self.sent), max(t for t in self.last_call if t is not None)
+        q = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        return {
+            "updates": len(self.updates),
+            "answered": len(latencies),
+            "throughput": len(latencies) / (last - first),
+            "p50_ms": q[49] * 1e3,
+            "p99_ms": q[98] * 1e3,
+            "max_ms": max(latencies) * 1e3,
+        }
+
+
+async def serve(app, port: int) -> tuple:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="on", log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def stop(server, task):
+    server.should_exit = True
+    await task
+
+
+class Driver(threading.Thread):
+    """Event loop in its own thread for the fake Telegram server and the update injector.
+
+    Keeping them off the bot's loop means HTTP parsing and retries on the
+    harness side do not queue up behind the bot's handlers. Otherwise
+    webhook mode, which makes one request per update, would be penalised.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def call(self, coro):
+        """Runs `coro` on the driver loop and waits for it without blocking the caller's loop."""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.join()
+        self.loop.close()
+
+
+async def replay(tracker: Tracker, inject, rate: float):
+    """Injects the tracker's updates at `rate` per second, then waits for the bot to answer them all."""
+    posts = []
+    start = time.perf_counter()
+    for i, update in enumerate(tracker.updates):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tracker.inject(i)
+        posts.append(asyncio.create_task(inject(update)))
+    await asyncio.gather(*posts)
+    await tracker.wait()
+
+
+async def run_mode(main, mode: str, stream: list, rate: float, concurrency: int, max_pending: int) -> dict:
+    from render_cache import RenderCache
+    from webhook import WebhookServer
+
+    main.render_cache = RenderCache(main.render_cache.capacity)  # Each mode starts cold
+    tracker = Tracker(stream)
+    fake = FakeTelegram(on_call=tracker.on_call)
+    driver = Driver()
+    driver.start()
+    fake_port = free_port()
+    fake_server = await driver.call(serve(fake, fake_port))
+    application = main.build_application("123:fake", f"http://127.0.0.1:{fake_port}/bot", concurrency)
+    rejected = 0
+
+    if mode == "polling":
+        await application.initialize()
+        await application.start()
+        await application.updater.start_polling(poll_interval=0.0, timeout=10)
+
+        async def inject(update):
+            fake.push_update(update)
+
+        await driver.call(replay(tracker, inject, rate))
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+    else:
+        hook = WebhookServer(application, path="/telegram", workers=concurrency, max_pending=max_pending)
+        hook_port = free_port()
+        hook_server = await serve(hook, hook_port)
+
+        async def inject(update):
+            nonlocal rejected
+            # Like Telegram: keep redelivering until the webhook accepts it
+            while (await client.post("/telegram", json=update)).status_code == 503:
+                rejected += 1
+                await asyncio.sleep(RETRY_DELAY)
+
+        async def run():
+            nonlocal client
+            client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{hook_port}",
+                                       limits=httpx.Limits(max_connections=concurrency * 4))
+            async with client:
+                await replay(tracker, inject, rate)
+
+        client = None
+        await driver.call(run())
+        await stop(*hook_server)
+
+    await driver.call(stop(*fake_server))
+    driver.close()
+    return dict(tracker.results(), rejected=rejected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--updates", help="JSONL file of recorded updates (see RECORD_UPDATES)")
+    source.add_argument("--generate", type=int, default=3000, help="number of synthetic folder-browsing clicks")
+    parser.add_argument("--mode", choices=["polling", "webhook", "both"], default="both")
+    parser.add_argument("--rate", type=float, default=1000, help="updates injected per second")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-pending", type=int, default=256)
+    args = parser.parse_args()
+
+    updates = os.path.abspath(args.updates) if args.updates else None
+    sys.path.insert(0, os.getcwd())
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)  # main.py opens its databases in the working directory
+        try:
+            import main as bot
+            logging.getLogger().setLevel(logging.WARNING)  # Per-request logging would dominate the timings
+            codes = populate(bot)
+            stream = load_stream(updates) if updates else generate_stream(bot, codes, args.generate, random.Random(1))
+            # Recorded streams may come from chats this fresh database has never seen
+            for update in stream:
+                chat_id = chat_of(update)
+                if chat_id is not None:
+                    bot.user_manager.register(chat_id, f"user{chat_id}")
+
+            modes = ["polling", "webhook"] if args.mode == "both" else [args.mode]
+            print(f"{len(stream)} updates at {args.rate:g}/s, concurrency {args.concurrency}, "
+                  f"webhook queue limit {args.max_pending}")
+            print(f"{'mode':>8} {'answered':>9} {'upd/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'503s':>6}")
+            for mode in modes:
+                r = asyncio.run(run_mode(bot, mode, stream, args.rate, args.concurrency, args.max_pending))
+                if not r["answered"]:
+                    print(f"{mode:>8} {0:>9}")
+                    continue
+                print(f"{mode:>8} {r['answered']:>9} {r['throughput']:>8.0f} {r['p50_ms']:>8.1f} "
+                      f"{r['p99_ms']:>8.1f} {r['max_ms']:>8.1f} {r['rejected']:>6}")
+            bot.storage.shutdown()
+            bot.user_manager.close()
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
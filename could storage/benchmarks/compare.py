@@ -0,0 +1,70 @@
+"""Compares two benchmark results files operation by operation.
+
+    python -m benchmarks.compare baseline.json candidate.json
+    python -m benchmarks.compare baseline.json candidate.json --metric p95_ms --threshold 20
+
+Prints the change of --metric for every operation in both files. Exits with
+status 1 when an operation got slower by more than --threshold percent, so
+the comparison can gate a CI job. Operations with fewer than --min-samples
+samples (one-off timings such as opening the databases) are listed but
+never fail the comparison, as they are too noisy. Neither do changes below
+--min-change-ms, since microsecond operations swing by tens of percent
+between identical runs.
+"""
+import argparse
+import sys
+
+from benchmarks import results
+
+METRICS = ("mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+
+
+def compare(baseline: dict, candidate: dict, metric: str, threshold: float, min_samples: int,
+            min_change_ms: float = 0.0) -> list:
+    """Rows of (benchmark, operation, old, new, change %, verdict) for operations present in both."""
+    rows = []
+    for bench in sorted(set(baseline["benchmarks"]) & set(candidate["benchmarks"])):
+        old_ops, new_ops = baseline["benchmarks"][bench], candidate["benchmarks"][bench]
+        for operation in sorted(set(old_ops) & set(new_ops)):
+            old, new = old_ops[operation][metric], new_ops[operation][metric]
+            change = (new - old) / old * 100 if old else 0.0
+            verdict = ""
+            if abs(change) > threshold and abs(new - old) >= min_change_ms:
+                if min(old_ops[operation]["n"], new_ops[operation]["n"]) < min_samples:
+                    verdict = "(noisy)"
+                else:
+                    verdict = "SLOWER" if change > 0 else "faster"
+            rows.append((bench, operation, old, new, change, verdict))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--metric", choices=METRICS, default="p50_ms")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change that counts")
+    parser.add_argument("--min-samples", type=int, default=10)
+    parser.add_argument("--min-change-ms", type=float, default=0.05, help="smallest absolute change that counts")
+    args = parser.parse_args()
+
+    baseline, candidate = results.load(args.baseline), results.load(args.candidate)
+    for label, data in (("baseline", baseline), ("candidate", candidate)):
+        env = data["environment"]
+        dirty = " (uncommitted changes)" if env.get("dirty") else ""
+        print(f"{label:>9}: commit {env.get('commit')}{dirty}, Python {env['python']}, {env['cpus']} CPUs, {env['time']}")
+    if baseline["dataset"] != candidate["dataset"]:
+        print("Warning: the results come from different datasets", file=sys.stderr)
+
+    rows = compare(baseline, candidate, args.metric, args.threshold, args.min_samples, args.min_change_ms)
+    print(f"\n{'benchmark':<9} {'operation':<28} {'old ' + args.metric:>12} {'new ' + args.metric:>12} {'change':>8}")
+    for bench, operation, old, new, change, verdict in rows:
+        print(f"{bench:<9} {operation:<28} {old:>12.3f} {new:>12.3f} {change:>+7.1f}% {verdict}")
+    slower = [row for row in rows if row[5] == "SLOWER"]
+    if slower:
+        print(f"\n{len(slower)} operation(s) slower by more than {args.threshold:g}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
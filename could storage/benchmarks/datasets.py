@@ -0,0 +1,140 @@
+"""Synthetic file_db.json / users.json datasets for the benchmark suite.
+
+The files use the formats the managers read on first start: FileManager
+imports file_db.json into SQLite and UserManager loads users.json as its
+snapshot. The same arguments and seed always produce the same bytes, so two
+commits benchmarked on the same dataset see the same data. Run from the
+`could storage` directory:
+
+    python -m benchmarks.datasets --scale medium --out /tmp/medium
+    python -m benchmarks.datasets --users 5000 --files-per-user 200 --folders-per-user 20 --out /tmp/big
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import string
+
+from folder_tree import FolderTree
+
+# name -> (users, files per user, folders per user)
+SCALES = {
+    "small": (100, 50, 5),
+    "medium": (1000, 100, 10),
+    "large": (10000, 100, 10),
+}
+MANIFEST = "dataset.json"
+DATA_FILES = ("file_db.json", "users.json")
+FIRST_USER_ID = 100000  # user n has ID FIRST_USER_ID + n; the first one is an admin
+WORDS = ("report invoice photo scan holiday budget draft notes contract receipt lecture slides backup "
+         "resume meeting project summary final review plan").split()
+EXTENSIONS = (".pdf", ".jpg", ".png", ".docx", ".txt", ".mp4", ".zip", ".xlsx")
+
+
+def folder_paths(rng: random.Random, count: int) -> list:
+    """`count` folder paths; about a third are nested one level below another folder."""
+    paths = []
+    for i in range(count):
+        top = [path for path in paths if path.count("/") == 1]
+        if top and rng.random() < 0.3:
+            paths.append(f"{rng.choice(top)}/sub{i}")
+        else:
+            paths.append(f"/dir{i}")
+    return paths
+
+
+def file_name(rng: random.Random) -> str:
+    return "_".join(rng.sample(WORDS, rng.randint(1, 3))) + f"_{rng.randrange(1000)}" + rng.choice(EXTENSIONS)
+
+
+def generate(out_dir: str, users: int, files_per_user: int, folders_per_user: int, seed: int = 0) -> dict:
+    """Writes file_db.json, users.json and a manifest into `out_dir`; returns the manifest."""
+    rng = random.Random(seed)
+    files, user_db = {}, {}
+    for n in range(users):
+        uid = FIRST_USER_ID + n
+        folders = folder_paths(rng, folders_per_user)
+        tree = FolderTree()
+        for path in folders:
+            tree.add(path)
+        user_db[str(uid)] = {"username": f"user{n}", "web_password": f"pw{n}", "current_folder": "/",
+                             "folders": tree.to_json(), "is_admin": n == 0}
+        for _ in range(files_per_user):
+            code = "".join(rng.choices(string.ascii_uppercase + string.digits, k=6))
+            while code in files:
+                code = "".join(rng.choices(string.ascii_uppercase + string.digits, k=6))
+            name = file_name(rng)
+            sha256 = f"{rng.getrandbits(256):064x}"
+            files[code] = {
+                "path": f"downloads/blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}",
+                "owner_id": uid,
+                "name": name,
+                "folder": rng.choice(["/"] + folders),
+                "uploaded_at": 1_700_000_000 - rng.randrange(365 * 86400),
+                "sha256": sha256,
+                "size": int(rng.lognormvariate(12, 2)),
+                "file_name": name,
+            }
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "file_db.json"), "w") as f:
+        json.dump(files, f)
+    with open(os.path.join(out_dir, "users.json"), "w") as f:
+        json.dump(user_db, f)
+    manifest = {"users": users, "files_per_user": files_per_user, "folders_per_user": folders_per_user,
+                "seed": seed, "files": len(files)}
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(dataset_dir: str) -> dict:
+    with open(os.path.join(dataset_dir, MANIFEST)) as f:
+        return json.load(f)
+
+
+def install(dataset_dir: str, work_dir: str):
+    """Copies the dataset into `work_dir`, where the managers will open it as if on first start."""
+    for name in DATA_FILES:
+        shutil.copyfile(os.path.join(dataset_dir, name), os.path.join(work_dir, name))
+
+
+def user_ids(manifest: dict) -> list:
+    return [FIRST_USER_ID + n for n in range(manifest["users"])]
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """--dataset, or --scale/--seed to generate one; see from_arguments."""
+    parser.add_argument("--dataset", help="directory written by benchmarks.datasets (default: generate one)")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small", help="size of a generated dataset")
+    parser.add_argument("--seed", type=int, default=0, help="seed of a generated dataset and of the operations")
+
+
+def from_arguments(args, tmp_dir: str) -> str:
+    """The --dataset directory, or a dataset generated into `tmp_dir` at --scale."""
+    if args.dataset:
+        return os.path.abspath(args.dataset)
+    path = os.path.join(tmp_dir, "dataset")
+    generate(path, *SCALES[args.scale], seed=args.seed)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", required=True, help="directory to write the dataset to")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--users", type=int, help="overrides the scale's user count")
+    parser.add_argument("--files-per-user", type=int)
+    parser.add_argument("--folders-per-user", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    users, files_per_user, folders_per_user = SCALES[args.scale]
+    manifest = generate(args.out, args.users or users, args.files_per_user or files_per_user,
+                        args.folders_per_user or folders_per_user, args.seed)
+    print(f"{manifest['users']} users, {manifest['files']} files in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
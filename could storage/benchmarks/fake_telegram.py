@@ -0,0 +1,184 @@
+"""Minimal stand-in for the Telegram Bot API, for running the bot locally without Telegram.
+
+Point the bot at it with `TELEGRAM_API_URL=http://127.0.0.1:<port>/bot`. It
+answers the methods the bot uses with plausible objects, serves queued
+updates to getUpdates (long polling) and file downloads, and records every
+call so a test or benchmark can see what the bot sent and when. FakeRequest
+plugs the same fake into PTB directly, without HTTP in between.
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import time
+from typing import Callable, Optional
+from urllib.parse import parse_qsl
+
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+SEND_METHODS = {"sendMessage", "sendDocument", "sendPhoto", "sendVideo", "sendAudio", "sendVoice", "sendAnimation"}
+
+
+class FakeTelegram:
+    """ASGI app implementing the handful of Bot API methods the bot calls."""
+
+    def __init__(self, on_call: Optional[Callable[[str, dict, float], None]] = None, file_size: int = 64 * 1024):
+        self.on_call = on_call  # called as on_call(method, params, timestamp) for every request
+        self.file_size = file_size  # bytes served for every file download
+        self.calls = []
+        self.webhook_url = None
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000)
+        self._file_ids = itertools.count(1)
+        self._new_updates = None
+
+    def push_update(self, update: dict):
+        """Queues an update for getUpdates; fills in update_id if missing."""
+        update.setdefault("update_id", next(self._update_ids))
+        self._updates.append(update)
+        if self._new_updates is not None:
+            self._new_updates.set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    self._new_updates = asyncio.Event()
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        if scope["path"].startswith("/file/"):
+            payload, content_type = self.file_content(scope["path"]), b"application/octet-stream"
+        else:
+            method = scope["path"].rsplit("/", 1)[-1]
+            payload = await self.handle(method, self._parse(dict(scope["headers"]).get(b"content-type", b""), body))
+            content_type = b"application/json"
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", content_type), (b"content-length", str(len(payload)).encode())]})
+        await send({"type": "http.response.body", "body": payload})
+
+    async def handle(self, method: str, params: dict) -> bytes:
+        """Records one Bot API call and returns the JSON response body."""
+        now = time.perf_counter()
+        self.calls.append((method, params, now))
+        if self.on_call:
+            self.on_call(method, params, now)
+        result = await self._dispatch(method, params)
+        return json.dumps({"ok": True, "result": result}).encode()
+
+    def file_content(self, path: str) -> bytes:
+        """`file_size` bytes derived from the path, so each file has its own content."""
+        seed = hashlib.sha256(path.encode()).digest()
+        return (seed * (self.file_size // len(seed) + 1))[:self.file_size]
+
+    @staticmethod
+    def _parse(content_type: bytes, body: bytes) -> dict:
+        if content_type.startswith(b"multipart/"):
+            return {}  # File uploads; the bot's parameters are not needed for them
+        if content_type.startswith(b"application/json"):
+            return json.loads(body or b"{}")
+        params = {}
+        # The bot sends form fields holding JSON values (plain strings are sent as-is)
+        for key, value in parse_qsl(body.decode()):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    def _message(self, params: dict, message_id: Optional[int] = None) -> dict:
+        return {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": params.get("chat_id", 0), "type": "private"},
+            "from": BOT_USER,
+            "text": str(params.get("text", "")),
+        }
+
+    async def _dispatch(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "setWebhook":
+            self.webhook_url = params.get("url")
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+        if method == "getFile":
+            file_id = str(params.get("file_id"))
+            return {"file_id": file_id, "file_unique_id": f"unique-{file_id}", "file_size": self.file_size,
+                    "file_path": f"documents/{file_id}"}
+        if method == "editMessageText":
+            return self._message(params, params.get("message_id"))
+        if method in SEND_METHODS:
+            message = self._message(params)
+            if method != "sendMessage":
+                n = next(self._file_ids)
+                message["document"] = {"file_id": f"fake-file-{n}", "file_unique_id": f"fake-unique-{n}"}
+            return message
+        return True  # answerCallbackQuery and anything else the bot only needs acknowledged
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = params.get("offset") or 0
+        limit = params.get("limit") or 100
+        timeout = params.get("timeout") or 0
+        # Confirmed updates (id < offset) are gone for good
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+
+class FakeRequest(BaseRequest):
+    """PTB request backend answering every call from a FakeTelegram in the same process.
+
+    Pass it to ApplicationBuilder().request(...) (main.build_application's
+    `request`) to run the real handlers with no network or HTTP parsing, so
+    a benchmark measures the bot's own work.
+    """
+
+    def __init__(self, fake: FakeTelegram):
+        self.fake = fake
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs) -> tuple:
+        if "/file/" in url:  # File.download_* fetches base_file_url + path
+            return 200, self.fake.file_content("/file/" + url.split("/file/", 1)[1])
+        params = {}
+        if request_data is not None:
+            # Same decoding as the form-encoded requests the ASGI side receives
+            for key, value in request_data.json_parameters.items():
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+        return 200, await self.fake.handle(url.rsplit("/", 1)[-1], params)
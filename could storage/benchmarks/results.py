@@ -0,0 +1,91 @@
+"""Latency statistics and the JSON result files the benchmark suite writes and compares."""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+
+class Recorder:
+    """Collects latencies per operation name."""
+
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, name: str, seconds: float):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def measure(self, name: str, fn, *args, **kwargs):
+        """Calls fn(*args, **kwargs), records its duration under `name` and returns its result."""
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.add(name, time.perf_counter() - start)
+        return result
+
+    async def measure_async(self, name: str, coro):
+        start = time.perf_counter()
+        result = await coro
+        self.add(name, time.perf_counter() - start)
+        return result
+
+    def summary(self) -> dict:
+        """{name: statistics in milliseconds} for every operation recorded."""
+        return {name: summarize(samples) for name, samples in sorted(self.samples.items())}
+
+
+def summarize(samples: list) -> dict:
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1e3
+
+    total = sum(ordered)
+    return {
+        "n": len(ordered),
+        "mean_ms": total / len(ordered) * 1e3,
+        "p50_ms": statistics.median(ordered) * 1e3,
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": ordered[-1] * 1e3,
+        "ops_per_s": len(ordered) / total if total else 0.0,
+    }
+
+
+def environment() -> dict:
+    """Where the numbers came from: commit, interpreter and machine."""
+    env = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    source_dir = os.path.dirname(os.path.abspath(__file__))  # Benchmarks run from temporary directories
+    try:
+        env["commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=source_dir, capture_output=True,
+                                       text=True, check=True).stdout.strip()
+        env["dirty"] = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=source_dir,
+                                           capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        env["commit"] = None
+    return env
+
+
+def save(path: str, benchmarks: dict, dataset: dict):
+    """Writes {"environment", "dataset", "benchmarks": {bench: {operation: stats}}} to `path`."""
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "dataset": dataset, "benchmarks": benchmarks}, f, indent=2)
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def print_summary(name: str, summary: dict, out=sys.stdout):
+    print(f"\n{name}", file=out)
+    print(f"{'operation':<28} {'n':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}", file=out)
+    for operation, stats in summary.items():
+        print(f"{operation:<28} {stats['n']:>6} {stats['mean_ms']:>9.3f} {stats['p50_ms']:>9.3f} "
+              f"{stats['p95_ms']:>9.3f} {stats['p99_ms']:>9.3f}", file=out)
@@ -0,0 +1,52 @@
+"""Runs the storage, bot and web benchmarks on one dataset and writes one results file.
+
+Each benchmark runs in its own process, so the module-level state of
+main.py and app.py never carries over from one to the next. Keep the
+results of each commit to compare them later. Run from the `could storage`
+directory:
+
+    python -m benchmarks.suite --scale medium --output results-$(git rev-parse --short HEAD).json
+    python -m benchmarks.compare results-<old>.json results-<new>.json
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import datasets, results
+
+BENCHMARKS = {
+    "storage": "benchmarks.bench_storage",
+    "bot": "benchmarks.bench_bot",
+    "web": "benchmarks.bench_web",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    datasets.add_arguments(parser)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--ops", type=int, help="passed to every benchmark (default: each benchmark's own)")
+    parser.add_argument("--output", default="benchmark-results.json", help="JSON file to write")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_dir = datasets.from_arguments(args, tmp)
+        manifest = datasets.load_manifest(dataset_dir)
+        print(f"Dataset: {manifest['users']} users, {manifest['files']} files")
+        benchmarks = {}
+        for name in args.only:
+            part = os.path.join(tmp, f"{name}.json")
+            command = [sys.executable, "-m", BENCHMARKS[name], "--dataset", dataset_dir, "--seed", str(args.seed),
+                       "--output", part]
+            if args.ops:
+                command += ["--ops", str(args.ops)]
+            subprocess.run(command, check=True)
+            benchmarks[name] = results.load(part)["benchmarks"][name]
+    results.save(args.output, benchmarks, manifest)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable
+from utils import DOWNLOAD_DIR
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = DOWNLOAD_DIR / "blobs"
+# Held while a blob is committed or reaped, so a new upload of the same content and the
+# unlink of its old copy cannot interleave (shared by every BlobStore in the process)
+blob_lock = threading.Lock()
+DIGEST = re.compile(r"[0-9a-f]{64}")
+
+
+class HashingWriter:
+    """File-like wrapper that hashes and counts bytes as they are written."""
+
+    def __init__(self, f):
+        self._f = f
+        self._hasher = hashlib.sha256()
+        self.size = 0
+        self.path = None  # Set to the blob path once committed
+
+    def write(self, data) -> int:
+        self._hasher.update(data)
+        self.size += len(data)
+        return self._f.write(data)
+
+    def flush(self):
+        self._f.flush()
+
+    def hexdigest(self) -> str:
+        return self._hasher.hexdigest()
+
+
+class BlobStore:
+    """Content-addressed file storage: blobs/<ab>/<cd>/<sha256>.
+
+    Identical content is stored once. Deciding when a blob is no longer
+    referenced is up to FileManager, which counts records per path.
+    """
+
+    def __init__(self, root: Path = BLOB_DIR):
+        self.root = Path(root)
+        self.tmp_dir = self.root / "tmp"
+
+    def path_for(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def _temp_path(self) -> Path:
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        return self.tmp_dir / uuid.uuid4().hex
+
+    def commit(self, tmp_path: Path, digest: str) -> Path:
+        """Moves a fully written temp file into place, or drops it if the blob already exists."""
+        path = self.path_for(digest)
+        with blob_lock:
+            if path.exists():
+                os.remove(tmp_path)
+                # Its record is not saved yet; the new mtime keeps BlobReaper from removing the blob meanwhile
+                os.utime(path)
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, path)
+        return path
+
+    @contextmanager
+    def ingest(self):
+        """Yields a HashingWriter over a temp file; on success the data becomes a blob at `writer.path`.
+
+        The hash is computed while the data streams in, so no second read pass is needed.
+        """
+        tmp_path = self._temp_path()
+        try:
+            with open(tmp_path, "wb") as f:
+                writer = HashingWriter(f)
+                yield writer
+            writer.path = self.commit(tmp_path, writer.hexdigest())
+        finally:
+            if tmp_path.exists():
+                os.remove(tmp_path)
+
+
+class BlobReaper:
+    """Removes files that no record references any more, on a background thread.
+
+    Deleting records then costs only the metadata commit, and the user gets
+    an answer before the files are gone. Right before removing a file the
+    reaper asks `in_use(path)` again, as a new record may point at the same
+    blob by now. Files modified less than `grace` seconds ago are retried
+    later: BlobStore.commit touches an existing blob when new content
+    matches it, before that upload's record is saved.
+
+    Deferred files are still on disk when the process stops, as are any a
+    crash interrupted; sweep() at start-up checks every blob and picks them up.
+    """
+
+    def __init__(self, in_use: Callable[[str], bool], grace: float = 60.0):
+        self.in_use = in_use
+        self.grace = grace
+        self.removed = 0
+        self._queue = queue.Queue()
+        self._deferred = {}  # path -> time to retry
+        self._thread = threading.Thread(target=self._run, daemon=True, name="blob-reaper")
+        self._thread.start()
+
+    def submit(self, paths: Iterable[str]):
+        for path in paths:
+            self._queue.put(path)
+
+    def sweep(self, root: Path = BLOB_DIR):
+        """Checks every blob under `root` in the background, removing those no record references."""
+        self._queue.put(Path(root))
+
+    def drain(self):
+        """Waits until every submitted file has been handled (deferred ones count as handled)."""
+        self._queue.join()
+
+    def close(self):
+        """Handles what was submitted and stops the thread; deferred files are left for the next sweep()."""
+        self._queue.put(None)
+        self._thread.join()
+        if self._deferred:
+            logger.info("Leaving %d recently used files for the next start's sweep", len(self._deferred))
+
+    def _run(self):
+        while True:
+            # Sleep until the next deferred file is due, or a new one arrives
+            timeout = max(0.0, min(self._deferred.values()) - time.time()) if self._deferred else None
+            try:
+                path = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                path = ""
+            now = time.time()
+            for due in [p for p, at in self._deferred.items() if at <= now]:
+                del self._deferred[due]
+                self._reap(due)
+            if path is None:
+                self._queue.task_done()
+                return
+            if isinstance(path, Path):
+                self._sweep(path)
+                self._queue.task_done()
+            elif path:
+                self._reap(path)
+                self._queue.task_done()
+
+    def _sweep(self, root: Path):
+        removed = self.removed
+        # Same layout and path strings as BlobStore.path_for, so they match the paths in records;
+        # a record written with an absolute path (as the download benchmark does) counts as well
+        for path in root.glob("??/??/*"):
+            if not (DIGEST.fullmatch(path.name) and path.parent.parent.name + path.parent.name == path.name[:4]):
+                continue
+            if not (self.in_use(os.path.abspath(path)) or self.in_use(str(path.resolve()))):
+                self._reap(str(path))
+        if self.removed > removed:
+            logger.info("Removed %d unreferenced files from %s", self.removed - removed, root)
+
+    def _reap(self, path: str):
+        with blob_lock:
+            if self.in_use(path):
+                return
+            try:
+                modified = os.stat(path).st_mtime
+                if time.time() - modified < self.grace:
+                    self._deferred[path] = modified + self.grace
+                    return
+                os.remove(path)
+                self.removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logger.exception("Could not remove %s", path)
@@ -0,0 +1,120 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+MAX_CALLBACK_BYTES = 64  # Telegram's limit for callback_data
+TOKEN_MARK = "~"
+
+
+class CallbackExpired(Exception):
+    """The button's argument was stored server-side and has since been evicted."""
+
+
+class TokenCache:
+    """Short-lived server-side store for callback arguments too long to fit in callback_data.
+
+    Holds at most `capacity` values for up to `ttl` seconds each, evicting the
+    least recently used first. The same value always maps to the same live
+    token, so re-rendering a keyboard does not fill the cache. Keyboards are
+    built on the storage thread and decoded on the event loop, so every
+    access holds a lock.
+    """
+
+    def __init__(self, capacity: int = 10000, ttl: float = 24 * 3600):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._items = OrderedDict()  # token -> (value, expires at)
+        self._tokens = {}            # value -> token
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def put(self, value: str) -> str:
+        with self._lock:
+            token = self._tokens.get(value)
+            if token is None:
+                token = secrets.token_urlsafe(6)
+                self._tokens[value] = token
+            self._items[token] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(token)
+            while len(self._items) > self.capacity:
+                self._evict()
+            return token
+
+    def get(self, token: str) -> Optional[str]:
+        with self._lock:
+            item = self._items.get(token)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                self._evict(token)
+                return None
+            self._items.move_to_end(token)
+            return value
+
+    def _evict(self, token: Optional[str] = None):
+        # Called with the lock held
+        if token is None:
+            token, (value, _) = self._items.popitem(last=False)
+        else:
+            value, _ = self._items.pop(token)
+        del self._tokens[value]
+
+
+class CallbackCodec:
+    """Compact callback_data: a one-character opcode followed by the argument.
+
+    Arguments that would push the payload past Telegram's 64-byte limit (or
+    that start with the token mark) are swapped for a short token from a
+    TokenCache. Data that does not start with a known opcode is read in the
+    old `<action>:<argument>` form, so buttons on messages sent before the
+    switch keep working.
+    """
+
+    def __init__(self, opcodes: dict, cache: Optional[TokenCache] = None):
+        self.opcodes = opcodes  # action -> opcode character
+        self.actions = {opcode: action for action, opcode in opcodes.items()}
+        self.cache = cache or TokenCache()
+
+    def encode(self, action: str, arg=None) -> str:
+        opcode = self.opcodes[action]
+        if arg is None:
+            return opcode
+        arg = str(arg)
+        data = opcode + arg
+        if arg.startswith(TOKEN_MARK) or len(data.encode("utf-8")) > MAX_CALLBACK_BYTES:
+            data = opcode + TOKEN_MARK + self.cache.put(arg)
+        return data
+
+    def uses_token(self, data: str) -> bool:
+        return len(data) > 1 and data[1] == TOKEN_MARK and data[0] in self.actions
+
+    def is_live(self, data: str) -> bool:
+        """False if `data` refers to a token that is no longer cached (keeps a live one from being evicted)."""
+        return not self.uses_token(data) or self.cache.get(data[2:]) is not None
+
+    def decode(self, data: str) -> Optional[tuple]:
+        """Returns (action, argument or None), or None if the data is not recognised.
+
+        Raises CallbackExpired if the argument was a token that is no longer cached.
+        """
+        if not data:
+            return None
+        action = self.actions.get(data[0])
+        if action is None:
+            # Old style: "<action>" or "<action>:<argument>"
+            name, sep, arg = data.partition(":")
+            return (name, arg if sep else None) if name in self.opcodes else None
+        arg = data[1:]
+        if not arg:
+            return action, None
+        if arg.startswith(TOKEN_MARK):
+            arg = self.cache.get(arg[1:])
+            if arg is None:
+                raise CallbackExpired(data)
+        return action, arg
@@ -0,0 +1,64 @@
+import secrets
+import threading
+from collections import deque
+from typing import Optional
+
+
+class ChangeFeed:
+    """In-memory log of record changes, numbered by a monotonically increasing sequence.
+
+    Readers keep a cursor (`<epoch>:<seq>`) and ask for everything after it,
+    so the cost of catching up depends on how much changed, not on how many
+    records exist. Only the last `capacity` changes are kept; a cursor older
+    than that, or from an earlier process (a different epoch), gets None and
+    the reader has to start over from a full listing.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self._log = deque(maxlen=capacity)  # (seq, code, record or None when deleted)
+        self._cond = threading.Condition()
+
+    @property
+    def cursor(self) -> str:
+        return f"{self.epoch}:{self.seq}"
+
+    def publish(self, code: str, record: Optional[dict]):
+        with self._cond:
+            self.seq += 1
+            self._log.append((self.seq, code, record))
+            self._cond.notify_all()
+
+    def _parse(self, cursor: Optional[str]) -> Optional[int]:
+        epoch, _, seq = (cursor or "").partition(":")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        oldest = self._log[0][0] - 1 if self._log else self.seq
+        if not oldest <= seq <= self.seq:
+            return None
+        return seq
+
+    def since(self, cursor: Optional[str]) -> tuple:
+        """Returns (changes, new cursor); changes is None if the cursor cannot be served.
+
+        Changes are {code: record or None}, one entry per code holding its latest state.
+        """
+        with self._cond:
+            seq = self._parse(cursor)
+            if seq is None:
+                return None, self.cursor
+            changes = {}
+            # The log is ordered by seq, so walk back only as far as the cursor
+            for change_seq, code, record in reversed(self._log):
+                if change_seq <= seq:
+                    break
+                changes.setdefault(code, record)
+            return dict(reversed(changes.items())), self.cursor
+
+    def wait(self, cursor: Optional[str], timeout: float) -> bool:
+        """Blocks until something newer than `cursor` is published; False on timeout."""
+        with self._cond:
+            seq = self._parse(cursor)
+            return self._cond.wait_for(lambda: seq is None or self.seq > seq, timeout)
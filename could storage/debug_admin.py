@@ -3,7 +3,7 @@ import json
 
 um = UserManager()
 print("--- User Database Dump ---")
-print(json.dumps(um.db, indent=2))
+print(um.export_json(indent=2))
 
 admins = [uid for uid, data in um.db.items() if data.get("is_admin")]
 if admins:
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadScheduler:
+    """Runs attachment downloads in the background with bounded concurrency.
+
+    Every user gets their own FIFO queue and jobs are started round-robin
+    across users, so one user's burst of large files cannot hold up everyone
+    else. At most `max_concurrency` jobs run at once, and at most
+    `per_user_limit` of them for the same user.
+    """
+
+    def __init__(self, max_concurrency: int = 4, per_user_limit: int = 1):
+        self.max_concurrency = max_concurrency
+        self.per_user_limit = per_user_limit
+        self._queues = {}        # user_id -> deque of (job, future)
+        self._turns = deque()    # users with queued jobs, in round-robin order
+        self._active = {}        # user_id -> running job count
+        self._tasks = set()
+
+    @property
+    def queue_depth(self) -> int:
+        """Jobs waiting for a slot (not counting running ones)."""
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def running(self) -> int:
+        return len(self._tasks)
+
+    def pending_for(self, user_id: int) -> int:
+        return len(self._queues.get(user_id, ()))
+
+    def submit(self, user_id: int, job: Callable[[], Awaitable]) -> asyncio.Future:
+        """Queues `job` (a coroutine function) for `user_id`; returns a future for its result."""
+        future = asyncio.get_running_loop().create_future()
+        if user_id not in self._queues:
+            self._queues[user_id] = deque()
+            self._turns.append(user_id)
+        self._queues[user_id].append((job, future))
+        self._dispatch()
+        return future
+
+    def _dispatch(self):
+        skipped = 0
+        while self._turns and len(self._tasks) < self.max_concurrency and skipped < len(self._turns):
+            user_id = self._turns[0]
+            self._turns.rotate(-1)
+            if self._active.get(user_id, 0) >= self.per_user_limit:
+                skipped += 1
+                continue
+            skipped = 0
+            queue = self._queues[user_id]
+            job, future = queue.popleft()
+            if not queue:
+                del self._queues[user_id]
+                self._turns.remove(user_id)
+            self._start(user_id, job, future)
+
+    def _start(self, user_id: int, job: Callable[[], Awaitable], future: asyncio.Future):
+        self._active[user_id] = self._active.get(user_id, 0) + 1
+        task = asyncio.create_task(self._run(user_id, job, future))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, user_id: int, job: Callable[[], Awaitable], future: asyncio.Future):
+        try:
+            result = await job()
+        except Exception as e:
+            logger.exception("Download job for user %s failed", user_id)
+            if not future.done():
+                future.set_exception(e)
+                # Already logged above; callers that never await the future should not get it logged again
+                future.exception()
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self._active[user_id] -= 1
+            if not self._active[user_id]:
+                del self._active[user_id]
+            # Our task is still counted in _tasks until this returns, so discard it before refilling slots
+            self._tasks.discard(asyncio.current_task())
+            self._dispatch()
@@ -0,0 +1,101 @@
+from bisect import bisect_left, insort
+from typing import Iterator
+
+
+class FileIndex:
+    """In-memory secondary indexes over FileManager records.
+
+    Buckets are dicts used as insertion-ordered sets, so listings come back in
+    the same order the old full scan produced.
+    """
+
+    def __init__(self):
+        self.by_owner = {}     # owner_id -> {code: None}
+        self.by_folder = {}    # (owner_id, folder) -> {code: None}
+        self.folders = {}      # owner_id -> sorted list of folders holding at least one file
+        self.by_path = {}      # stored file path -> {code: None}; doubles as the file's reference count
+        self.by_unique_id = {}  # Telegram file_unique_id -> {code: None}
+
+    @staticmethod
+    def _path(record):
+        return record.get("path") if isinstance(record, dict) else record
+
+    def add(self, code: str, record):
+        path = self._path(record)
+        if path:
+            self.by_path.setdefault(path, {})[code] = None
+        if not isinstance(record, dict):
+            return  # Legacy string records have no owner or folder
+        unique_id = record.get("tg_unique_id")
+        if unique_id:
+            self.by_unique_id.setdefault(unique_id, {})[code] = None
+        owner = record.get("owner_id")
+        folder = record.get("folder", "/")
+        self.by_owner.setdefault(owner, {})[code] = None
+        bucket = self.by_folder.get((owner, folder))
+        if bucket is None:
+            bucket = self.by_folder[(owner, folder)] = {}
+            insort(self.folders.setdefault(owner, []), folder)
+        bucket[code] = None
+
+    def remove(self, code: str, record):
+        path = self._path(record)
+        refs = self.by_path.get(path)
+        if refs is not None:
+            refs.pop(code, None)
+            if not refs:
+                del self.by_path[path]
+        if not isinstance(record, dict):
+            return
+        unique_refs = self.by_unique_id.get(record.get("tg_unique_id"))
+        if unique_refs is not None:
+            unique_refs.pop(code, None)
+            if not unique_refs:
+                del self.by_unique_id[record["tg_unique_id"]]
+        owner = record.get("owner_id")
+        folder = record.get("folder", "/")
+        codes = self.by_owner.get(owner)
+        if codes is not None:
+            codes.pop(code, None)
+            if not codes:
+                del self.by_owner[owner]
+        bucket = self.by_folder.get((owner, folder))
+        if bucket is not None:
+            bucket.pop(code, None)
+            if not bucket:
+                del self.by_folder[(owner, folder)]
+                folders = self.folders[owner]
+                del folders[bisect_left(folders, folder)]
+                if not folders:
+                    del self.folders[owner]
+
+    def path_refs(self, path: str) -> int:
+        """Number of records pointing at a stored file."""
+        return len(self.by_path.get(path, ()))
+
+    def owner_codes(self, owner_id) -> list:
+        return list(self.by_owner.get(owner_id, ()))
+
+    def folder_codes(self, owner_id, folder: str) -> list:
+        return list(self.by_folder.get((owner_id, folder), ()))
+
+    def _subtree_folders(self, owner_id, folder: str) -> Iterator[str]:
+        folders = self.folders.get(owner_id, [])
+        if folder == "/":
+            yield from folders
+            return
+        if (owner_id, folder) in self.by_folder:
+            yield folder
+        # Every descendant sorts contiguously after "<folder>/"
+        prefix = folder + "/"
+        for i in range(bisect_left(folders, prefix), len(folders)):
+            if not folders[i].startswith(prefix):
+                break
+            yield folders[i]
+
+    def subtree_codes(self, owner_id, folder: str) -> list:
+        """Codes in `folder` and all of its subfolders."""
+        codes = []
+        for f in list(self._subtree_folders(owner_id, folder)):
+            codes.extend(self.by_folder[(owner_id, f)])
+        return codes
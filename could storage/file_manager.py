@@ -1,28 +1,186 @@
-import json
+import hashlib
+import itertools
 import random
 import string
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Optional
+from metadata_store import MetadataStore, SQLiteMetadataStore, migrate_json_to_sqlite
+from file_index import FileIndex
+from search_index import NgramIndex
+from change_feed import ChangeFeed
+from sorted_index import SortedViews
+from blob_store import BlobReaper
+import metrics
 
 DB_FILE = Path("file_db.json")
 
+# Sort orders for list_files; records from before upload times and sizes were stored sort first
+SORT_KEYS = {
+    "name": lambda record: record.get("name", "").lower(),
+    "uploaded": lambda record: record.get("uploaded_at", 0),
+    "size": lambda record: record.get("size", -1),
+}
+
 class FileManager:
-    def __init__(self):
-        self.db = self._load_db()
+    def __init__(self, store: Optional[MetadataStore] = None, background: bool = True):
+        self.store = store or self._open_default_store()
+        # The bot's storage thread, web request threads and sync() may all touch the indexes
+        self._lock = threading.RLock()
+        # Unreferenced files are removed by the reaper thread, or inline without one
+        self.reaper = BlobReaper(self.is_path_referenced) if background else None
+        # Files from before hashes were recorded are hashed on demand, off the caller's thread when background
+        self._hasher = ThreadPoolExecutor(1, thread_name_prefix="content-hash") if background else None
+        self._hashing = set()
+        # While a batch() is open: (code, old record) to undo it, and the paths its deletes released
+        self._undo = None
+        self._released = None
+        # Read before loading, so a write that lands in between is applied (again) by the first sync()
+        self._synced = self.store.change_seq()
+        self.db = self.store.load_all()
+        self.index = FileIndex()
+        self.name_index = NgramIndex()
+        self.changes = ChangeFeed()
+        self.views = SortedViews(SORT_KEYS)
+        # (owner, folder) -> version, bumped whenever that folder's listing changes
+        self.folder_versions = {}
+        self._versions = itertools.count(1)
+        for code, record in self.db.items():
+            self._index_add(code, record)
+        if self.reaper is not None and store is None:
+            # Files an earlier run released but had not removed yet; only the default store describes BLOB_DIR
+            self.reaper.sweep()
+
+    @staticmethod
+    def _open_default_store() -> MetadataStore:
+        store = SQLiteMetadataStore()
+        # One-shot import of the old JSON database on first start
+        migrate_json_to_sqlite(DB_FILE, store)
+        return store
+
+    def _index_add(self, code: str, record):
+        self.index.add(code, record)
+        if isinstance(record, dict):
+            self.name_index.add(code, record.get("name", ""))
+            self.views.add(None, code, record)
+            self.views.add((record.get("owner_id"), record.get("folder", "/")), code, record)
+            self._bump(record)
+
+    def _index_remove(self, code: str, record):
+        self.index.remove(code, record)
+        self.name_index.remove(code)
+        if isinstance(record, dict):
+            self.views.remove(None, code, record)
+            self.views.remove((record.get("owner_id"), record.get("folder", "/")), code, record)
+            self._bump(record)
+
+    def _bump(self, record: dict):
+        # Versions come from one counter, so a folder that is emptied and refilled never repeats one
+        self.folder_versions[(record.get("owner_id"), record.get("folder", "/"))] = next(self._versions)
+
+    def folder_version(self, user_id: int, folder: str) -> int:
+        """Changes whenever a file is added to, changed in or removed from the folder."""
+        return self.folder_versions.get((user_id, folder), 0)
+
+    def _apply(self, code: str, record):
+        """Updates memory, the indexes and the change feed; a None record removes the code."""
+        old = self.db.get(code)
+        if old is not None:
+            self._index_remove(code, old)
+        if record is None:
+            self.db.pop(code, None)
+        else:
+            self.db[code] = record
+            self._index_add(code, record)
+        self.changes.publish(code, record)
+        if self._undo is not None:
+            self._undo.append((code, old))
+
+    def _put(self, code: str, record: dict):
+        """Writes a record to memory, the indexes and the store."""
+        with self._lock:
+            self._apply(code, record)
+            self.store.upsert(code, record)
+
+    def _drop(self, code: str):
+        with self._lock:
+            self._apply(code, None)
+            self.store.delete(code)
+
+    @contextmanager
+    def batch(self):
+        """Groups writes into one store commit; files the deletes released are removed after it.
+
+        If the block raises, the store rolls back and memory is restored to
+        match it. Nested batches join the outer one.
+        """
+        with self._lock:
+            if self._undo is not None:
+                yield
+                return
+            self._undo, self._released = [], []
+            try:
+                with self.store.transaction():
+                    yield
+            except BaseException:
+                for code, record in reversed(self._undo):
+                    self._apply(code, record)
+                self._released = []
+                raise
+            finally:
+                self._undo, released, self._released = None, self._released, None
+            self._reap(released)
 
-    def _load_db(self) -> dict:
-        if DB_FILE.exists():
+    def _reap(self, paths: list):
+        paths = [path for path in paths if not self.index.path_refs(path)]
+        if self.reaper is not None:
+            self.reaper.submit(paths)
+            return
+        for path in paths:
             try:
-                with open(DB_FILE, "r") as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                return {}
-        return {}
+                os.remove(path)
+            except OSError:
+                pass  # File might be gone already
 
-    def _save_db(self):
-        with open(DB_FILE, "w") as f:
-            json.dump(self.db, f, indent=4)
+    def is_path_referenced(self, path: str) -> bool:
+        """Whether any record still points at the stored file."""
+        with self._lock:
+            return bool(self.index.path_refs(path))
+
+    def close(self):
+        """Finishes pending file removals and closes the store."""
+        if self._hasher is not None:
+            self._hasher.shutdown(wait=True, cancel_futures=True)
+        if self.reaper is not None:
+            self.reaper.close()
+        self.store.close()
+
+    def sync(self) -> int:
+        """Applies writes other processes made to the store since the last sync; returns how many records changed.
+
+        Only the changed records are read back. Records that already match
+        memory, such as our own writes, are skipped.
+        """
+        with self._lock:
+            result = self.store.changes_since(self._synced)
+            if result is None:
+                # The store's change log no longer reaches back that far; compare every record instead
+                seq = self.store.change_seq()
+                changes = dict.fromkeys(self.db)
+                changes.update(self.store.load_all())
+            else:
+                changes, seq = result
+            changed = 0
+            for code, record in changes.items():
+                if record != self.db.get(code):
+                    self._apply(code, record)
+                    changed += 1
+            self._synced = seq
+            return changed
 
     def generate_code(self, length=6) -> str:
         """Generates a unique random code."""
@@ -31,16 +189,24 @@ class FileManager:
             if code not in self.db:
                 return code
 
-    def save_file_record(self, file_path: str, user_id: int, original_name: str, folder: str = "/") -> str:
-        """Saves file metadata and returns a unique code."""
+    def save_file_record(self, file_path: str, user_id: int, original_name: str, folder: str = "/", **attrs) -> str:
+        """Saves file metadata and returns a unique code.
+
+        Optional `attrs` are stored on the record when not None: sha256, size,
+        file_name (the name to download it as), and tg_unique_id / tg_file_id /
+        tg_kind for content that came from Telegram. Several records may point
+        at the same stored file (blobs are shared by content).
+        """
         code = self.generate_code()
-        self.db[code] = {
+        record = {
             "path": str(file_path),
             "owner_id": user_id,
             "name": original_name,
-            "folder": folder
+            "folder": folder,
+            "uploaded_at": time.time()
         }
-        self._save_db()
+        record.update((key, value) for key, value in attrs.items() if value is not None)
+        self._put(code, record)
         return code
 
     def get_file_path(self, code: str) -> Optional[str]:
@@ -51,41 +217,198 @@ class FileManager:
         # Fallback for old format (if any)
         return record if isinstance(record, str) else None
 
+    def get_file_record(self, code: str) -> Optional[dict]:
+        """Returns the metadata dict for a code (None for unknown or legacy records)."""
+        record = self.db.get(code.upper())
+        return record if isinstance(record, dict) else None
+
+    def find_by_unique_id(self, unique_id: str) -> Optional[dict]:
+        """Returns a record holding the same Telegram content (file_unique_id), if it is still on disk."""
+        for code in self.index.by_unique_id.get(unique_id, ()):
+            record = self.db[code]
+            if os.path.exists(record.get("path", "")):
+                return record
+        return None
+
+    def get_telegram_file(self, code: str) -> Optional[tuple]:
+        """Returns a cached (kind, file_id) that Telegram can resend without an upload."""
+        record = self.get_file_record(code)
+        if record is None:
+            return None
+        # Any record sharing the stored file can lend its file_id
+        for other in [code.upper(), *self.index.by_path.get(record.get("path"), ())]:
+            other_record = self.db[other]
+            if other_record.get("tg_file_id"):
+                return other_record.get("tg_kind", "document"), other_record["tg_file_id"]
+        return None
+
+    def set_telegram_file(self, code: str, kind: str, file_id: str):
+        """Remembers the Telegram file_id a stored file was last sent or received as."""
+        code = code.upper()
+        record = self.get_file_record(code)
+        if record is not None and record.get("tg_file_id") != file_id:
+            self._put(code, dict(record, tg_kind=kind, tg_file_id=file_id))
+
+    def get_download_name(self, code: str) -> Optional[str]:
+        """Returns the file name to use when sending a stored file back."""
+        record = self.db.get(code.upper())
+        if isinstance(record, dict):
+            return record.get("file_name") or os.path.basename(record.get("path", ""))
+        return os.path.basename(record) if isinstance(record, str) else None
+
+    def get_content_hash(self, code: str) -> Optional[str]:
+        """Returns the SHA-256 of the stored file, or None if it is unknown.
+
+        Records from before hashes were kept get theirs computed (once) on a
+        background thread the first time they are asked for; until it is
+        recorded this returns None, so no request waits on reading a large file.
+        """
+        code = code.upper()
+        record = self.get_file_record(code)
+        if record is None:
+            return None
+        if "sha256" in record:
+            return record["sha256"]
+        if self._hasher is None:
+            self._hash_file(code)
+            return (self.get_file_record(code) or {}).get("sha256")
+        with self._lock:
+            if code not in self._hashing:
+                self._hashing.add(code)
+                self._hasher.submit(self._hash_file, code)
+        return None
+
+    def _hash_file(self, code: str):
+        try:
+            record = self.get_file_record(code)
+            path = record.get("path") if record else None
+            if not path or "sha256" in record:
+                return
+            digest = hashlib.sha256()
+            try:
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(block)
+            except OSError:
+                return
+            with self._lock:
+                # Recorded only if the record still points at the file that was read
+                current = self.get_file_record(code)
+                if current is not None and current.get("path") == path and "sha256" not in current:
+                    self._put(code, dict(current, sha256=digest.hexdigest()))
+        finally:
+            with self._lock:
+                self._hashing.discard(code)
+
     def get_user_files(self, user_id: int, folder: str = "/") -> list:
         """Returns a list of (code, name, type) tuples for the user in the current folder."""
         files = []
-        for code, record in self.db.items():
-            if isinstance(record, dict) and record.get("owner_id") == user_id:
-                # Check if file is in the requested folder
-                file_folder = record.get("folder", "/")
-                if file_folder == folder:
-                    files.append((code, record.get("name", "Unknown File"), "file"))
+        for code in self.index.folder_codes(user_id, folder):
+            files.append((code, self.db[code].get("name", "Unknown File"), "file"))
         return files
 
+    def list_files(self, user_id: Optional[int] = None, folder: str = "/", sort: str = "name",
+                   descending: bool = False, cursor: Optional[str] = None, limit: int = 50) -> tuple:
+        """Returns (files, next_cursor): one page of a folder's files, or of all files if user_id is None (Admin).
+
+        Files are dicts with code, name, owner, size and uploaded_at; sort is one of
+        SORT_KEYS. Pass next_cursor back to get the following page (None after the
+        last one). Pages come from sorted views, so a page costs O(log n + limit).
+        """
+        if user_id is None:
+            scope = None
+            records = lambda: ((code, r) for code, r in self.db.items() if isinstance(r, dict))
+        else:
+            scope = (user_id, folder)
+            records = lambda: ((code, self.db[code]) for code in self.index.folder_codes(user_id, folder))
+        with self._lock:
+            codes, next_cursor = self.views.page(scope, sort, records, cursor, limit, descending)
+            return [self._file_row(code, self.db[code]) for code in codes], next_cursor
+
+    def page_files(self, user_id: int, folder: str, start: int, limit: int, sort: str = "name") -> tuple:
+        """Returns (files, total) for `limit` of a folder's files from position `start`; files as in list_files."""
+        with self._lock:
+            codes, total = self.views.slice((user_id, folder), sort,
+                                            lambda: ((code, self.db[code]) for code in self.index.folder_codes(user_id, folder)),
+                                            start, limit)
+            return [self._file_row(code, self.db[code]) for code in codes], total
+
+    @staticmethod
+    def _file_row(code: str, record: dict) -> dict:
+        return {
+            "code": code,
+            "name": record.get("name", "Unknown"),
+            "owner": record.get("owner_id"),
+            "size": record.get("size"),
+            "uploaded_at": record.get("uploaded_at"),
+            "tags": record.get("tags", [])
+        }
+
+    def _log_cursor(self, cursor: Optional[str]) -> tuple:
+        """(log id, seq) of a cursor into the store's change log; seq is None if it is not one."""
+        log_id = self.store.log_id()
+        prefix, _, seq = (cursor or "").partition(":")
+        return log_id, int(seq) if prefix == log_id and seq.isdigit() else None
+
+    def get_changes(self, cursor: Optional[str]) -> tuple:
+        """Returns (changes, cursor) for the admin feed: {code: file dict as in list_files, or None if deleted}.
+
+        changes is None when the cursor is too old or from another database; callers
+        should then reload get_all_files() and continue from the returned cursor.
+        With a store that keeps a change log, cursors are positions in it, so
+        they stay valid across restarts and between web worker processes.
+        """
+        log_id, seq = self._log_cursor(cursor)
+        if log_id is None:
+            changes, cursor = self.changes.since(cursor)
+        else:
+            result = self.store.change_log(seq) if seq is not None else None
+            if result is None:
+                # Memory has everything up to the last sync; replaying from there repeats at most a few changes
+                with self._lock:
+                    return None, f"{log_id}:{self._synced}"
+            changes, seq = result
+            cursor = f"{log_id}:{seq}"
+        if changes is not None:
+            changes = {code: self._file_row(code, record) if record else None for code, record in changes.items()}
+        return changes, cursor
+
+    def wait_changes(self, cursor: Optional[str], timeout: float) -> bool:
+        """Blocks until there are changes newer than `cursor` (or it is invalid); False on timeout."""
+        log_id, seq = self._log_cursor(cursor)
+        if log_id is None:
+            return self.changes.wait(cursor, timeout)
+        deadline = time.monotonic() + timeout
+        while seq is not None and self.store.change_seq() <= seq:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # Local writes and synced remote ones are published here; the store is re-checked at least twice a second
+            self.changes.wait(self.changes.cursor, min(remaining, 0.5))
+        return True
+
     def get_all_files(self) -> list:
         """Returns a list of all files for admin view: (code, name, owner_id)."""
         files = []
-        for code, record in self.db.items():
-            if isinstance(record, dict):
-                files.append((code, record.get("name", "Unknown"), record.get("owner_id")))
+        with self._lock:
+            for code, record in self.db.items():
+                if isinstance(record, dict):
+                    files.append((code, record.get("name", "Unknown"), record.get("owner_id")))
         return files
 
-    def search_files(self, query: str, user_id: Optional[int] = None) -> list:
-        """Search files by name. If user_id is None, search all files (Admin)."""
+    def search_files(self, query: str, user_id: Optional[int] = None, limit: Optional[int] = None) -> list:
+        """Search files by name, best matches first. If user_id is None, search all files (Admin)."""
+        within = None if user_id is None else self.index.by_owner.get(user_id, {})
         results = []
-        query = query.lower()
-        for code, record in self.db.items():
-            if isinstance(record, dict):
-                name = record.get("name", "").lower()
-                owner = record.get("owner_id")
-                
-                if query in name:
-                    if user_id is None:
-                        # Admin search: return (code, name, owner)
-                        results.append((code, record.get("name"), owner))
-                    elif owner == user_id:
-                        # User search: return (code, name, type)
-                        results.append((code, record.get("name"), "file"))
+        with self._lock:
+            for code in self.name_index.search(query, limit=limit, within=within):
+                record = self.db[code]
+                if user_id is None:
+                    # Admin search: return (code, name, owner)
+                    results.append((code, record.get("name"), record.get("owner_id")))
+                else:
+                    # User search: return (code, name, type)
+                    results.append((code, record.get("name"), "file"))
         return results
 
     def rename_file(self, code: str, new_name: str, user_id: int) -> bool:
@@ -93,38 +416,80 @@ class FileManager:
         code = code.upper()
         record = self.db.get(code)
         if isinstance(record, dict) and record.get("owner_id") == user_id:
-            self.db[code]["name"] = new_name
-            self._save_db()
+            self._put(code, dict(record, name=new_name))
             return True
         return False
 
     def delete_file(self, code: str, user_id: int) -> bool:
-        """Deletes a file record and the physical file if owned by user."""
+        """Deletes a file record if owned by user, and the physical file once nothing else references it."""
         code = code.upper()
-        record = self.db.get(code)
-        
-        if isinstance(record, dict) and record.get("owner_id") == user_id:
+        with self._lock:
+            record = self.db.get(code)
+            if not (isinstance(record, dict) and record.get("owner_id") == user_id):
+                return False
+            self._drop(code)
             file_path = record.get("path")
-            if file_path and os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except OSError:
-                    pass # File might be gone already
-            
-            del self.db[code]
-            self._save_db()
+            if file_path:
+                if self._released is not None:
+                    self._released.append(file_path)
+                else:
+                    self._reap([file_path])
             return True
-        return False
 
-    def delete_files_in_folder(self, user_id: int, folder_path: str):
-        """Deletes all files belonging to user in the specified folder and subfolders."""
-        to_delete = []
-        for code, record in self.db.items():
+    def delete_files_in_folder(self, user_id: int, folder_path: str) -> int:
+        """Deletes all files belonging to user in the specified folder and subfolders, in one commit.
+
+        Returns how many were deleted.
+        """
+        with self.batch():
+            # The folder and all its subfolders form one contiguous run in the sorted folder index
+            to_delete = self.index.subtree_codes(user_id, folder_path)
+            return sum(self.delete_file(code, user_id) for code in to_delete)
+
+    # Bulk operations: each takes any number of codes, skips the ones the user does not own,
+    # and commits once
+    def _owned(self, codes, user_id: int):
+        for code in dict.fromkeys(code.upper() for code in codes):
+            record = self.db.get(code)
             if isinstance(record, dict) and record.get("owner_id") == user_id:
-                file_folder = record.get("folder", "/")
-                # Check if file is in the folder or any subfolder
-                if file_folder == folder_path or file_folder.startswith(folder_path + "/"):
-                    to_delete.append(code)
-        
-        for code in to_delete:
-            self.delete_file(code, user_id)
+                yield code, record
+
+    def move_files(self, codes, user_id: int, folder: str) -> int:
+        """Moves the user's files to `folder`; returns how many moved."""
+        with self.batch():
+            moved = 0
+            for code, record in list(self._owned(codes, user_id)):
+                if record.get("folder", "/") != folder:
+                    self._put(code, dict(record, folder=folder))
+                    moved += 1
+            return moved
+
+    def copy_files(self, codes, user_id: int, folder: str) -> list:
+        """Copies the user's files to `folder`, sharing their stored content; returns the new codes."""
+        with self.batch():
+            copies = []
+            for _, record in list(self._owned(codes, user_id)):
+                code = self.generate_code()
+                self._put(code, dict(record, folder=folder, uploaded_at=time.time()))
+                copies.append(code)
+            return copies
+
+    def delete_files(self, codes, user_id: int) -> int:
+        """Deletes the user's files; returns how many were deleted."""
+        with self.batch():
+            return sum(self.delete_file(code, user_id) for code, _ in list(self._owned(codes, user_id)))
+
+    def tag_files(self, codes, user_id: int, add=(), remove=()) -> int:
+        """Adds and removes tags on the user's files; returns how many changed."""
+        add, remove = {tag.strip() for tag in add} - {""}, {tag.strip() for tag in remove}
+        with self.batch():
+            changed = 0
+            for code, record in list(self._owned(codes, user_id)):
+                tags = sorted((set(record.get("tags", ())) | add) - remove)
+                if tags != record.get("tags", []):
+                    self._put(code, dict(record, tags=tags))
+                    changed += 1
+            return changed
+
+
+metrics.instrument(FileManager, "storage_call_seconds", "Time spent in storage methods", component="file_manager")
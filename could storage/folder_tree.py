@@ -0,0 +1,113 @@
+from bisect import bisect_left, insort
+from typing import Optional
+
+
+class FolderTree:
+    """One user's folders as a path -> children map rooted at "/".
+
+    Membership and child lookups are O(1), deleting a folder costs the size of
+    its subtree, and resolving a relative path costs its depth.
+    """
+
+    def __init__(self):
+        self.children = {"/": {}}  # path -> {child path: None}, in creation order
+        self._sorted = {}  # path -> sorted child paths, built on first page() and kept up to date
+
+    @staticmethod
+    def join(parent: str, name: str) -> str:
+        return f"/{name}" if parent == "/" else f"{parent}/{name}"
+
+    @staticmethod
+    def parent(path: str) -> str:
+        head = path.rsplit("/", 1)[0]
+        return head or "/"
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.children
+
+    def __len__(self) -> int:
+        return len(self.children)
+
+    def add(self, path: str) -> bool:
+        """Creates a folder (and any missing parents); False if it already exists."""
+        if path in self.children:
+            return False
+        parent = self.parent(path)
+        if parent not in self.children:
+            self.add(parent)
+        self.children[parent][path] = None
+        self.children[path] = {}
+        if parent in self._sorted:
+            insort(self._sorted[parent], path)
+        return True
+
+    def remove(self, path: str) -> bool:
+        """Removes a folder and its whole subtree. The root cannot be removed."""
+        if path == "/" or path not in self.children:
+            return False
+        parent = self.parent(path)
+        del self.children[parent][path]
+        siblings = self._sorted.get(parent)
+        if siblings is not None:
+            del siblings[bisect_left(siblings, path)]
+        stack = [path]
+        while stack:
+            removed = stack.pop()
+            self._sorted.pop(removed, None)
+            stack.extend(self.children.pop(removed))
+        return True
+
+    def subfolders(self, path: str) -> list:
+        """Full paths of the direct children of `path`."""
+        return list(self.children.get(path, ()))
+
+    def page(self, path: str, start: int, limit: int) -> tuple:
+        """Returns (child paths, total children) for `limit` direct children of `path` in name order, from `start`."""
+        kids = self.children.get(path)
+        if kids is None:
+            return [], 0
+        ordered = self._sorted.get(path)
+        if ordered is None:
+            ordered = self._sorted[path] = sorted(kids)
+        return ordered[start:start + limit], len(ordered)
+
+    def resolve(self, current: str, target: str) -> Optional[str]:
+        """Resolves `target` (absolute, relative or "..") against `current`; None if it does not exist."""
+        path = "/" if target.startswith("/") else current
+        for part in target.split("/"):
+            if not part or part == ".":
+                continue
+            path = self.parent(path) if part == ".." else self.join(path, part)
+            if path not in self.children:
+                return None
+        return path
+
+    def to_json(self) -> dict:
+        """Nested {name: {...}} form; each folder name is stored once."""
+        root = {}
+        nodes = {"/": root}
+        for path, kids in self.children.items():
+            node = nodes.get(path)
+            if node is None:
+                continue
+            for child in kids:
+                nodes[child] = node[child.rsplit("/", 1)[1]] = {}
+        return root
+
+    @classmethod
+    def from_json(cls, data) -> "FolderTree":
+        """Loads the nested form, or the legacy flat list of paths."""
+        tree = cls()
+        if isinstance(data, list):
+            for path in data:
+                if path != "/":
+                    tree.add(path)
+            return tree
+        stack = [("/", data or {})]
+        while stack:
+            parent, node = stack.pop()
+            for name, sub in node.items():
+                path = cls.join(parent, name)
+                tree.add(path)
+                stack.append((path, sub))
+        return tree
@@ -0,0 +1,115 @@
+"""Framework-independent helpers for HTTP Range and conditional GET handling."""
+import uuid
+from typing import Iterator, Optional
+
+CHUNK_SIZE = 256 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[list]:
+    """Parses a `Range: bytes=...` header into a list of inclusive (start, end) pairs.
+
+    Returns None when the header is absent or not a byte range (serve the whole
+    file) and raises RangeNotSatisfiable when no requested range overlaps the file.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        first, sep, last = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if first == "":
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length == 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+        except ValueError:
+            return None
+        if start > end and last:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return _coalesce(ranges)
+
+
+def _coalesce(ranges: list) -> list:
+    """Merges overlapping or adjacent ranges so no byte is sent twice."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def quote_etag(etag: str) -> str:
+    return f'"{etag}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match / If-Range style header names `etag` (or is `*`)."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in header.split(",")]
+    # Weak comparison for If-None-Match: W/"x" matches "x"
+    return any(tag.removeprefix("W/") == quote_etag(etag) for tag in tags)
+
+
+def iter_file_range(path: str, start: int, end: int, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Streams bytes start..end (inclusive) of a file without loading it into memory."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+class MultipartRanges:
+    """A multipart/byteranges body for a request asking for several ranges."""
+
+    def __init__(self, path: str, ranges: list, size: int, content_type: str):
+        self.path = path
+        self.ranges = ranges
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/byteranges; boundary={self.boundary}"
+        self._headers = [
+            (f"\r\n--{self.boundary}\r\nContent-Type: {content_type}\r\n"
+             f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode("latin-1")
+            for start, end in ranges
+        ]
+        self._trailer = f"\r\n--{self.boundary}--\r\n".encode("latin-1")
+
+    @property
+    def content_length(self) -> int:
+        body = sum(end - start + 1 for start, end in self.ranges)
+        return body + sum(map(len, self._headers)) + len(self._trailer)
+
+    def __iter__(self) -> Iterator[bytes]:
+        for header, (start, end) in zip(self._headers, self.ranges):
+            yield header
+            yield from iter_file_range(self.path, start, end)
+        yield self._trailer
@@ -0,0 +1,249 @@
+import json
+import os
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows, where a log another process has open cannot be renamed in the first place
+    fcntl = None
+
+
+class Journal:
+    """Append-only log of small JSON records, one per line.
+
+    Each line is `<crc32 hex> <json>\\n`. On replay, the first line that is
+    incomplete or fails its checksum marks the end of the log: it and anything
+    after it are truncated, so a crash mid-append only loses that last record.
+
+    Several processes may append to the same log. follow() returns what the
+    others appended, and rotations are coordinated through a lock file, so
+    only one process compacts at a time. Appends hold a shared lock and
+    rotate() an exclusive one, so no append can land in a log after it was
+    moved aside for compaction.
+
+    Appends are fsynced before they return, so an acknowledged change
+    survives a power cut; append_many() (a batch) costs a single fsync.
+    """
+
+    def __init__(self, path: Path, fsync: bool = True):
+        self.path = Path(path)
+        self.rotated_path = self.path.with_name(self.path.name + ".old")
+        # The previous rotated log is kept until the next rotation, for processes still following it
+        self.retained_path = self.path.with_name(self.path.name + ".prev")
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.append_lock_path = self.path.with_name(self.path.name + ".append.lock")
+        self.fsync = fsync
+        self.pending = 0  # records in the live log, i.e. appended since the last rotation
+        self._file = None
+        self._append_lock = None
+        # (first line of the file, offset) of the next record follow() has not returned yet. Files are
+        # told apart by their first line, which for new files is a random header: inodes get reused
+        self._tail = (None, 0)
+
+    def _open(self):
+        if self._file is not None and not self._is_live(self._file):
+            # Another process rotated the log; our handle still points at the old file
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            self._file = open(self.path, "ab")
+            if self._file.tell() == 0:
+                self._file.write(self._encode({"journal_id": os.urandom(8).hex()}))
+                self._file.flush()
+
+    @contextmanager
+    def _appending(self, shared: bool = True):
+        """Shared for appends, exclusive for rotate(); a no-op without fcntl."""
+        if fcntl is None:
+            yield
+            return
+        if self._append_lock is None:
+            self._append_lock = open(self.append_lock_path, "ab")
+        fcntl.flock(self._append_lock.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._append_lock.fileno(), fcntl.LOCK_UN)
+
+    def _is_live(self, f) -> bool:
+        try:
+            return os.stat(self.path).st_ino == os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _encode(record: dict) -> bytes:
+        payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        return b"%08x " % zlib.crc32(payload) + payload + b"\n"
+
+    def append(self, record: dict):
+        """Appends one record; O(1) regardless of how much state it describes."""
+        self.append_many([record])
+
+    def append_many(self, records: list):
+        """Appends several records with one write (and one fsync)."""
+        if not records:
+            return
+        data = b"".join(self._encode(record) for record in records)
+        with self._appending():
+            # Under the lock, the file _open() checked is still the live one when the write lands
+            self._open()
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        self.pending += len(records)
+
+    @staticmethod
+    def _read_valid(f, offset: int = 0) -> Iterator[tuple]:
+        """Yields (record, end_offset) for each intact record in the open file `f` from `offset`."""
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                return
+            crc, _, payload = line.rstrip(b"\n").partition(b" ")
+            try:
+                if int(crc, 16) != zlib.crc32(payload):
+                    return
+                record = json.loads(payload)
+            except ValueError:
+                return
+            offset += len(line)
+            if record.keys() != {"journal_id"}:
+                yield record, offset
+
+    def replay(self, truncate: bool = True) -> Iterator[dict]:
+        """Yields every intact record, rotated log first, truncating any torn tail unless `truncate` is False.
+
+        Afterwards `pending` is the number of records in the live log.
+        """
+        self._tail = (None, 0)
+        self.pending = 0
+        for path in (self.rotated_path, self.path):
+            if not path.exists():
+                continue
+            good_offset = 0
+            with open(path, "rb") as f:
+                for record, good_offset in self._read_valid(f):
+                    if path == self.path:
+                        self.pending += 1
+                    yield record
+                if path == self.path:
+                    self._tail = (self._first_line(f), good_offset)
+            if truncate and good_offset != path.stat().st_size:
+                with open(path, "r+b") as f:
+                    f.truncate(good_offset)
+        if self._tail[0] is None:
+            # Start a log now, so follow() has a file to tell rotations by
+            self._open()
+            with open(self.path, "rb") as f:
+                self._tail = (self._first_line(f), f.seek(0, os.SEEK_END))
+
+    def follow(self) -> Optional[list]:
+        """Returns the records appended since replay() or the last follow(), by this or any other process.
+
+        Follows the log through rotations. Returns None if the position was
+        lost because the log was rotated twice since the last call. The caller
+        then has to reload from the snapshot.
+        """
+        first, offset = self._tail
+        records = []
+        try:
+            with open(self.path, "rb") as f:
+                live = self._first_line(f)
+        except FileNotFoundError:
+            live = None
+        if live is None:
+            return records  # In the middle of a rotation; pick up from here next time
+        if first is not None and live != first:
+            # Rotated: finish the file we were reading, then start the live one from the top
+            for path in (self.rotated_path, self.retained_path):
+                try:
+                    with open(path, "rb") as f:
+                        if self._first_line(f) == first:
+                            records.extend(record for record, _ in self._read_valid(f, offset))
+                            break
+                except FileNotFoundError:
+                    pass
+            else:
+                return None
+            first, offset = live, 0
+        try:
+            with open(self.path, "rb") as f:
+                if self._first_line(f) == live:
+                    for record, offset in self._read_valid(f, offset):
+                        records.append(record)
+        except FileNotFoundError:
+            pass
+        self._tail = (live, offset)
+        return records
+
+    @staticmethod
+    def _first_line(f) -> Optional[bytes]:
+        """The file's first complete line, which identifies it; None while it has none."""
+        f.seek(0)
+        line = f.readline()
+        return line if line.endswith(b"\n") else None
+
+    def try_lock(self, stale_after: float = 300.0) -> bool:
+        """Takes the cross-process rotation lock; False if another process holds it."""
+        for _ in range(2):
+            try:
+                os.close(os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.lock_path) < stale_after:
+                        return False
+                    # Left behind by a process that died while holding it
+                    os.remove(self.lock_path)
+                except FileNotFoundError:
+                    pass
+        return False
+
+    def unlock(self):
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+
+    def rotate(self):
+        """Moves the live log aside so a snapshot can be written without blocking appends."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        # Waits for appends in progress; later ones find the log moved and open the new one
+        with self._appending(shared=False):
+            if self.path.exists():
+                if self.rotated_path.exists():
+                    # A previous compaction did not finish; keep its records and add ours after them
+                    with open(self.rotated_path, "ab") as dst, open(self.path, "rb") as src:
+                        dst.write(src.read())
+                    os.remove(self.path)
+                else:
+                    os.replace(self.path, self.rotated_path)
+        self.pending = 0
+        # Start the new log right away: other processes wait for it before reading the rest of the old one
+        self._open()
+
+    def discard_rotated(self):
+        """Retires the rotated log once its records are safely in a snapshot."""
+        if self.rotated_path.exists():
+            # Not deleted yet: other processes may still be reading its last records
+            os.replace(self.rotated_path, self.retained_path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._append_lock is not None:
+            self._append_lock.close()
+            self._append_lock = None
+
+
+metrics.instrument(Journal, "storage_call_seconds", "Time spent in storage methods", component="journal")
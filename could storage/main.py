@@ -1,12 +1,28 @@
 
+import json
 import os
 import logging
+import shutil
+import threading
+import time
+from typing import Optional
+import httpx
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, CallbackQueryHandler
-from utils import ensure_download_dir, get_save_path
-from file_manager import FileManager
-from user_manager import UserManager
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
+from telegram.error import BadRequest
+from telegram.request import BaseRequest, HTTPXRequest
+from telegram.ext import Application, ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, TypeHandler, filters, CallbackQueryHandler
+from utils import ensure_download_dir
+from blob_store import BlobStore, HashingWriter
+from download_scheduler import DownloadScheduler
+from async_storage import AsyncProxy, AsyncStorage
+from callback_codec import CallbackCodec, CallbackExpired
+from render_cache import RenderCache
+from state_store import MemoryStateStore, SQLiteStateStore
+from webhook import run_webhook
+from storage_service import get_storage
+from thumbnails import get_thumbnailer, preview_kind
+import metrics
 
 # Load environment variables
 load_dotenv()
@@ -17,18 +33,85 @@ logging.basicConfig(
     level=logging.INFO
 )
 
-# Global state
-file_manager = FileManager()
-user_manager = UserManager()
+# Global state; the web app uses the same managers when it runs in this process (WEB_PORT)
+shared_storage = get_storage()
+file_manager = shared_storage.file_manager
+user_manager = shared_storage.user_manager
+blob_store = BlobStore()
+# Web previews of stored images and videos, built in worker processes
+thumbnailer = get_thumbnailer()
+# Pending prompts per user, and the files picked in select mode (kept apart, so answering a
+# prompt does not end select mode); the SQLite stores can be shared by several bot processes
+if os.getenv("STATE_STORE", "memory") == "sqlite":
+    state_store = SQLiteStateStore()
+    selection_store = SQLiteStateStore(table="user_selection")
+else:
+    state_store = MemoryStateStore()
+    selection_store = MemoryStateStore()
+# Handlers reach the managers through this, so disk and serialization work stays off the event loop
+storage = AsyncStorage(file_manager, user_manager, state_store)
+selections = AsyncProxy(selection_store, storage.run_io)
+download_scheduler = DownloadScheduler(
+    max_concurrency=int(os.getenv("DOWNLOAD_CONCURRENCY", "4")),
+    per_user_limit=int(os.getenv("DOWNLOAD_PER_USER", "1"))
+)
+# Attachments are fetched from the Bot API's file URLs with a client of our own, as PTB's
+# File.download_* methods hold the whole file in memory
+download_client = httpx.AsyncClient(timeout=httpx.Timeout(30.0), follow_redirects=True)
+DOWNLOAD_CHUNK = 1 << 20
+
+# Folder entries (subfolders + files) per page of the file browser keyboard
+BOT_PAGE_SIZE = int(os.getenv("BOT_PAGE_SIZE", "20"))
+
+# One-character opcodes for callback_data. Existing codes must never change or be reused,
+# since buttons on already-sent messages still carry them
+callbacks = CallbackCodec({
+    "main_menu": "M",
+    "register_info": "R",
+    "help": "H",
+    "upload_info": "U",
+    "search_prompt": "S",
+    "password_info": "P",
+    "list_files": "L",
+    "ls": "G",
+    "noop": "N",
+    "cd": "C",
+    "file": "F",
+    "rename_prompt": "E",
+    "dl": "D",
+    "del_confirm": "X",
+    "del": "Y",
+    "mkdir_prompt": "K",
+    "del_folder_confirm": "Q",
+    "del_folder": "Z",
+    "select": "B",
+    "pick": "I",
+    "bulk": "J",
+    "bulk_del": "O",
+})
+
+# Rendered folder keyboards, keyed by the folder's file and subfolder versions
+render_cache = RenderCache(capacity=int(os.getenv("RENDER_CACHE_SIZE", "2048")))
+# Exported on /metrics next to the latency histograms
+metrics.registry.counter("bot_render_cache_hits_total", "Folder keyboards served from render_cache", lambda: render_cache.hits)
+metrics.registry.counter("bot_render_cache_misses_total", "Folder keyboards rendered anew", lambda: render_cache.misses)
+metrics.registry.gauge("bot_downloads_running", "Attachment downloads in progress", lambda: download_scheduler.running)
+metrics.registry.gauge("bot_downloads_queued", "Attachment downloads waiting for a slot", lambda: download_scheduler.queue_depth)
 
-# User Interaction States
-user_states = {}
-user_context = {}
+# Bot methods that can resend each kind of Telegram file by its file_id
+SEND_METHODS = {
+    "document": "send_document",
+    "photo": "send_photo",
+    "video": "send_video",
+    "audio": "send_audio",
+    "voice": "send_voice",
+    "animation": "send_animation",
+}
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
-        [InlineKeyboardButton("🏠 Main Menu", callback_data='main_menu')],
-        [InlineKeyboardButton("📝 Register", callback_data='register_info')]
+        [InlineKeyboardButton("🏠 Main Menu", callback_data=callbacks.encode('main_menu'))],
+        [InlineKeyboardButton("📝 Register", callback_data=callbacks.encode('register_info'))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -44,7 +127,7 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_chat.id
     username = update.effective_user.username or "Unknown"
     
-    if user_manager.register(user_id, username):
+    if await storage.users.register(user_id, username):
         await update.message.reply_text(f"✅ Welcome {username}! You are now registered.\nYou can start sending files immediately.")
     else:
         await update.message.reply_text("You are already registered! Just send me files.")
@@ -54,11 +137,11 @@ async def home(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
-        [InlineKeyboardButton("📂 My Files", callback_data='list_files')],
-        [InlineKeyboardButton("📤 How to Upload", callback_data='upload_info')],
-        [InlineKeyboardButton("🔍 Search", callback_data='search_prompt')],
-        [InlineKeyboardButton("⚙️ Set Password", callback_data='password_info')],
-        [InlineKeyboardButton("❓ Help", callback_data='help')]
+        [InlineKeyboardButton("📂 My Files", callback_data=callbacks.encode('list_files'))],
+        [InlineKeyboardButton("📤 How to Upload", callback_data=callbacks.encode('upload_info'))],
+        [InlineKeyboardButton("🔍 Search", callback_data=callbacks.encode('search_prompt'))],
+        [InlineKeyboardButton("⚙️ Set Password", callback_data=callbacks.encode('password_info'))],
+        [InlineKeyboardButton("❓ Help", callback_data=callbacks.encode('help'))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -70,262 +153,579 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
-def get_file_list_markup(user_id: int, current_folder: str) -> InlineKeyboardMarkup:
+def get_file_list_markup(user_id: int, current_folder: str, offset: int = 0, selected: frozenset = None) -> InlineKeyboardMarkup:
+    """Keyboard for one page of a folder: subfolders first, then files, both by name.
+
+    `offset` is the position of the page's first entry; only that page's slice
+    is fetched, so the cost and size of the markup do not depend on the folder size.
+    With `selected` (the user's picked codes) the page is shown in select mode.
+    """
     keyboard = []
     
     # Navigation
     if current_folder != "/":
-        keyboard.append([InlineKeyboardButton("⬆️ Up", callback_data='cd:..')])
+        keyboard.append([InlineKeyboardButton("⬆️ Up", callback_data=callbacks.encode('cd', '..'))])
     
-    keyboard.append([InlineKeyboardButton("🏠 Home", callback_data='main_menu'), InlineKeyboardButton("➕ New Folder", callback_data='mkdir_prompt')])
+    if selected is not None:
+        keyboard.append([InlineKeyboardButton("✅ Done", callback_data=callbacks.encode('select', 'off')),
+                         InlineKeyboardButton("All Here", callback_data=callbacks.encode('select', 'all')),
+                         InlineKeyboardButton("Clear", callback_data=callbacks.encode('select', 'none'))])
+    else:
+        keyboard.append([InlineKeyboardButton("🏠 Home", callback_data=callbacks.encode('main_menu')), InlineKeyboardButton("➕ New Folder", callback_data=callbacks.encode('mkdir_prompt')),
+                         InlineKeyboardButton("☑️ Select", callback_data=callbacks.encode('select', 'on'))])
     
     # Delete Folder Option (if not root)
-    if current_folder != "/":
-        keyboard.append([InlineKeyboardButton("🗑️ Delete This Folder", callback_data='del_folder_confirm')])
+    if current_folder != "/" and selected is None:
+        keyboard.append([InlineKeyboardButton("🗑️ Delete This Folder", callback_data=callbacks.encode('del_folder_confirm'))])
 
     # Subfolders
-    subfolders = user_manager.get_subfolders(user_id, current_folder)
+    subfolders, folder_total = user_manager.page_subfolders(user_id, current_folder, offset, BOT_PAGE_SIZE)
     for f in subfolders:
         name = f.split("/")[-1]
-        keyboard.append([InlineKeyboardButton(f"📁 {name}", callback_data=f"cd:{name}")])
+        keyboard.append([InlineKeyboardButton(f"📁 {name}", callback_data=callbacks.encode('cd', name))])
         
-    # Files
-    files = file_manager.get_user_files(user_id, current_folder)
-    for code, name, _ in files:
-        keyboard.append([InlineKeyboardButton(f"📄 {name}", callback_data=f"file:{code}")])
+    # Files (the page continues with files once the subfolders run out)
+    files, file_total = file_manager.page_files(user_id, current_folder, max(0, offset - folder_total),
+                                                BOT_PAGE_SIZE - len(subfolders))
+    for file in files:
+        if selected is not None:
+            # Picking a file re-renders this same page, so the offset travels with the code
+            mark = "☑️" if file['code'] in selected else "⬜"
+            keyboard.append([InlineKeyboardButton(f"{mark} {file['name']}", callback_data=callbacks.encode('pick', f"{file['code']}:{offset}"))])
+        else:
+            keyboard.append([InlineKeyboardButton(f"📄 {file['name']}", callback_data=callbacks.encode('file', file['code']))])
+
+    # Pager
+    total = folder_total + file_total
+    if offset and not subfolders and not files:
+        # The folder shrank since this page was requested; show its last page instead
+        return get_file_list_markup(user_id, current_folder, max(0, (total - 1) // BOT_PAGE_SIZE * BOT_PAGE_SIZE), selected)
+    if total > BOT_PAGE_SIZE:
+        pager = []
+        if offset > 0:
+            pager.append(InlineKeyboardButton("◀️ Prev", callback_data=callbacks.encode('ls', max(0, offset - BOT_PAGE_SIZE))))
+        pager.append(InlineKeyboardButton(f"{offset // BOT_PAGE_SIZE + 1}/{-(-total // BOT_PAGE_SIZE)}", callback_data=callbacks.encode('noop')))
+        if offset + BOT_PAGE_SIZE < total:
+            pager.append(InlineKeyboardButton("Next ▶️", callback_data=callbacks.encode('ls', offset + BOT_PAGE_SIZE)))
+        keyboard.append(pager)
+
+    # Actions on the picked files, wherever they are
+    if selected:
+        keyboard.append([InlineKeyboardButton(f"{len(selected)} selected:", callback_data=callbacks.encode('noop'))])
+        keyboard.append([InlineKeyboardButton("📁 Move", callback_data=callbacks.encode('bulk', 'move')),
+                         InlineKeyboardButton("📋 Copy", callback_data=callbacks.encode('bulk', 'copy')),
+                         InlineKeyboardButton("🏷️ Tag", callback_data=callbacks.encode('bulk', 'tag')),
+                         InlineKeyboardButton("🗑️ Delete", callback_data=callbacks.encode('bulk', 'del'))])
         
     return InlineKeyboardMarkup(keyboard)
 
+async def render_file_list(user_id: int, current_folder: str, offset: int = 0) -> InlineKeyboardMarkup:
+    """get_file_list_markup, served from render_cache while the folder is unchanged."""
+    selected = await get_selection(user_id)
+    if selected is not None:
+        # Select mode pages depend on the picks too; they are rendered fresh each time
+        return await storage.run(get_file_list_markup, user_id, current_folder, offset, frozenset(selected))
+    key = (user_id, current_folder, offset,
+           file_manager.folder_version(user_id, current_folder), user_manager.folder_version(user_id, current_folder))
+    # A cached keyboard is only usable while the tokens behind its long callback arguments live
+    cached = render_cache.get(key, valid=lambda entry: all(callbacks.is_live(data) for data in entry[1]))
+    if cached is not None:
+        return cached[0]
+    reply_markup = await storage.run(get_file_list_markup, user_id, current_folder, offset)
+    tokens = [button.callback_data for row in reply_markup.inline_keyboard for button in row
+              if callbacks.uses_token(button.callback_data)]
+    render_cache.put(key, (reply_markup, tokens))
+    return reply_markup
+
+async def send_stored_file(bot, chat_id: int, code: str, caption: str = None):
+    """Sends a stored file, by cached Telegram file_id when possible instead of uploading it from disk."""
+    cached = await storage.files.get_telegram_file(code)
+    if cached and cached[0] in SEND_METHODS:
+        kind, file_id = cached
+        try:
+            await getattr(bot, SEND_METHODS[kind])(chat_id, file_id, caption=caption)
+            return
+        except BadRequest:
+            pass # file_id not usable by this bot (e.g. token changed), upload instead
+
+    # Opened off the event loop and streamed by the HTTP client, so the file is never read into memory whole
+    f = await storage.run_io(open, await storage.files.get_file_path(code), "rb")
+    try:
+        document = InputFile(f, filename=await storage.files.get_download_name(code), read_file_handle=False)
+        message = await bot.send_document(chat_id=chat_id, document=document, caption=caption)
+    finally:
+        await storage.run_io(f.close)
+    await storage.files.set_telegram_file(code, "document", message.document.file_id)
+
+# Callback handlers by action; button_handler routes to them with one dict lookup
+CALLBACK_HANDLERS = {}
+
+def on_callback(action: str):
+    def register_handler(handler):
+        CALLBACK_HANDLERS[action] = metrics.timed("bot_callback_seconds", "Time to handle a button press, by action",
+                                                  action=action)(handler)
+        return handler
+    return register_handler
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    # Don't answer immediately here, as some paths might need specific answers or alerts
-    
-    user_id = update.effective_chat.id
-    
-    if query.data == 'main_menu':
-        await query.answer()
-        await show_main_menu(update, context)
-        
-    elif query.data == 'register_info':
-        await query.answer()
-        await query.edit_message_text(
-            text="To register, simply type `/register`.\n\nOnce registered, you can upload files and access the web dashboard.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data='main_menu')]])
-        )
-        
-    elif query.data == 'help':
-        await query.answer()
-        help_text = (
-            "❓ **Help & Commands**\n\n"
-            "**Basics**\n"
-            "`/start` - Restart bot\n"
-            "`/register` - Create account\n"
-            "`/home` - Show Main Menu\n\n"
-            "**Interactive**\n"
-            "Use the buttons to navigate, create folders, and manage files.\n"
-            "The bot will ask you for input when needed."
-        )
-        await query.edit_message_text(
-            text=help_text,
-            parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data='main_menu')]])
-        )
-        
-    elif query.data == 'upload_info':
+    # Handlers answer the query themselves, as some paths need specific answers or alerts
+    try:
+        decoded = callbacks.decode(query.data)
+    except CallbackExpired:
+        await query.answer("This button has expired. Please open the menu again.", show_alert=True)
+        return
+    handler = CALLBACK_HANDLERS.get(decoded[0]) if decoded else None
+    if handler is None:
         await query.answer()
+        return
+    await handler(update, context, decoded[1])
+
+@on_callback('main_menu')
+async def main_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    await query.answer()
+    await show_main_menu(update, context)
+
+@on_callback('register_info')
+async def register_info_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text(
+        text="To register, simply type `/register`.\n\nOnce registered, you can upload files and access the web dashboard.",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data=callbacks.encode('main_menu'))]])
+    )
+
+@on_callback('help')
+async def help_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    await query.answer()
+    help_text = (
+        "❓ **Help & Commands**\n\n"
+        "**Basics**\n"
+        "`/start` - Restart bot\n"
+        "`/register` - Create account\n"
+        "`/home` - Show Main Menu\n\n"
+        "**Interactive**\n"
+        "Use the buttons to navigate, create folders, and manage files.\n"
+        "☑️ Select lets you move, copy, tag or delete many files at once.\n"
+        "The bot will ask you for input when needed."
+    )
+    await query.edit_message_text(
+        text=help_text,
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data=callbacks.encode('main_menu'))]])
+    )
+
+@on_callback('upload_info')
+async def upload_info_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text(
+        text="📤 **How to Upload**\n\n"
+             "1. Simply send any **File**, **Photo**, or **Video** to this chat.\n"
+             "2. Add a caption to name the file (optional).\n"
+             "3. Or send **Text** to create a text file.\n\n"
+             "Your file will be saved instantly!",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data=callbacks.encode('main_menu'))]])
+    )
+
+@on_callback('search_prompt')
+async def search_prompt_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    await storage.states.set(user_id, "WAIT_SEARCH")
+    await context.bot.send_message(chat_id=user_id, text="🔍 **Search**\n\nPlease type what you are looking for:")
+
+@on_callback('password_info')
+async def password_info_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    await storage.states.set(user_id, "WAIT_PASSWORD")
+    await context.bot.send_message(chat_id=user_id, text="⚙️ **Set Password**\n\nPlease type your new web password:")
+
+@on_callback('list_files')
+async def list_files_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    if not await storage.users.is_registered(user_id):
+        await query.edit_message_text("Please `/register` first.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data=callbacks.encode('main_menu'))]]))
+        return
+
+    current_folder = await storage.users.get_current_folder(user_id)
+    reply_markup = await render_file_list(user_id, current_folder)
+
+    await query.edit_message_text(
+        text=f"📂 **Path: {current_folder}**", 
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+@on_callback('ls')
+async def ls_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    # Another page of the current folder; the callback carries the page's starting position
+    await query.answer()
+    offset = int(arg) if arg and arg.isdigit() else 0
+    current_folder = await storage.users.get_current_folder(user_id)
+    reply_markup = await render_file_list(user_id, current_folder, offset)
+    try:
         await query.edit_message_text(
-            text="📤 **How to Upload**\n\n"
-                 "1. Simply send any **File**, **Photo**, or **Video** to this chat.\n"
-                 "2. Add a caption to name the file (optional).\n"
-                 "3. Or send **Text** to create a text file.\n\n"
-                 "Your file will be saved instantly!",
+            text=f"📂 **Path: {current_folder}**",
             parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data='main_menu')]])
+            reply_markup=reply_markup
         )
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            raise
 
-    elif query.data == 'search_prompt':
-        await query.answer()
-        user_states[user_id] = "WAIT_SEARCH"
-        await context.bot.send_message(chat_id=user_id, text="🔍 **Search**\n\nPlease type what you are looking for:")
-        
-    elif query.data == 'password_info':
-        await query.answer()
-        user_states[user_id] = "WAIT_PASSWORD"
-        await context.bot.send_message(chat_id=user_id, text="⚙️ **Set Password**\n\nPlease type your new web password:")
-        
-    elif query.data == 'list_files':
-        await query.answer()
-        if not user_manager.is_registered(user_id):
-            await query.edit_message_text("Please `/register` first.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data='main_menu')]]))
+@on_callback('noop')
+async def noop_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    await query.answer()
+
+@on_callback('cd')
+async def cd_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    target = arg
+    current = await storage.users.get_current_folder(user_id)
+
+    if target == "..":
+        if current != "/":
+            parent = "/" + "/".join(current.strip("/").split("/")[:-1])
+            if parent == "//": parent = "/"
+            await storage.users.set_current_folder(user_id, parent)
+    else:
+        # Enter folder
+        new_path = await storage.users.resolve_folder(user_id, target)
+        if new_path is not None:
+            await storage.users.set_current_folder(user_id, new_path)
+        else:
+            await context.bot.answer_callback_query(query.id, text="Folder not found!", show_alert=True)
             return
 
-        current_folder = user_manager.get_current_folder(user_id)
-        reply_markup = get_file_list_markup(user_id, current_folder)
-        
+    # Refresh list
+    new_current = await storage.users.get_current_folder(user_id)
+    reply_markup = await render_file_list(user_id, new_current)
+    await query.edit_message_text(
+        text=f"📂 **Path: {new_current}**",
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+@on_callback('file')
+async def file_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    await query.answer()
+    code = arg
+    file_path = await storage.files.get_file_path(code)
+
+    if not file_path:
+        await query.edit_message_text("File not found.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data=callbacks.encode('list_files'))]]))
+        return
+
+    # Get file info
+    record = await storage.files.get_file_record(code)
+    name = record.get("name", "Unknown") if record else "Unknown"
+    tags = f"\n**Tags:** {', '.join(record['tags'])}" if record and record.get("tags") else ""
+
+    keyboard = [
+        [InlineKeyboardButton("⬇️ Download", callback_data=callbacks.encode('dl', code))],
+        [InlineKeyboardButton("✏️ Rename", callback_data=callbacks.encode('rename_prompt', code))],
+        [InlineKeyboardButton("🗑️ Delete", callback_data=callbacks.encode('del_confirm', code))],
+        [InlineKeyboardButton("🔙 Back", callback_data=callbacks.encode('list_files'))]
+    ]
+
+    await query.edit_message_text(
+        text=f"📄 **File Details**\n\n**Name:** {name}\n**Code:** `{code}`{tags}",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+@on_callback('rename_prompt')
+async def rename_prompt_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    code = arg
+    await storage.states.set(user_id, "WAIT_RENAME", code)
+    await context.bot.send_message(
+        chat_id=user_id, 
+        text=f"✏️ **Rename File**\n\nPlease type the new name for file `{code}`:",
+        parse_mode='Markdown'
+    )
+
+@on_callback('dl')
+async def dl_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    code = arg
+    path = await storage.files.get_file_path(code)
+    if path and os.path.exists(path):
+        await send_stored_file(context.bot, user_id, code)
+    else:
+        await context.bot.answer_callback_query(query.id, text="File not found!", show_alert=True)
+
+@on_callback('del_confirm')
+async def del_confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    await query.answer()
+    code = arg
+    keyboard = [
+        [InlineKeyboardButton("✅ Yes, Delete", callback_data=callbacks.encode('del', code))],
+        [InlineKeyboardButton("❌ Cancel", callback_data=callbacks.encode('file', code))]
+    ]
+    await query.edit_message_text(
+        text=f"⚠️ Are you sure you want to delete file `{code}`?",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+@on_callback('del')
+async def del_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    code = arg
+    if await storage.files.delete_file(code, user_id):
+        await context.bot.answer_callback_query(query.id, text="File deleted!", show_alert=True)
+        # Return to list
+        current_folder = await storage.users.get_current_folder(user_id)
+        reply_markup = await render_file_list(user_id, current_folder)
         await query.edit_message_text(
-            text=f"📂 **Path: {current_folder}**", 
+            text=f"📂 **Path: {current_folder}**",
             parse_mode='Markdown',
             reply_markup=reply_markup
         )
-        
-    elif query.data.startswith('cd:'):
-        await query.answer()
-        target = query.data.split(':', 1)[1]
-        current = user_manager.get_current_folder(user_id)
-        
-        if target == "..":
-            if current != "/":
-                parent = "/" + "/".join(current.strip("/").split("/")[:-1])
-                if parent == "//": parent = "/"
-                user_manager.set_current_folder(user_id, parent)
-        else:
-            # Enter folder
-            if current == "/":
-                new_path = f"/{target}"
-            else:
-                new_path = f"{current}/{target}"
-            
-            folders = user_manager.db[str(user_id)].get("folders", ["/"])
-            if new_path in folders:
-                user_manager.set_current_folder(user_id, new_path)
-            else:
-                await context.bot.answer_callback_query(query.id, text="Folder not found!", show_alert=True)
-                return
+    else:
+        await context.bot.answer_callback_query(query.id, text="Failed to delete.", show_alert=True)
+
+@on_callback('mkdir_prompt')
+async def mkdir_prompt_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    await storage.states.set(user_id, "WAIT_MKDIR")
+    await context.bot.send_message(chat_id=user_id, text="📂 **New Folder**\n\nPlease type the name for the new folder:")
+
+@on_callback('del_folder_confirm')
+async def del_folder_confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    current_folder = await storage.users.get_current_folder(user_id)
+    if current_folder == "/":
+        await context.bot.answer_callback_query(query.id, text="Cannot delete root!", show_alert=True)
+        return
 
-        # Refresh list
-        new_current = user_manager.get_current_folder(user_id)
-        reply_markup = get_file_list_markup(user_id, new_current)
+    keyboard = [
+        [InlineKeyboardButton("✅ Yes, Delete Folder", callback_data=callbacks.encode('del_folder'))],
+        [InlineKeyboardButton("❌ Cancel", callback_data=callbacks.encode('list_files'))]
+    ]
+    await query.edit_message_text(
+        text=f"⚠️ **Delete Folder?**\n\nAre you sure you want to delete `{current_folder}` and ALL files inside it?",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+@on_callback('del_folder')
+async def del_folder_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    current_folder = await storage.users.get_current_folder(user_id)
+    if current_folder == "/":
+        await context.bot.answer_callback_query(query.id, text="Cannot delete root!", show_alert=True)
+        return
+
+    # Files and folders go in one commit each; the stored files are removed in the background
+    if await storage.run(shared_storage.delete_folder, user_id, current_folder):
+        await context.bot.answer_callback_query(query.id, text="Folder deleted!", show_alert=True)
+        # Return to root (or parent, but logic resets to root if current deleted)
+        new_current = await storage.users.get_current_folder(user_id)
+        reply_markup = await render_file_list(user_id, new_current)
         await query.edit_message_text(
             text=f"📂 **Path: {new_current}**",
             parse_mode='Markdown',
             reply_markup=reply_markup
         )
-        
-    elif query.data.startswith('file:'):
-        await query.answer()
-        code = query.data.split(':')[1]
-        file_path = file_manager.get_file_path(code)
-        
-        if not file_path:
-            await query.edit_message_text("File not found.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data='list_files')]]))
-            return
-            
-        # Get file info
-        record = file_manager.db.get(code)
-        name = record.get("name", "Unknown") if record else "Unknown"
-        
-        keyboard = [
-            [InlineKeyboardButton("⬇️ Download", callback_data=f"dl:{code}")],
-            [InlineKeyboardButton("✏️ Rename", callback_data=f"rename_prompt:{code}")],
-            [InlineKeyboardButton("🗑️ Delete", callback_data=f"del_confirm:{code}")],
-            [InlineKeyboardButton("🔙 Back", callback_data='list_files')]
-        ]
-        
+    else:
+        await context.bot.answer_callback_query(query.id, text="Failed to delete folder.", show_alert=True)
+
+async def show_folder(query, user_id: int, offset: int = 0):
+    """Re-renders the user's current folder in the message the button belongs to."""
+    current_folder = await storage.users.get_current_folder(user_id)
+    reply_markup = await render_file_list(user_id, current_folder, offset)
+    try:
         await query.edit_message_text(
-            text=f"📄 **File Details**\n\n**Name:** {name}\n**Code:** `{code}`",
+            text=f"📂 **Path: {current_folder}**",
             parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=reply_markup
         )
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            raise
 
-    elif query.data.startswith('rename_prompt:'):
-        await query.answer()
-        code = query.data.split(':')[1]
-        user_states[user_id] = "WAIT_RENAME"
-        user_context[user_id] = code
-        await context.bot.send_message(
-            chat_id=user_id, 
-            text=f"✏️ **Rename File**\n\nPlease type the new name for file `{code}`:",
-            parse_mode='Markdown'
-        )
+async def get_selection(user_id: int) -> Optional[set]:
+    """The codes the user has picked, or None outside select mode."""
+    entry = await selections.get(user_id)
+    return set(entry[1]) if entry else None
 
-    elif query.data.startswith('dl:'):
-        await query.answer()
-        code = query.data.split(':')[1]
-        path = file_manager.get_file_path(code)
-        if path and os.path.exists(path):
-            await context.bot.send_document(chat_id=user_id, document=open(path, 'rb'))
-        else:
-            await context.bot.answer_callback_query(query.id, text="File not found!", show_alert=True)
+async def set_selection(user_id: int, codes):
+    # Every change restarts the TTL, so select mode ends like a prompt left unanswered
+    await selections.set(user_id, "SELECT", sorted(codes))
 
-    elif query.data.startswith('del_confirm:'):
-        await query.answer()
-        code = query.data.split(':')[1]
-        keyboard = [
-            [InlineKeyboardButton("✅ Yes, Delete", callback_data=f"del:{code}")],
-            [InlineKeyboardButton("❌ Cancel", callback_data=f"file:{code}")]
-        ]
-        await query.edit_message_text(
-            text=f"⚠️ Are you sure you want to delete file `{code}`?",
-            parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+@on_callback('select')
+async def select_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    if arg == 'on':
+        await set_selection(user_id, await get_selection(user_id) or ())
+    elif arg == 'off':
+        await selections.clear(user_id)
+    elif arg == 'none':
+        await set_selection(user_id, ())
+    elif arg == 'all':
+        # Every file in the current folder, not just the page on screen
+        current_folder = await storage.users.get_current_folder(user_id)
+        files = await storage.files.get_user_files(user_id, current_folder)
+        selected = await get_selection(user_id) or set()
+        await set_selection(user_id, selected.union(code for code, _, _ in files))
+    await show_folder(query, user_id)
 
-    elif query.data.startswith('del:'):
-        await query.answer()
-        code = query.data.split(':')[1]
-        if file_manager.delete_file(code, user_id):
-            await context.bot.answer_callback_query(query.id, text="File deleted!", show_alert=True)
-            # Return to list
-            current_folder = user_manager.get_current_folder(user_id)
-            reply_markup = get_file_list_markup(user_id, current_folder)
-            await query.edit_message_text(
-                text=f"📂 **Path: {current_folder}**",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-        else:
-            await context.bot.answer_callback_query(query.id, text="Failed to delete.", show_alert=True)
-            
-    elif query.data == 'mkdir_prompt':
-        await query.answer()
-        user_states[user_id] = "WAIT_MKDIR"
-        await context.bot.send_message(chat_id=user_id, text="📂 **New Folder**\n\nPlease type the name for the new folder:")
+@on_callback('pick')
+async def pick_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    code, _, offset = arg.partition(":")
+    selected = await get_selection(user_id) or set()
+    if code in selected:
+        selected.discard(code)
+    else:
+        selected.add(code)
+    await set_selection(user_id, selected)
+    await show_folder(query, user_id, int(offset) if offset.isdigit() else 0)
 
-    elif query.data == 'del_folder_confirm':
-        await query.answer()
-        current_folder = user_manager.get_current_folder(user_id)
-        if current_folder == "/":
-            await context.bot.answer_callback_query(query.id, text="Cannot delete root!", show_alert=True)
-            return
-            
+BULK_PROMPTS = {
+    "move": "📁 **Move {n} files**\n\nPlease type the folder to move them to, from the top (e.g. `photos/2024`, or `~` for the top level):",
+    "copy": "📋 **Copy {n} files**\n\nPlease type the folder to copy them to, from the top (e.g. `photos/2024`, or `~` for the top level):",
+    "tag": "🏷️ **Tag {n} files**\n\nPlease type the tags to add, separated by spaces; prefix a tag with `-` to remove it:",
+}
+
+@on_callback('bulk')
+async def bulk_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    selected = await get_selection(user_id)
+    if not selected:
+        await context.bot.answer_callback_query(query.id, text="No files selected.", show_alert=True)
+        return
+    if arg == 'del':
         keyboard = [
-            [InlineKeyboardButton("✅ Yes, Delete Folder", callback_data='del_folder')],
-            [InlineKeyboardButton("❌ Cancel", callback_data='list_files')]
+            [InlineKeyboardButton(f"✅ Yes, Delete {len(selected)} Files", callback_data=callbacks.encode('bulk_del'))],
+            [InlineKeyboardButton("❌ Cancel", callback_data=callbacks.encode('list_files'))]
         ]
         await query.edit_message_text(
-            text=f"⚠️ **Delete Folder?**\n\nAre you sure you want to delete `{current_folder}` and ALL files inside it?",
-            parse_mode='Markdown',
+            text=f"⚠️ Are you sure you want to delete {len(selected)} files?",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
+    elif arg in BULK_PROMPTS:
+        await storage.states.set(user_id, "WAIT_BULK", arg)
+        await context.bot.send_message(chat_id=user_id, text=BULK_PROMPTS[arg].format(n=len(selected)), parse_mode='Markdown')
 
-    elif query.data == 'del_folder':
-        await query.answer()
-        current_folder = user_manager.get_current_folder(user_id)
-        if current_folder == "/":
-            await context.bot.answer_callback_query(query.id, text="Cannot delete root!", show_alert=True)
-            return
+@on_callback('bulk_del')
+async def bulk_del_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    query = update.callback_query
+    user_id = update.effective_chat.id
+    await query.answer()
+    # One commit for all of them; the stored files are removed in the background
+    codes = list(await get_selection(user_id) or ())
+    await selections.clear(user_id)
+    deleted = await storage.files.delete_files(codes, user_id)
+    await context.bot.answer_callback_query(query.id, text=f"{deleted} files deleted!", show_alert=True)
+    await show_folder(query, user_id)
 
-        # Delete files first
-        file_manager.delete_files_in_folder(user_id, current_folder)
-        # Delete folder
-        if user_manager.delete_folder(user_id, current_folder):
-            await context.bot.answer_callback_query(query.id, text="Folder deleted!", show_alert=True)
-            # Return to root (or parent, but logic resets to root if current deleted)
-            new_current = user_manager.get_current_folder(user_id)
-            reply_markup = get_file_list_markup(user_id, new_current)
-            await query.edit_message_text(
-                text=f"📂 **Path: {new_current}**",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-        else:
-            await context.bot.answer_callback_query(query.id, text="Failed to delete folder.", show_alert=True)
+async def run_bulk(user_id: int, op: str, text: str) -> str:
+    """Applies a move, copy or tag prompt's answer to the picked files; returns the reply."""
+    codes = list(await get_selection(user_id) or ())
+    if not codes:
+        return "❌ No files selected."
+    if op == "tag":
+        words = text.split()
+        add = [word for word in words if not word.startswith("-")]
+        remove = [word[1:] for word in words if word.startswith("-")]
+        changed = await storage.files.tag_files(codes, user_id, add, remove)
+        await selections.clear(user_id)
+        return f"✅ Tags updated on {changed} files."
+    # Paths are taken from the top, since an answer starting with "/" would be sent as a command
+    folder = await storage.users.resolve_folder(user_id, "/" + text.strip().lstrip("~").strip("/"))
+    if folder is None:
+        return f"❌ Folder `{text}` not found."
+    await selections.clear(user_id)
+    if op == "move":
+        moved = await storage.files.move_files(codes, user_id, folder)
+        return f"✅ Moved {moved} files to `{folder}`."
+    copies = await storage.files.copy_files(codes, user_id, folder)
+    return f"✅ Copied {len(copies)} files to `{folder}`."
 
-def is_authorized(update: Update) -> bool:
-    return user_manager.is_registered(update.effective_chat.id)
+async def is_authorized(update: Update) -> bool:
+    return await storage.users.is_registered(update.effective_chat.id)
+
+def write_blob(data: bytes):
+    """Hashes and stores bytes in the blob store (blocking; run it with storage.run_io)."""
+    with blob_store.ingest() as out:
+        out.write(data)
+    return out
+
+def copy_blob(path: str):
+    """Copies a file into the blob store a chunk at a time (blocking; run it with storage.run_io)."""
+    with open(path, "rb") as f, blob_store.ingest() as out:
+        shutil.copyfileobj(f, out, DOWNLOAD_CHUNK)
+    return out
+
+async def download_blob(file) -> HashingWriter:
+    """Streams a Telegram file into the blob store, holding one chunk in memory at a time.
+
+    Each chunk is hashed and written on the io executor, like write_blob.
+    """
+    if not file.file_path.startswith(("http://", "https://")):
+        # A local Bot API server hands out paths on this machine
+        return await storage.run_io(copy_blob, file.file_path)
+    ingest = blob_store.ingest()
+    out = await storage.run_io(ingest.__enter__)
+    try:
+        async with download_client.stream("GET", file.file_path) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK):
+                await storage.run_io(out.write, chunk)
+    except BaseException as e:
+        await storage.run_io(ingest.__exit__, type(e), e, e.__traceback__)  # Removes the temp file
+        raise
+    await storage.run_io(ingest.__exit__, None, None, None)
+    return out
+
+def saved_file_markup(code: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton("✏️ Rename", callback_data=callbacks.encode('rename_prompt', code))]])
+
+# Where the time of a received attachment goes: waiting for a download slot, streaming it from
+# Telegram into the blob store, and adding the file record
+UPLOAD_PHASES = {phase: metrics.registry.histogram("bot_upload_phase_seconds", "Time per phase of storing a received attachment",
+                                                   phase=phase)
+                 for phase in ("queued", "download", "record")}
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_authorized(update):
+    if not await is_authorized(update):
         await update.message.reply_text("Please `/register` first.")
         return
 
@@ -336,8 +736,10 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if isinstance(attachment, (list, tuple)):
         file_obj = attachment[-1]
         file_name = f"{file_obj.file_unique_id}.jpg"
+        kind = "photo"
     else:
         file_obj = attachment
+        kind = type(attachment).__name__.lower()
         if hasattr(attachment, 'file_name'):
             file_name = attachment.file_name
         else:
@@ -348,26 +750,58 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.caption:
         display_name = update.message.caption
 
-    file = await file_obj.get_file()
-    save_path = get_save_path(file_name)
-    await file.download_to_drive(save_path)
-    
-    # Get current folder
-    current_folder = user_manager.get_current_folder(update.effective_chat.id)
-    
-    # Generate Secret Code with ownership and folder
-    code = file_manager.save_file_record(str(save_path), update.effective_chat.id, display_name, current_folder)
-    
-    keyboard = [[InlineKeyboardButton("✏️ Rename", callback_data=f"rename_prompt:{code}")]]
-    
-    await update.message.reply_text(
-        f"File saved to `{current_folder}`! \n\nCode: `{code}`",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    user_id = update.effective_chat.id
+    # Get current folder now, so navigating while a large file downloads does not move it
+    current_folder = await storage.users.get_current_folder(user_id)
+
+    existing = await storage.files.find_by_unique_id(file_obj.file_unique_id)
+    if existing:
+        # Same content was stored before (forwarded or re-sent): just add a record, no download or disk write
+        code = await storage.files.save_file_record(existing["path"], user_id, display_name, current_folder,
+                                                    sha256=existing.get("sha256"), size=existing.get("size"), file_name=file_name,
+                                                    tg_unique_id=file_obj.file_unique_id, tg_file_id=file_obj.file_id, tg_kind=kind)
+        await update.message.reply_text(
+            f"File saved to `{current_folder}`! \n\nCode: `{code}`",
+            reply_markup=saved_file_markup(code)
+        )
+        return
+
+    # Acknowledge right away and download in the background, so other users are not kept waiting
+    waiting = download_scheduler.queue_depth
+    ack = await update.message.reply_text(f"⏳ Receiving file... ({waiting} ahead in queue)" if waiting else "⏳ Receiving file...")
+    submitted = time.perf_counter()
+
+    async def store():
+        UPLOAD_PHASES["queued"].observe(time.perf_counter() - submitted)
+        try:
+            # Hashed and written off the event loop as it arrives; identical content is stored once
+            with UPLOAD_PHASES["download"].time():
+                file = await file_obj.get_file()
+                out = await download_blob(file)
+        except Exception:
+            logging.exception("Failed to download attachment for user %s", user_id)
+            await ack.edit_text("❌ Failed to save file. Please send it again.")
+            return
+
+        # Generate Secret Code with ownership and folder
+        with UPLOAD_PHASES["record"].time():
+            code = await storage.files.save_file_record(str(out.path), user_id, display_name, current_folder,
+                                                        sha256=out.hexdigest(), size=out.size, file_name=file_name,
+                                                        tg_unique_id=file_obj.file_unique_id, tg_file_id=file_obj.file_id, tg_kind=kind)
+        await ack.edit_text(
+            f"File saved to `{current_folder}`! \n\nCode: `{code}`",
+            reply_markup=saved_file_markup(code)
+        )
+        # Start the web preview now, so galleries never wait for it (the first call scans the preview cache)
+        preview = preview_kind(file_name, kind)
+        if preview:
+            await storage.run_io(thumbnailer.submit, str(out.path), out.hexdigest(), preview)
+
+    download_scheduler.submit(user_id, store)
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Allow register command to pass (though filters handle this, good safety)
-    if not is_authorized(update):
+    if not await is_authorized(update):
         await update.message.reply_text("Please `/register` first.")
         return
 
@@ -375,34 +809,32 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
     
     # Check for active state
-    state = user_states.get(user_id)
+    state, state_data = await storage.states.get(user_id) or (None, None)
+    if state:
+        # Whatever the answer, the prompt is done
+        await storage.states.clear(user_id)
     
     if state == "WAIT_MKDIR":
-        if user_manager.create_folder(user_id, text):
+        if await storage.users.create_folder(user_id, text):
             await update.message.reply_text(f"✅ Folder `{text}` created!")
             # Show updated list
-            current_folder = user_manager.get_current_folder(user_id)
-            reply_markup = get_file_list_markup(user_id, current_folder)
+            current_folder = await storage.users.get_current_folder(user_id)
+            reply_markup = await render_file_list(user_id, current_folder)
             await update.message.reply_text(f"📂 **Path: {current_folder}**", parse_mode='Markdown', reply_markup=reply_markup)
         else:
             await update.message.reply_text("❌ Failed to create folder (maybe it exists?).")
-        
-        if user_id in user_states: del user_states[user_id]
         return
         
     elif state == "WAIT_RENAME":
-        code = user_context.get(user_id)
-        if code and file_manager.rename_file(code, text, user_id):
+        code = state_data
+        if code and await storage.files.rename_file(code, text, user_id):
             await update.message.reply_text(f"✅ File renamed to: {text}")
         else:
             await update.message.reply_text("❌ Failed to rename.")
-            
-        if user_id in user_states: del user_states[user_id]
-        if user_id in user_context: del user_context[user_id]
         return
         
     elif state == "WAIT_SEARCH":
-        results = file_manager.search_files(text, user_id)
+        results = await storage.files.search_files(text, user_id)
         if not results:
             await update.message.reply_text(f"🔍 No files found for '{text}'.")
         else:
@@ -410,55 +842,56 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             for code, name, _ in results:
                 message += f"📄 `{code}` - {name}\n"
             await update.message.reply_text(message, parse_mode='Markdown')
-            
-        if user_id in user_states: del user_states[user_id]
         return
         
+    elif state == "WAIT_BULK":
+        await update.message.reply_text(await run_bulk(user_id, state_data, text))
+        current_folder = await storage.users.get_current_folder(user_id)
+        reply_markup = await render_file_list(user_id, current_folder)
+        await update.message.reply_text(f"📂 **Path: {current_folder}**", parse_mode='Markdown', reply_markup=reply_markup)
+        return
+
     elif state == "WAIT_PASSWORD":
-        user_manager.set_web_password(user_id, text)
+        await storage.users.set_web_password(user_id, text)
         await update.message.reply_text(f"✅ Web password set! You can now login at the website with User ID `{user_id}`.")
-        if user_id in user_states: del user_states[user_id]
         return
 
     # Normal text handling (save as text file or retrieve by code)
-    file_path_str = file_manager.get_file_path(text)
+    file_path_str = await storage.files.get_file_path(text)
     
     if file_path_str:
         if os.path.exists(file_path_str):
             # Check if it's a text file we created
-            if file_path_str.endswith(".txt"):
+            download_name = await storage.files.get_download_name(text)
+            if download_name.endswith(".txt"):
                 try:
-                    with open(file_path_str, "r", encoding="utf-8") as f:
-                        content = f.read()
+                    content = await storage.read_text(file_path_str)
                     await update.message.reply_text(f"📝 **Note/Link** (Code: {text}):\n\n{content}", parse_mode='Markdown')
                 except Exception:
                     # Fallback if read fails
-                    await update.message.reply_document(document=open(file_path_str, 'rb'), caption=f"Here is your file (Code: {text})")
+                    await send_stored_file(context.bot, user_id, text, caption=f"Here is your file (Code: {text})")
             else:
-                await update.message.reply_document(document=open(file_path_str, 'rb'), caption=f"Here is your file (Code: {text})")
+                await send_stored_file(context.bot, user_id, text, caption=f"Here is your file (Code: {text})")
         else:
             await update.message.reply_text("File not found on server.")
     else:
         ensure_download_dir()
         safe_prefix = "".join(c for c in text[:10] if c.isalnum()) or "text"
         file_name = f"{safe_prefix}_{update.message.id}.txt"
-        save_path = get_save_path(file_name)
         
-        with open(save_path, "w", encoding="utf-8") as f:
-            f.write(text)
+        out = await storage.run_io(write_blob, text.encode("utf-8"))
             
-        current_folder = user_manager.get_current_folder(update.effective_chat.id)
-        code = file_manager.save_file_record(str(save_path), update.effective_chat.id, f"Note: {safe_prefix}...", current_folder)
-        
-        keyboard = [[InlineKeyboardButton("✏️ Rename", callback_data=f"rename_prompt:{code}")]]
+        current_folder = await storage.users.get_current_folder(update.effective_chat.id)
+        code = await storage.files.save_file_record(str(out.path), update.effective_chat.id, f"Note: {safe_prefix}...", current_folder,
+                                                    sha256=out.hexdigest(), size=out.size, file_name=file_name)
         
         await update.message.reply_text(
             f"Text saved to `{current_folder}`! \n\nCode: `{code}`",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=saved_file_markup(code)
         )
 
 async def admin_login(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_authorized(update): return
+    if not await is_authorized(update): return
     args = context.args
     if len(args) != 1:
         await update.message.reply_text("Usage: `/admin_login <secret_key>`")
@@ -467,13 +900,28 @@ async def admin_login(update: Update, context: ContextTypes.DEFAULT_TYPE):
     secret = args[0]
     # Hardcoded secret for simplicity as per plan
     if secret == "bharath":
-        user_manager.set_admin(update.effective_chat.id, True)
+        await storage.users.set_admin(update.effective_chat.id, True)
         await update.message.reply_text("👑 You are now an **Admin**! You can access the Admin Panel on the website.")
     else:
         await update.message.reply_text("❌ Invalid secret key.")
 
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_authorized(update): return
+    if not await storage.users.is_admin(update.effective_chat.id):
+        await update.message.reply_text("❌ Admins only.")
+        return
+
+    cache = render_cache.stats()
+    await update.message.reply_text(
+        "📊 **Stats**\n\n"
+        f"**Folder view cache:** {cache['size']}/{cache['capacity']} entries\n"
+        f"Hits: {cache['hits']} | Misses: {cache['misses']} | Hit rate: {cache['hit_rate']:.1%}\n"
+        f"**Download queue:** {download_scheduler.running} running, {download_scheduler.queue_depth} waiting",
+        parse_mode='Markdown'
+    )
+
 async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_authorized(update):
+    if not await is_authorized(update):
         await update.message.reply_text("Please `/register` first.")
         return
 
@@ -484,7 +932,7 @@ async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     query = " ".join(args)
     user_id = update.effective_chat.id
-    results = file_manager.search_files(query, user_id)
+    results = await storage.files.search_files(query, user_id)
 
     if not results:
         await update.message.reply_text(f"🔍 No files found for '{query}'.")
@@ -496,23 +944,82 @@ async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(message, parse_mode='Markdown')
 
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile start [ms] | stop: toggles the sampling profiler; stop sends the collapsed stacks."""
+    if not await is_authorized(update): return
+    if not await storage.users.is_admin(update.effective_chat.id):
+        await update.message.reply_text("❌ Admins only.")
+        return
+
+    action = context.args[0] if context.args else ""
+    if action == "start":
+        try:
+            started = metrics.sampler.start((float(context.args[1]) if len(context.args) > 1 else 10.0) / 1000)
+        except ValueError:
+            await update.message.reply_text("❌ The interval must be a positive number of milliseconds.")
+            return
+        state = "sampling" if started else "already sampling"
+        await update.message.reply_text(f"🔬 Profiler {state} every {metrics.sampler.interval * 1000:g} ms.")
+    elif action == "stop":
+        metrics.sampler.stop()
+        report = metrics.sampler.report()
+        if not report:
+            await update.message.reply_text("No samples collected.")
+            return
+        await update.message.reply_document(document=report.encode("utf-8"), filename="profile.folded",
+                                            caption=f"{metrics.sampler.samples} samples (open with speedscope or flamegraph.pl)")
+    else:
+        state = f"running, every {metrics.sampler.interval * 1000:g} ms" if metrics.sampler.running else "stopped"
+        await update.message.reply_text(f"Profiler is {state}. Usage: `/profile start [ms]` or `/profile stop`",
+                                        parse_mode='Markdown')
+
 # Deprecated/Legacy commands (kept for compatibility if needed, but flow is now interactive)
 async def list_files_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await list_files(update, context)
 
-if __name__ == '__main__':
-    token = os.getenv("BOT_TOKEN")
-    if not token:
-        print("Error: BOT_TOKEN not found in .env file.")
-        exit(1)
-    
-    application = ApplicationBuilder().token(token).build()
+# Optional: append every incoming update to a JSONL file, e.g. to replay it with benchmarks.bench_webhook
+RECORD_UPDATES = os.getenv("RECORD_UPDATES")
+record_lock = threading.Lock()
+
+def append_update(data: dict):
+    with record_lock, open(RECORD_UPDATES, "a", encoding="utf-8") as f:
+        f.write(json.dumps(data) + "\n")
+
+async def record_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await storage.run_io(append_update, update.to_dict())
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest recording each Bot API call's duration by method, to tell Telegram I/O apart from our own work."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        histogram = metrics.registry.histogram("telegram_api_seconds", "Bot API request time, by API method",
+                                               method=url.rsplit("/", 1)[-1])
+        with histogram.time():
+            return await super().do_request(url, method, *args, **kwargs)
+
+def build_application(token: str, base_url: str = None, concurrency: int = 1, request: BaseRequest = None) -> Application:
+    """Creates the bot Application with all handlers; the same one runs in polling and webhook mode.
+
+    `request` replaces the Bot API transport (benchmarks.bench_bot passes an in-process fake).
+    """
+    # Long polls (getUpdates) keep the builder's own request, so they do not swamp the API timings
+    request = request or TimedRequest(connection_pool_size=256)
+    builder = ApplicationBuilder().token(token).concurrent_updates(concurrency).request(request)
+    if base_url:
+        # A self-hosted Bot API server, or the fake one the benchmarks use
+        builder = builder.base_url(base_url)
+    application = builder.build()
+
+    if RECORD_UPDATES:
+        application.add_handler(TypeHandler(Update, record_update), group=-1)
     
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('register', register))
     application.add_handler(CommandHandler('list', list_files_command))
     application.add_handler(CommandHandler('admin_login', admin_login))
     application.add_handler(CommandHandler('search', search))
+    application.add_handler(CommandHandler('stats', stats))
+    application.add_handler(CommandHandler('profile', profile))
     application.add_handler(CommandHandler('home', home))
     
     # Callback Handler
@@ -520,6 +1027,50 @@ if __name__ == '__main__':
     
     application.add_handler(MessageHandler(filters.ATTACHMENT | filters.PHOTO | filters.VIDEO | filters.AUDIO, handle_document))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    return application
+
+def start_web(port: int):
+    """Serves the web app (asgi_app) from a background thread of this process, sharing its storage with the bot."""
+    import uvicorn
+    from asgi_app import app as web_app
+
+    server = uvicorn.Server(uvicorn.Config(web_app, host=os.getenv("WEB_HOST", "0.0.0.0"), port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True, name="web").start()
+    return server
+
+if __name__ == '__main__':
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        print("Error: BOT_TOKEN not found in .env file.")
+        exit(1)
     
-    print("Bot is running...")
-    application.run_polling()
+    metrics_port = os.getenv("METRICS_PORT")
+    if metrics_port:
+        metrics.serve(int(metrics_port), os.getenv("METRICS_HOST", "127.0.0.1"))
+        print(f"Metrics are served on port {metrics_port}...")
+    metrics.start_sampler_from_env()
+
+    web_port = os.getenv("WEB_PORT")
+    if web_port:
+        start_web(int(web_port))
+        print(f"Web app is running on port {web_port}...")
+
+    concurrency = int(os.getenv("BOT_CONCURRENCY", "8"))
+    application = build_application(token, os.getenv("TELEGRAM_API_URL"), concurrency)
+    
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if webhook_url:
+        print("Bot is running (webhook)...")
+        run_webhook(
+            application,
+            listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", "8443")),
+            path=os.getenv("WEBHOOK_PATH", "/telegram"),
+            secret_token=os.getenv("WEBHOOK_SECRET"),
+            webhook_url=webhook_url,
+            workers=concurrency,
+            max_pending=int(os.getenv("WEBHOOK_MAX_PENDING", "256"))
+        )
+    else:
+        print("Bot is running...")
+        application.run_polling()
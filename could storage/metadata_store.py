@@ -0,0 +1,340 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Union
+
+SQLITE_DB_FILE = Path("file_db.sqlite3")
+CHANGE_LOG_KEEP = 100000  # Entries kept in the SQLite change log; a reader further behind reloads everything
+
+# A record is normally a dict, but very old databases stored the bare path string.
+Record = Union[dict, str]
+
+
+class MetadataStore:
+    """Persistence backend for FileManager records, keyed by file code."""
+
+    def load_all(self) -> dict:
+        """Returns every stored record as a {code: record} dict."""
+        raise NotImplementedError
+
+    def upsert(self, code: str, record: Record):
+        """Inserts or replaces a single record."""
+        raise NotImplementedError
+
+    def delete(self, code: str):
+        """Removes a single record (no-op if it does not exist)."""
+        raise NotImplementedError
+
+    @contextmanager
+    def transaction(self):
+        """Groups several upserts/deletes into one commit where supported."""
+        yield
+
+    def change_seq(self) -> int:
+        """Current position in the store's change log (0 if it keeps none)."""
+        return 0
+
+    def changes_since(self, seq: int) -> Optional[tuple]:
+        """Returns ({code: record, or None if deleted}, new seq) for writes after `seq`, by any process.
+
+        Returns None if the log no longer reaches back to `seq`. Stores that only
+        one process can use keep no log and always report no changes.
+        """
+        return {}, seq
+
+    def log_id(self) -> Optional[str]:
+        """Identifies the store's change log, so positions in it can be handed between processes; None if it keeps none."""
+        return None
+
+    def change_log(self, seq: int) -> Optional[tuple]:
+        """Like changes_since, but always reads the log, including this process's own writes."""
+        return {}, seq
+
+    def close(self):
+        pass
+
+
+class MemoryMetadataStore(MetadataStore):
+    """Non-persistent store, used for benchmarks and throwaway instances."""
+
+    def __init__(self, records: dict = None):
+        self.records = dict(records or {})
+
+    def load_all(self) -> dict:
+        return dict(self.records)
+
+    def upsert(self, code: str, record: Record):
+        self.records[code] = record
+
+    def delete(self, code: str):
+        self.records.pop(code, None)
+
+
+class JsonMetadataStore(MetadataStore):
+    """The original single-file JSON database (rewritten on every change)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.records = self._read()
+        self._batch_depth = 0
+
+    def _read(self) -> dict:
+        if self.path.exists():
+            try:
+                with open(self.path, "r") as f:
+                    return json.load(f)
+            except json.JSONDecodeError:
+                return {}
+        return {}
+
+    def _write(self):
+        if self._batch_depth:
+            return
+        # Write to a temp file first so a crash never leaves a truncated database
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.records, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def load_all(self) -> dict:
+        return dict(self.records)
+
+    def upsert(self, code: str, record: Record):
+        self.records[code] = record
+        self._write()
+
+    def delete(self, code: str):
+        if self.records.pop(code, None) is not None:
+            self._write()
+
+    @contextmanager
+    def transaction(self):
+        """Writes the file once when the outermost block exits; if it raises, the records are put back instead."""
+        outermost = self._batch_depth == 0
+        # Shallow is enough: records are replaced on change, never edited in place
+        snapshot = dict(self.records) if outermost else None
+        self._batch_depth += 1
+        try:
+            yield
+        except BaseException:
+            self._batch_depth -= 1
+            if outermost:
+                self.records = snapshot
+            raise
+        self._batch_depth -= 1
+        self._write()
+
+
+class SQLiteMetadataStore(MetadataStore):
+    """SQLite (WAL) backend: each change is a single-row upsert or delete.
+
+    The full record is kept as JSON in `data`; code, owner_id, folder and name
+    are also stored in their own indexed columns so they can be queried directly.
+    Triggers log every changed code to `file_changes`, so processes sharing the
+    database can pick up each other's writes (changes_since).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            code TEXT PRIMARY KEY,
+            owner_id INTEGER,
+            folder TEXT,
+            name TEXT,
+            path TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_files_owner_folder ON files(owner_id, folder);
+        CREATE INDEX IF NOT EXISTS idx_files_folder ON files(folder);
+        CREATE INDEX IF NOT EXISTS idx_files_name ON files(name);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS file_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT NOT NULL
+        );
+        CREATE TRIGGER IF NOT EXISTS files_log_insert AFTER INSERT ON files
+            BEGIN INSERT INTO file_changes (code) VALUES (new.code); END;
+        CREATE TRIGGER IF NOT EXISTS files_log_update AFTER UPDATE ON files
+            BEGIN INSERT INTO file_changes (code) VALUES (new.code); END;
+        CREATE TRIGGER IF NOT EXISTS files_log_delete AFTER DELETE ON files
+            BEGIN INSERT INTO file_changes (code) VALUES (old.code); END;
+    """
+
+    def __init__(self, path: Path = SQLITE_DB_FILE, prune_every: int = 1000, checkpoint_interval: float = 1.0):
+        self.path = Path(path)
+        # Shared between the bot's handlers and Flask's worker threads, so writes are serialized by a lock
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self.prune_every = prune_every
+        self._writes = 0
+        self._data_version = None
+        self.conn = sqlite3.connect(str(self.path), isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        # Fixed when the database is created, so a cursor from another database (or a recreated one) is rejected
+        self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('change_log_id', ?)", (secrets.token_hex(4),))
+        self._log_id = self.get_meta("change_log_id")
+        # Left to SQLite, checkpoints run inside whichever commit fills the WAL and stall it (and every
+        # caller queued behind it) for longer the larger the database is; a background thread does them
+        self.conn.execute("PRAGMA wal_autocheckpoint=0")
+        self._stop = threading.Event()
+        self._checkpointer = threading.Thread(target=self._checkpoint_loop, args=(checkpoint_interval,),
+                                              daemon=True, name="sqlite-checkpoint")
+        self._checkpointer.start()
+
+    def _checkpoint_loop(self, interval: float):
+        # A connection of its own: a PASSIVE checkpoint never blocks readers or writers
+        conn = sqlite3.connect(str(self.path), isolation_level=None, check_same_thread=False)
+        written = self._writes
+        try:
+            while not self._stop.wait(interval):
+                if self._writes == written:
+                    continue
+                written = self._writes
+                try:
+                    conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+                except sqlite3.OperationalError:
+                    pass  # Busy; the next tick tries again
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _columns(code: str, record: Record) -> tuple:
+        data = json.dumps(record)
+        if isinstance(record, dict):
+            return (code, record.get("owner_id"), record.get("folder", "/"),
+                    record.get("name"), record.get("path"), data)
+        # Legacy string record: only the path is known
+        return (code, None, None, None, record, data)
+
+    def load_all(self) -> dict:
+        with self._lock:
+            rows = self.conn.execute("SELECT code, data FROM files").fetchall()
+        return {code: json.loads(data) for code, data in rows}
+
+    def upsert(self, code: str, record: Record):
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO files (code, owner_id, folder, name, path, data) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(code) DO UPDATE SET owner_id=excluded.owner_id, folder=excluded.folder, "
+                "name=excluded.name, path=excluded.path, data=excluded.data",
+                self._columns(code, record)
+            )
+            self._wrote()
+
+    def delete(self, code: str):
+        with self._lock:
+            self.conn.execute("DELETE FROM files WHERE code = ?", (code,))
+            self._wrote()
+
+    def _wrote(self):
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.conn.execute("DELETE FROM file_changes WHERE seq <= (SELECT MAX(seq) FROM file_changes) - ?",
+                              (CHANGE_LOG_KEEP,))
+
+    def change_seq(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM file_changes").fetchone()[0]
+
+    def changes_since(self, seq: int) -> Optional[tuple]:
+        with self._lock:
+            # data_version only moves when another connection commits, which makes the common case one cheap query
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._data_version:
+                # Nobody else committed, so everything logged since is our own
+                return {}, max(seq, self.change_seq())
+            result = self.change_log(seq)
+            if result is not None:
+                self._data_version = version
+            return result
+
+    def change_log(self, seq: int) -> Optional[tuple]:
+        with self._lock:
+            rows = self.conn.execute("SELECT seq, code FROM file_changes WHERE seq > ? ORDER BY seq", (seq,)).fetchall()
+            oldest = self.conn.execute("SELECT MIN(seq) FROM file_changes").fetchone()[0]
+            if oldest is not None and oldest > seq + 1:
+                return None
+            if not rows:
+                return {}, seq
+            codes = list(dict.fromkeys(code for _, code in rows))
+            changes = dict.fromkeys(codes)
+            for start in range(0, len(codes), 500):
+                chunk = codes[start:start + 500]
+                changes.update((code, json.loads(data)) for code, data in self.conn.execute(
+                    f"SELECT code, data FROM files WHERE code IN ({','.join('?' * len(chunk))})", chunk))
+            return changes, rows[-1][0]
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            outermost = self._batch_depth == 0
+            if outermost:
+                self.conn.execute("BEGIN IMMEDIATE")
+            self._batch_depth += 1
+            try:
+                yield
+            except BaseException:
+                self._batch_depth -= 1
+                if outermost:
+                    self.conn.execute("ROLLBACK")
+                raise
+            self._batch_depth -= 1
+            if outermost:
+                self.conn.execute("COMMIT")
+
+    def log_id(self) -> str:
+        return self._log_id
+
+    def get_meta(self, key: str):
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                (key, value)
+            )
+
+    def close(self):
+        self._stop.set()
+        self._checkpointer.join()
+        with self._lock:
+            self.conn.close()
+
+
+def migrate_json_to_sqlite(json_path: Path, store: SQLiteMetadataStore) -> int:
+    """Copies every record from a file_db.json into the SQLite store in one transaction.
+
+    Runs at most once per store; returns the number of records imported.
+    Unlike the old loader, a corrupt JSON file raises instead of being treated as empty.
+    """
+    json_path = Path(json_path)
+    if store.get_meta("json_migrated") or not json_path.exists():
+        return 0
+
+    with open(json_path, "r") as f:
+        records = json.load(f)
+
+    with store.transaction():
+        for code, record in records.items():
+            # Legacy string-valued records are kept as-is so get_file_path still resolves them
+            store.upsert(code, record)
+        store.set_meta("json_migrated", str(json_path))
+    return len(records)
+
+
+if __name__ == "__main__":
+    from file_manager import DB_FILE
+    sqlite_store = SQLiteMetadataStore()
+    count = migrate_json_to_sqlite(DB_FILE, sqlite_store)
+    print(f"Migrated {count} records from {DB_FILE} to {sqlite_store.path}")
@@ -0,0 +1,307 @@
+import bisect
+import functools
+import inspect
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency buckets, from 100µs to 10s
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Clients allowed to read /metrics from the web apps
+LOCAL_ADDRESSES = {"127.0.0.1", "::1", "localhost"}
+
+
+class Histogram:
+    """Observation counts per latency bucket for one metric and label set."""
+
+    __slots__ = ("counts", "total", "_lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # The last bucket is +Inf
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.total += seconds
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            return list(self.counts), self.total
+
+    def time(self) -> "Timer":
+        return Timer(self)
+
+
+class Timer:
+    """Context manager observing the time spent in its block, also when the block raises."""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry:
+    """Histograms, gauges and counters of this process, rendered in the Prometheus text format.
+
+    Histograms are created on first use and live for the whole process, so a
+    hot path should look its histogram up once and keep it; an observation is
+    then two clock reads, a bisect and an uncontended lock.
+    """
+
+    def __init__(self):
+        self._help = {}        # metric name -> help text
+        self._histograms = {}  # metric name -> {labels tuple: Histogram}
+        self._values = {}      # metric name -> ("gauge" or "counter", function returning the current value)
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help: str = "", **labels) -> Histogram:
+        key = tuple(sorted(labels.items()))
+        family = self._histograms.get(name)
+        histogram = family.get(key) if family is not None else None
+        if histogram is None:
+            with self._lock:
+                self._help.setdefault(name, help)
+                histogram = self._histograms.setdefault(name, {}).setdefault(key, Histogram())
+        return histogram
+
+    def gauge(self, name: str, help: str, read: Callable[[], float]):
+        """Reports `read()` as the gauge's value on every scrape."""
+        with self._lock:
+            self._help[name] = help
+            self._values[name] = ("gauge", read)
+
+    def counter(self, name: str, help: str, read: Callable[[], float]):
+        """Like gauge, for a value that only ever grows (e.g. an existing hit counter)."""
+        with self._lock:
+            self._help[name] = help
+            self._values[name] = ("counter", read)
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = {name: dict(family) for name, family in self._histograms.items()}
+            values = dict(self._values)
+        lines = []
+        for name in sorted(histograms):
+            lines.append(f"# HELP {name} {self._help.get(name, '')}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in sorted(histograms[name].items()):
+                counts, total = histogram.snapshot()
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(key)} {total}")
+                lines.append(f"{name}_count{format_labels(key)} {cumulative}")
+        for name in sorted(values):
+            kind, read = values[name]
+            try:
+                value = float(read())
+            except Exception:
+                logger.exception("Reading metric %s failed", name)
+                continue
+            lines.append(f"# HELP {name} {self._help.get(name, '')}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(key: tuple) -> str:
+    if not key:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in key)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(key, escaped)) + "}"
+
+
+registry = Registry()
+# Content type of registry.render() for HTTP responses
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def timed(name: str, help: str = "", **labels):
+    """Decorator recording every call's duration in a histogram; works on plain and async functions."""
+    def decorate(func):
+        histogram = registry.histogram(name, help, **labels)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def timed_async(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+            return timed_async
+
+        @functools.wraps(func)
+        def timed_call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return timed_call
+    return decorate
+
+
+def instrument(cls, name: str, help: str = "", **labels):
+    """Times every public method defined on `cls` under `name`, labelled with the method name.
+
+    Generator methods and context managers are left alone, since a call only creates them.
+    """
+    for attr, value in list(vars(cls).items()):
+        if (not attr.startswith("_") and inspect.isfunction(value)
+                and not inspect.isgeneratorfunction(inspect.unwrap(value))):
+            setattr(cls, attr, timed(name, help, method=attr, **labels)(value))
+    return cls
+
+
+class Sampler:
+    """Wall-clock sampling profiler for every thread of the process.
+
+    A background thread takes a snapshot of all thread stacks every
+    `interval` seconds and counts identical stacks. Threads waiting for I/O
+    or locks are sampled too, which is what shows whether a slow path is
+    waiting or computing. report() returns the counts as collapsed stacks,
+    one `thread;outer;...;inner count` line each, the input format of
+    flamegraph.pl and speedscope. Costs nothing while stopped.
+    """
+
+    def __init__(self):
+        self.interval = None
+        self.samples = 0
+        self.started = None
+        self._stacks = Counter()
+        self._frame_names = {}  # code object -> "function (file:line)"
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float = 0.01, reset: bool = True) -> bool:
+        """Starts sampling every `interval` seconds; False if it was already running (at its own interval)."""
+        if not (math.isfinite(interval) and interval > 0):
+            raise ValueError("interval must be a positive number of seconds")
+        with self._lock:
+            if self._thread is not None:
+                return False
+            if reset:
+                self._stacks.clear()
+                self.samples = 0
+            self.interval = interval
+            self.started = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="profile-sampler")
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def _frame_name(self, code) -> str:
+        name = self._frame_names.get(code)
+        if name is None:
+            name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._frame_names[code] = name
+        return name
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def report(self, limit: Optional[int] = None) -> str:
+        """Collapsed stacks, most sampled first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.copy().most_common(limit))
+
+
+sampler = Sampler()
+
+
+def start_sampler_from_env():
+    """Starts the sampler when PROFILE_SAMPLE_MS is set, at that interval."""
+    interval_ms = os.getenv("PROFILE_SAMPLE_MS")
+    if interval_ms:
+        sampler.start(float(interval_ms) / 1000)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics; GET /profile (collapsed stacks), /profile/start?interval_ms=10 and /profile/stop."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/metrics":
+            self._reply(registry.render(), CONTENT_TYPE)
+        elif url.path == "/profile":
+            self._reply(sampler.report())
+        elif url.path == "/profile/start":
+            try:
+                started = sampler.start(float(parse_qs(url.query).get("interval_ms", ["10"])[0]) / 1000)
+            except ValueError:
+                self.send_error(400, "interval_ms must be a positive number")
+                return
+            interval_ms = sampler.interval * 1000
+            if started:
+                self._reply(f"sampling every {interval_ms:g} ms\n")
+            else:
+                self._reply(f"already sampling every {interval_ms:g} ms; stop it first\n", status=409)
+        elif url.path == "/profile/stop":
+            sampler.stop()
+            self._reply(f"stopped after {sampler.samples} samples\n")
+        else:
+            self.send_error(404)
+
+    def _reply(self, text: str, content_type: str = "text/plain; charset=utf-8", status: int = 200):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the log
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serves MetricsHandler from a daemon thread; bound to localhost unless `host` says otherwise."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
@@ -0,0 +1,49 @@
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+
+class RenderCache:
+    """LRU cache of rendered views with hit/miss counters.
+
+    Keys are expected to include a version of whatever the view was rendered
+    from, so a change never has to find and evict stale entries: it bumps the
+    version, later lookups use the new key and old entries age out.
+    """
+
+    def __init__(self, capacity: int = 2048):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key: Hashable, valid: Optional[Callable] = None):
+        """Returns the cached value, or None; an entry failing `valid(value)` is dropped and counts as a miss."""
+        value = self._items.get(key)
+        if value is not None and valid is not None and not valid(value):
+            del self._items[key]
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,103 @@
+import heapq
+from typing import Optional
+
+
+class NgramIndex:
+    """Incremental inverted index for case-insensitive substring search.
+
+    Every 1-, 2- and 3-character gram of each text is indexed, so a query of up
+    to three characters is answered by a single posting lookup. Longer queries
+    intersect the postings of their trigrams (rarest first) and then confirm the
+    match, so the cost follows the size of the rarest trigram's posting list
+    rather than the number of indexed texts.
+    """
+
+    MAX_GRAM = 3
+
+    def __init__(self):
+        self.postings = {}  # gram -> set of keys
+        self.texts = {}     # key -> lowercased text
+
+    @classmethod
+    def _grams(cls, text: str) -> set:
+        grams = set()
+        for n in range(1, cls.MAX_GRAM + 1):
+            for i in range(len(text) - n + 1):
+                grams.add(text[i:i + n])
+        return grams
+
+    def add(self, key, text: str):
+        if key in self.texts:
+            self.remove(key)
+        text = text.lower()
+        self.texts[key] = text
+        for gram in self._grams(text):
+            self.postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        text = self.texts.pop(key, None)
+        if text is None:
+            return
+        for gram in self._grams(text):
+            keys = self.postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[gram]
+
+    def _matches(self, query: str, within) -> set:
+        if len(query) <= self.MAX_GRAM:
+            matches = self.postings.get(query, set())
+            return matches & within.keys() if within is not None else set(matches)
+
+        trigrams = {query[i:i + self.MAX_GRAM] for i in range(len(query) - self.MAX_GRAM + 1)}
+        postings = []
+        for gram in trigrams:
+            keys = self.postings.get(gram)
+            if not keys:
+                return set()
+            postings.append(keys)
+        postings.sort(key=len)
+        if within is not None and len(within) < len(postings[0]):
+            candidates = set(within)
+        else:
+            candidates = set(postings[0])
+        for keys in postings:
+            candidates &= keys
+            if not candidates:
+                return candidates
+        if within is not None:
+            candidates &= within.keys()
+        # Trigrams can all be present without being contiguous, so confirm the substring
+        return {key for key in candidates if query in self.texts[key]}
+
+    def _rank(self, key, query: str) -> tuple:
+        text = self.texts[key]
+        pos = text.find(query)
+        if text == query:
+            tier = 0
+        elif pos == 0:
+            tier = 1
+        elif not text[pos - 1].isalnum():
+            tier = 2  # Starts at a word boundary
+        else:
+            tier = 3
+        return (tier, pos, len(text), str(key))
+
+    def search(self, query: str, limit: Optional[int] = None, within: Optional[dict] = None) -> list:
+        """Returns keys whose text contains `query`, best matches first.
+
+        `within` (a dict or set of keys) restricts the search, e.g. to one owner's files.
+        """
+        query = query.lower()
+        if within is not None and not isinstance(within, dict):
+            within = dict.fromkeys(within)
+        if not query:
+            keys = list(within if within is not None else self.texts)
+            return keys[:limit] if limit is not None else keys
+
+        matches = self._matches(query, within)
+        rank = lambda key: self._rank(key, query)
+        if limit is not None:
+            return heapq.nsmallest(limit, matches, key=rank)
+        return sorted(matches, key=rank)
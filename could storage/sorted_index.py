@@ -0,0 +1,133 @@
+import base64
+import json
+import os
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+# Codes the per-scope views may hold together (about 100 bytes each); views of all records are not counted
+VIEW_CACHE_ENTRIES = int(os.getenv("VIEW_CACHE_ENTRIES", "500000"))
+
+
+class SortedCodes:
+    """Codes kept in (sort key, code) order; a page after any position is a bisect plus a slice."""
+
+    def __init__(self, items: Iterable[tuple] = ()):
+        self.items = sorted(items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, key, code: str):
+        insort(self.items, (key, code))
+
+    def remove(self, key, code: str) -> bool:
+        i = bisect_left(self.items, (key, code))
+        if i < len(self.items) and self.items[i] == (key, code):
+            del self.items[i]
+            return True
+        return False
+
+    def page(self, after: Optional[tuple], limit: int, descending: bool = False) -> tuple:
+        """Returns ([(key, code), ...], has_more) for up to `limit` entries past `after`."""
+        if descending:
+            end = len(self.items) if after is None else bisect_left(self.items, after)
+            start = max(0, end - limit)
+            return self.items[start:end][::-1], start > 0
+        start = 0 if after is None else bisect_right(self.items, after)
+        return self.items[start:start + limit], start + limit < len(self.items)
+
+
+class SortedViews:
+    """Lazily built SortedCodes per (scope, sort), kept up to date as records change.
+
+    A scope is whatever subset the caller pages through (e.g. None for all
+    records, or an (owner, folder) pair). Views are built on first use. Views
+    of all records are kept for good; the others are dropped least recently
+    used first once they hold more than `max_entries` codes together. The
+    budget counts codes rather than views, as memory does: thousands of
+    users' folders of a few dozen files fit in it side by side.
+    """
+
+    def __init__(self, sort_keys: dict, max_entries: int = VIEW_CACHE_ENTRIES):
+        self.sort_keys = sort_keys  # sort name -> function(record) -> key
+        self.max_entries = max_entries
+        self.entries = 0  # codes in the evictable views
+        self.hits = 0
+        self.misses = 0
+        self._views = OrderedDict()
+
+    def get(self, scope, sort: str, records: Callable[[], Iterable[tuple]]) -> SortedCodes:
+        """Returns the view for (scope, sort), building it from `records()` ((code, record) pairs) if needed."""
+        view = self._views.get((scope, sort))
+        if view is not None:
+            self.hits += 1
+            self._views.move_to_end((scope, sort))
+            return view
+        self.misses += 1
+        key = self.sort_keys[sort]
+        view = self._views[(scope, sort)] = SortedCodes((key(record), code) for code, record in records())
+        if scope is not None:
+            self.entries += len(view)
+            self._evict(keep=(scope, sort))
+        return view
+
+    def _evict(self, keep: tuple):
+        while self.entries > self.max_entries:
+            oldest = next(key for key in self._views if key[0] is not None)
+            if oldest == keep:
+                break  # A single view over the budget is still kept while it is being paged
+            self.entries -= len(self._views.pop(oldest))
+
+    def page(self, scope, sort: str, records: Callable[[], Iterable[tuple]], cursor: Optional[str] = None,
+             limit: int = 50, descending: bool = False) -> tuple:
+        """Returns (codes, next_cursor) for one page; next_cursor is None on the last page.
+
+        A cursor that does not decode for this sort starts from the first page.
+        """
+        view = self.get(scope, sort, records)
+        after = decode_cursor(cursor, sort)
+        try:
+            entries, more = view.page(after, limit, descending)
+        except TypeError:  # Key of the wrong type, e.g. a hand-edited cursor
+            entries, more = view.page(None, limit, descending)
+        next_cursor = encode_cursor(sort, entries[-1]) if more and entries else None
+        return [code for _, code in entries], next_cursor
+
+    def slice(self, scope, sort: str, records: Callable[[], Iterable[tuple]], start: int, limit: int) -> tuple:
+        """Returns (codes, total) for `limit` entries from position `start` (ascending)."""
+        view = self.get(scope, sort, records)
+        return [code for _, code in view.items[start:start + limit]], len(view)
+
+    def add(self, scope, code: str, record):
+        for sort, key in self.sort_keys.items():
+            view = self._views.get((scope, sort))
+            if view is not None:
+                view.add(key(record), code)
+                if scope is not None:
+                    self.entries += 1
+
+    def remove(self, scope, code: str, record):
+        for sort, key in self.sort_keys.items():
+            view = self._views.get((scope, sort))
+            if view is not None and view.remove(key(record), code) and scope is not None:
+                self.entries -= 1
+
+
+def encode_cursor(sort: str, position: tuple) -> str:
+    """Opaque page token for the entry a page ended at."""
+    data = json.dumps([sort, *position], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], sort: str) -> Optional[tuple]:
+    """Returns the (key, code) position from a page token, or None if it is missing, invalid or for another sort."""
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(data, list) or len(data) != 3 or data[0] != sort:
+        return None
+    return data[1], data[2]
@@ -0,0 +1,134 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+STATE_DB_FILE = Path("bot_state.sqlite3")
+STATE_TTL = 15 * 60  # A prompt left unanswered this long is forgotten
+
+
+class StateStore:
+    """Per-user conversation state: what the bot is waiting for, plus an optional argument.
+
+    Entries expire `ttl` seconds after they were set, so a prompt that is
+    never answered does not linger.
+    """
+
+    def __init__(self, ttl: float = STATE_TTL):
+        self.ttl = ttl
+
+    def get(self, user_id: int) -> Optional[tuple]:
+        """Returns (state, data) for the user, or None."""
+        raise NotImplementedError
+
+    def set(self, user_id: int, state: str, data=None):
+        raise NotImplementedError
+
+    def clear(self, user_id: int):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """In-process store; at most `max_entries` users are kept, oldest dropped first."""
+
+    def __init__(self, ttl: float = STATE_TTL, max_entries: int = 10000):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # user_id -> (state, data, expires at), oldest first
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, user_id: int) -> Optional[tuple]:
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None:
+                return None
+            if item[2] < time.monotonic():
+                del self._items[user_id]
+                return None
+            return item[0], item[1]
+
+    def set(self, user_id: int, state: str, data=None):
+        now = time.monotonic()
+        with self._lock:
+            self._items[user_id] = (state, data, now + self.ttl)
+            self._items.move_to_end(user_id)
+            # Every entry has the same TTL, so expired ones are always at the front
+            while self._items:
+                oldest = next(iter(self._items.values()))
+                if oldest[2] >= now and len(self._items) <= self.max_entries:
+                    break
+                self._items.popitem(last=False)
+
+    def clear(self, user_id: int):
+        with self._lock:
+            self._items.pop(user_id, None)
+
+
+class SQLiteStateStore(StateStore):
+    """SQLite (WAL) store that several bot processes can share.
+
+    Expired rows are ignored on read and deleted on every `sweep_every`-th set.
+    Stores for different kinds of state can share one database file, each
+    in its own `table`.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS {table} (
+            user_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL,
+            data TEXT,
+            expires REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_{table}_expires ON {table}(expires);
+    """
+
+    def __init__(self, path: Path = STATE_DB_FILE, ttl: float = STATE_TTL, sweep_every: int = 100,
+                 table: str = "user_state"):
+        super().__init__(ttl)
+        if not table.isidentifier():
+            raise ValueError(f"Invalid table name: {table!r}")
+        self.path = Path(path)
+        self.table = table
+        self.sweep_every = sweep_every
+        self._sets = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), isolation_level=None, check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA.format(table=table))
+
+    def get(self, user_id: int) -> Optional[tuple]:
+        with self._lock:
+            row = self.conn.execute(f"SELECT state, data FROM {self.table} WHERE user_id = ? AND expires > ?",
+                                    (user_id, time.time())).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]) if row[1] is not None else None
+
+    def set(self, user_id: int, state: str, data=None):
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                f"INSERT INTO {self.table} (user_id, state, data, expires) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, data = excluded.data, expires = excluded.expires",
+                (user_id, state, json.dumps(data) if data is not None else None, now + self.ttl))
+            self._sets += 1
+            if self._sets % self.sweep_every == 0:
+                self.conn.execute(f"DELETE FROM {self.table} WHERE expires <= ?", (now,))
+
+    def clear(self, user_id: int):
+        with self._lock:
+            self.conn.execute(f"DELETE FROM {self.table} WHERE user_id = ?", (user_id,))
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
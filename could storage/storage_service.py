@@ -0,0 +1,82 @@
+import logging
+import os
+import threading
+from typing import Optional
+from file_manager import FileManager
+from user_manager import UserManager
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for writes made by another process (0 disables the sync thread)
+SYNC_INTERVAL = float(os.getenv("STORAGE_SYNC_INTERVAL", "0.5"))
+
+
+class SharedStorage:
+    """The FileManager and UserManager of this process, shared by the bot and the web app.
+
+    When both front-ends run in one process (main.py with WEB_PORT set),
+    every write is visible to both immediately. When they run as separate
+    processes, a background thread picks up the other process's writes:
+    file records come from the SQLite change log and users from the journal.
+    Only the changed records are applied, so the databases are never
+    reloaded from disk.
+    """
+
+    def __init__(self, sync_interval: float = SYNC_INTERVAL):
+        self.file_manager = FileManager()
+        self.user_manager = UserManager()
+        self._stop = threading.Event()
+        self._syncer = None
+        if sync_interval > 0:
+            self._syncer = threading.Thread(target=self._sync_loop, args=(sync_interval,), daemon=True,
+                                            name="storage-sync")
+            self._syncer.start()
+
+    def sync(self) -> int:
+        """Applies other processes' writes now; returns how many file records and journal records were applied."""
+        return self.file_manager.sync() + self.user_manager.sync()
+
+    def _sync_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Storage sync failed")  # Retried on the next tick
+
+    def delete_folder(self, user_id: int, folder_path: str) -> bool:
+        return delete_folder_tree(self.file_manager, self.user_manager, user_id, folder_path)
+
+    def close(self):
+        self._stop.set()
+        if self._syncer is not None:
+            self._syncer.join()
+        self.user_manager.close()
+        self.file_manager.close()
+
+
+def delete_folder_tree(file_manager: FileManager, user_manager: UserManager, user_id: int, folder_path: str) -> bool:
+    """Deletes a folder, its subfolders and every file in them with one commit per manager.
+
+    The file records go first, so a crash or error in between leaves an
+    empty folder rather than files in a folder that no longer exists: if
+    either part raises, that manager's batch rolls back. The stored files are
+    removed afterwards by the file manager's reaper.
+    """
+    if folder_path == "/" or not user_manager.folder_exists(user_id, folder_path):
+        return False
+    with user_manager.batch():
+        file_manager.delete_files_in_folder(user_id, folder_path)
+        return user_manager.delete_folder(user_id, folder_path)
+
+
+_shared: Optional[SharedStorage] = None
+_shared_lock = threading.Lock()
+
+
+def get_storage() -> SharedStorage:
+    """Returns this process's SharedStorage, opening it on first use."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = SharedStorage()
+        return _shared
@@ -0,0 +1,89 @@
+import asyncio
+import gc
+import logging
+
+import pytest
+
+from download_scheduler import DownloadScheduler
+
+
+class Messages(logging.Handler):
+    """Keeps only the messages: logged tracebacks reference the job's frame, and so its future."""
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_failed_job_is_logged_once():
+    unhandled = []
+    logs = Messages()
+    logger = logging.getLogger("download_scheduler")
+    logger.addHandler(logs)
+    logger.propagate = False  # pytest's own capture keeps whole records
+
+    async def scenario():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context))
+        scheduler = DownloadScheduler()
+
+        async def fail():
+            raise OSError("disk full")
+
+        awaited = scheduler.submit(1, fail)
+        with pytest.raises(OSError):
+            await awaited
+        scheduler.submit(1, fail)  # Fire and forget, as main.handle_document does
+        while scheduler.running:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0)  # Let the finished task be released
+        gc.collect()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(scenario())
+        gc.collect()
+    finally:
+        loop.close()
+        logger.removeHandler(logs)
+        logger.propagate = True
+    assert unhandled == []
+    assert logs.messages == ["Download job for user 1 failed"] * 2
+
+
+def test_users_take_turns_within_the_concurrency_limit():
+    async def scenario():
+        scheduler = DownloadScheduler(max_concurrency=2, per_user_limit=1)
+        started, running, peak = [], set(), 0
+        gate = asyncio.Event()
+
+        def job(user_id, n):
+            async def run():
+                nonlocal peak
+                started.append((user_id, n))
+                running.add(user_id)
+                peak = max(peak, len(running))
+                await gate.wait()
+                await asyncio.sleep(0)
+                running.discard(user_id)
+                return n
+            return run
+
+        # One user's burst is queued before anyone else's
+        futures = [scheduler.submit(1, job(1, n)) for n in range(4)]
+        futures += [scheduler.submit(user_id, job(user_id, 0)) for user_id in (2, 3)]
+        await asyncio.sleep(0)
+        assert scheduler.running == 2 and scheduler.queue_depth == 4
+        gate.set()
+        results = await asyncio.gather(*futures)
+        return started, peak, results
+
+    started, peak, results = asyncio.run(scenario())
+    assert results == [0, 1, 2, 3, 0, 0]
+    assert peak == 2
+    # Users 2 and 3 are served before the rest of user 1's burst
+    assert started.index((2, 0)) < started.index((1, 1))
+    assert started.index((3, 0)) < started.index((1, 2))
+    assert [n for user_id, n in started if user_id == 1] == [0, 1, 2, 3]
@@ -0,0 +1,56 @@
+import pytest
+
+from http_ranges import MultipartRanges, RangeNotSatisfiable, etag_matches, parse_range
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", [(0, 9)]),
+    ("bytes=90-", [(90, 99)]),
+    ("bytes=-10", [(90, 99)]),
+    ("bytes=-1000", [(0, 99)]),
+    ("bytes=50-1000", [(50, 99)]),
+    ("bytes=0-0,-1", [(0, 0), (99, 99)]),
+    # Overlapping and adjacent ranges are merged, so no byte is sent twice
+    ("bytes=0-9,5-19,20-29", [(0, 29)]),
+    ("bytes=40-49, 0-9", [(0, 9), (40, 49)]),
+    ("bytes=0-9,200-300", [(0, 9)]),
+    ("BYTES=0-1", [(0, 1)]),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", [None, "", "items=0-9", "bytes=", "bytes=abc", "bytes=9-0", "bytes=5", "bytes=1-x"])
+def test_unusable_range_means_whole_file(header):
+    assert parse_range(header, 100) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=100-200,300-", "bytes=-0"])
+def test_unsatisfiable_range(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, 100)
+
+
+def test_empty_file_has_no_satisfiable_range():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=0-", 0)
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', "abc")
+    assert etag_matches('W/"abc", "other"', "abc")
+    assert etag_matches("*", "abc")
+    assert not etag_matches('"abcd"', "abc")
+    assert not etag_matches(None, "abc")
+
+
+def test_multipart_body_matches_its_length(tmp_path):
+    path = tmp_path / "data.bin"
+    data = bytes(range(256)) * 4
+    path.write_bytes(data)
+    body = MultipartRanges(str(path), [(0, 9), (500, 1023)], len(data), "application/octet-stream")
+    payload = b"".join(body)
+    assert len(payload) == body.content_length
+    assert payload.count(f"--{body.boundary}".encode()) == 3
+    assert b"Content-Range: bytes 500-1023/1024\r\n\r\n" + data[500:] in payload
+    assert payload.endswith(f"--{body.boundary}--\r\n".encode())
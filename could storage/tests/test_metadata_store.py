@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+import metadata_store
+from metadata_store import JsonMetadataStore, SQLiteMetadataStore
+
+
+def record(name: str) -> dict:
+    return {"path": f"downloads/{name}", "owner_id": 1, "name": name, "folder": "/"}
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    store = SQLiteMetadataStore(tmp_path / "files.db")
+    yield store
+    store.close()
+
+
+def test_json_transaction_writes_once_on_success(tmp_path):
+    store = JsonMetadataStore(tmp_path / "file_db.json")
+    with store.transaction():
+        store.upsert("A", record("a"))
+        with store.transaction():
+            store.upsert("B", record("b"))
+        # Nested blocks do not write; only the outermost one does
+        assert not (tmp_path / "file_db.json").exists()
+    assert set(json.loads((tmp_path / "file_db.json").read_text())) == {"A", "B"}
+
+
+def test_json_transaction_rolls_back_on_error(tmp_path):
+    path = tmp_path / "file_db.json"
+    store = JsonMetadataStore(path)
+    store.upsert("A", record("a"))
+    before = path.read_bytes()
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.upsert("A", record("renamed"))
+            store.upsert("B", record("b"))
+            store.delete("A")
+            raise RuntimeError("halfway")
+    assert store.load_all() == {"A": record("a")}
+    assert path.read_bytes() == before
+    assert JsonMetadataStore(path).load_all() == {"A": record("a")}
+
+
+def test_sqlite_transaction_rolls_back_on_error(sqlite_store, tmp_path):
+    sqlite_store.upsert("A", record("a"))
+    seq = sqlite_store.change_seq()
+    with pytest.raises(RuntimeError):
+        with sqlite_store.transaction():
+            sqlite_store.upsert("A", record("renamed"))
+            with sqlite_store.transaction():
+                sqlite_store.delete("A")
+                sqlite_store.upsert("B", record("b"))
+            raise RuntimeError("halfway")
+    assert sqlite_store.load_all() == {"A": record("a")}
+    # The change log rolled back with the rows it describes
+    assert sqlite_store.change_seq() == seq
+    other = SQLiteMetadataStore(tmp_path / "files.db")
+    assert other.load_all() == {"A": record("a")}
+    other.close()
+
+
+def test_sqlite_commit_is_seen_by_another_connection(sqlite_store, tmp_path):
+    other = SQLiteMetadataStore(tmp_path / "files.db")
+    seq = other.change_seq()
+    with sqlite_store.transaction():
+        sqlite_store.upsert("A", record("a"))
+        sqlite_store.upsert("B", record("b"))
+        sqlite_store.delete("A")
+    changes, new_seq = other.changes_since(seq)
+    assert changes == {"A": None, "B": record("b")}
+    assert new_seq > seq
+    assert other.log_id() == sqlite_store.log_id()
+    other.close()
+
+
+def test_sqlite_rejects_a_cursor_older_than_the_change_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(metadata_store, "CHANGE_LOG_KEEP", 100)
+    store = SQLiteMetadataStore(tmp_path / "files.db", prune_every=10)
+    for i in range(300):
+        store.upsert(f"C{i % 5}", record(str(i)))
+    assert store.change_log(0) is None
+    assert store.change_log(store.change_seq()) == ({}, store.change_seq())
+    store.close()
@@ -0,0 +1,38 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def profiler():
+    server = metrics.serve(0)
+    port = server.server_address[1]
+
+    def get(path: str):
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode()
+
+    yield get
+    metrics.sampler.stop()
+    server.shutdown()
+
+
+@pytest.mark.parametrize("interval", ["0", "-5", "abc", "nan", "inf"])
+def test_profile_start_rejects_bad_intervals(profiler, interval):
+    status, _ = profiler(f"/profile/start?interval_ms={interval}")
+    assert status == 400
+    assert not metrics.sampler.running
+
+
+def test_profile_start_reports_the_running_interval(profiler):
+    assert profiler("/profile/start?interval_ms=20") == (200, "sampling every 20 ms\n")
+    status, body = profiler("/profile/start?interval_ms=5")
+    assert status == 409
+    assert "every 20 ms" in body
+    assert metrics.sampler.interval == 0.02
@@ -0,0 +1,146 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from blob_store import BlobStore
+from upload_sessions import UploadError, UploadManager
+
+CHUNK = 16
+
+
+def upload(manager: UploadManager, data: bytes):
+    return manager.create(1, "data.bin", len(data), hashlib.sha256(data).hexdigest())
+
+
+def chunk(data: bytes, index: int) -> io.BytesIO:
+    return io.BytesIO(data[index * CHUNK:(index + 1) * CHUNK])
+
+
+@pytest.fixture
+def blobs(tmp_path):
+    return BlobStore(tmp_path / "blobs")
+
+
+def test_out_of_order_chunks_finalize_to_the_right_file(tmp_path, blobs):
+    manager = UploadManager(tmp_path / "uploads", chunk_size=CHUNK)
+    data = os.urandom(CHUNK * 4 + 5)
+    session = upload(manager, data)
+    for index in (4, 2, 0, 3, 1):
+        manager.write_chunk(session, index, chunk(data, index))
+    path, digest = manager.finalize(session, blobs)
+    assert path.read_bytes() == data
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert list((tmp_path / "uploads").iterdir()) == []
+
+
+def test_resent_chunk_is_ignored(tmp_path, blobs):
+    manager = UploadManager(tmp_path / "uploads", chunk_size=CHUNK)
+    data = os.urandom(CHUNK * 2)
+    session = upload(manager, data)
+    manager.write_chunk(session, 0, chunk(data, 0))
+    # A retry after a lost response, even with different bytes, does not overwrite the accepted chunk
+    manager.write_chunk(session, 0, io.BytesIO(b"x" * CHUNK))
+    manager.write_chunk(session, 1, chunk(data, 1))
+    assert manager.finalize(session, blobs)[0].read_bytes() == data
+
+
+def test_bad_chunks_are_rejected(tmp_path, blobs):
+    manager = UploadManager(tmp_path / "uploads", chunk_size=CHUNK)
+    data = os.urandom(CHUNK + 3)
+    session = upload(manager, data)
+    with pytest.raises(UploadError):
+        manager.write_chunk(session, 2, chunk(data, 0))
+    with pytest.raises(UploadError):
+        manager.write_chunk(session, 0, io.BytesIO(data[:CHUNK - 1]))
+    with pytest.raises(UploadError):
+        manager.write_chunk(session, 1, io.BytesIO(data[CHUNK:] + b"!"))
+    with pytest.raises(UploadError):
+        manager.write_chunk(session, 0, chunk(data, 0), chunk_sha256="0" * 64)
+    assert session.received == set()
+    with pytest.raises(UploadError):
+        manager.finalize(session, blobs)
+    # The same chunks, sent correctly, still complete the upload
+    manager.write_chunk(session, 1, chunk(data, 1))
+    manager.write_chunk(session, 0, chunk(data, 0), chunk_sha256=hashlib.sha256(data[:CHUNK]).hexdigest())
+    assert manager.finalize(session, blobs)[1] == hashlib.sha256(data).hexdigest()
+
+
+def test_checksum_mismatch_discards_the_upload(tmp_path, blobs):
+    manager = UploadManager(tmp_path / "uploads", chunk_size=CHUNK)
+    data = os.urandom(CHUNK)
+    session = manager.create(1, "data.bin", len(data), "0" * 64)
+    manager.write_chunk(session, 0, chunk(data, 0))
+    with pytest.raises(UploadError):
+        manager.finalize(session, blobs)
+    assert manager.get(session.id, 1) is None
+    assert list((tmp_path / "uploads").iterdir()) == []
+
+
+def test_upload_resumes_after_a_restart(tmp_path, blobs):
+    manager = UploadManager(tmp_path / "uploads", chunk_size=CHUNK)
+    data = os.urandom(CHUNK * 3)
+    session = upload(manager, data)
+    manager.write_chunk(session, 2, chunk(data, 2))
+    manager.write_chunk(session, 0, chunk(data, 0))
+
+    restarted = UploadManager(tmp_path / "uploads", chunk_size=CHUNK)
+    resumed = restarted.get(session.id, 1)
+    assert resumed.received == {0, 2}
+    assert restarted.get(session.id, 2) is None  # Someone else's upload
+    restarted.write_chunk(resumed, 1, chunk(data, 1))
+    # The in-memory hash was lost with the process; finalize reads the part file back
+    assert restarted.finalize(resumed, blobs)[1] == hashlib.sha256(data).hexdigest()
+
+
+def test_chunks_may_reach_different_workers(tmp_path, blobs):
+    first = UploadManager(tmp_path / "uploads", chunk_size=CHUNK)
+    second = UploadManager(tmp_path / "uploads", chunk_size=CHUNK)
+    data = os.urandom(CHUNK * 3)
+    session = upload(first, data)
+    second.write_chunk(second.get(session.id, 1), 1, chunk(data, 1))
+    first.write_chunk(session, 0, chunk(data, 0))
+    second.write_chunk(second.get(session.id, 1), 2, chunk(data, 2))
+    assert first.get(session.id, 1).received == {0, 1, 2}
+    path, _ = first.finalize(session, blobs)
+    assert path.read_bytes() == data
+    # Finished on the first worker, so gone on the second
+    assert second.get(session.id, 1) is None
+
+
+def test_idle_sessions_expire(tmp_path):
+    manager = UploadManager(tmp_path / "uploads", chunk_size=CHUNK, ttl=60)
+    data = os.urandom(CHUNK)
+    session = upload(manager, data)
+    manager.write_chunk(session, 0, chunk(data, 0))
+    old = session.updated - 120
+    for path in (tmp_path / "uploads").iterdir():
+        os.utime(path, (old, old))
+    session.updated = old
+    assert manager.expire() == 1
+    assert manager.get(session.id, 1) is None
+    assert list((tmp_path / "uploads").iterdir()) == []
+
+
+def test_truncated_part_file_fails_instead_of_spinning(tmp_path):
+    manager = UploadManager(tmp_path / "uploads", chunk_size=CHUNK)
+    data = os.urandom(CHUNK * 3)
+    session = upload(manager, data)
+    manager.write_chunk(session, 1, chunk(data, 1))
+    manager.write_chunk(session, 2, chunk(data, 2))
+    with open(manager._part_path(session.id), "r+b") as f:
+        f.truncate(CHUNK)
+    with pytest.raises(UploadError):
+        manager.write_chunk(session, 0, chunk(data, 0))
+    # The whole-file hash was not fed the part of chunk 1 that could be read
+    assert session.hashed_chunks == 1
+    assert session.hasher.hexdigest() == hashlib.sha256(data[:CHUNK]).hexdigest()
+
+
+def test_oversized_upload_is_refused(tmp_path):
+    manager = UploadManager(tmp_path / "uploads", chunk_size=CHUNK, max_size=100)
+    manager.create(1, "ok.bin", 100)
+    with pytest.raises(UploadError):
+        manager.create(1, "big.bin", 101)
+    assert len(list((tmp_path / "uploads").glob("*.part"))) == 1
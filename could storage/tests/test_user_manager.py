@@ -0,0 +1,39 @@
+import pytest
+
+from user_manager import UserManager
+
+
+@pytest.fixture
+def users(tmp_path, monkeypatch):
+    # users.json and users.journal are relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    manager = UserManager(background=False)
+    manager.register(1, "alice")
+    manager.create_folder(1, "kept")
+    yield manager
+    manager.close()
+
+
+def test_failed_batch_writes_nothing_and_restores_memory(users):
+    version = users.folder_version(1, "/")
+    with pytest.raises(RuntimeError):
+        with users.batch():
+            users.create_folder(1, "new")
+            users.delete_folder(1, "/kept")
+            raise RuntimeError("halfway")
+    assert users.folder_exists(1, "/kept")
+    assert not users.folder_exists(1, "/new")
+    # Cached keyboards for the folder are stale either way
+    assert users.folder_version(1, "/") > version
+    reopened = UserManager(background=False)
+    assert reopened.folder_exists(1, "/kept") and not reopened.folder_exists(1, "/new")
+    reopened.close()
+
+
+def test_batch_writes_once_on_success(users):
+    with users.batch():
+        users.create_folder(1, "a")
+        users.create_folder(1, "b")
+    reopened = UserManager(background=False)
+    assert reopened.get_subfolders(1, "/") == users.get_subfolders(1, "/")
+    reopened.close()
@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+from webhook import WebhookServer
+
+
+class FakeApplication:
+    """Just enough of a PTB Application for WebhookServer: records what it processes."""
+
+    def __init__(self):
+        self.bot = None
+        self.processed = []
+
+    async def initialize(self):
+        pass
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_update(self, update):
+        self.processed.append(update.update_id)
+
+
+async def post(server: WebhookServer, body: bytes) -> int:
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await server({"type": "http", "path": server.path, "method": "POST", "headers": []}, receive, send)
+    return sent[0]["status"]
+
+
+def test_non_object_bodies_are_rejected():
+    async def scenario():
+        server = WebhookServer(FakeApplication(), workers=1)
+        await server.start()
+        statuses = [await post(server, body) for body in (b"[1]", b'"x"', b"1", b"null", b"{")]
+        await server.stop()
+        return statuses, server.accepted
+
+    statuses, accepted = asyncio.run(scenario())
+    assert statuses == [400] * 5
+    assert accepted == 0
+
+
+def test_worker_survives_a_malformed_update():
+    async def scenario():
+        app = FakeApplication()
+        server = WebhookServer(app, workers=1)
+        await server.start()
+        # Payloads that fail in Update.de_json must not take the worker down with them
+        server._queue.put_nowait([1])
+        server._queue.put_nowait({"update_id": "not a number", "message": 5})
+        status = await post(server, json.dumps({"update_id": 7}).encode())
+        await asyncio.wait_for(server._queue.join(), 5)
+        alive = [not task.done() for task in server._tasks]
+        await server.stop()
+        return status, app.processed, alive
+
+    status, processed, alive = asyncio.run(scenario())
+    assert status == 200
+    assert processed == [7]
+    assert alive == [True]
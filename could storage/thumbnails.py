@@ -0,0 +1,315 @@
+"""Small JPEG previews of stored images and first-frame posters of videos.
+
+Previews are built in worker processes, so decoding a large photo never
+holds up the bot's event loop or a web request thread. The workers run
+this file on its own (`python thumbnails.py`), so they start without the
+bot or web app that uses them. They are kept in a
+size-bounded directory keyed by content hash: identical files share one
+preview, and it stays valid for as long as the content exists. Image
+previews need Pillow and video posters need ffmpeg on the PATH; without
+them, those files simply have no preview.
+"""
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+from utils import DOWNLOAD_DIR
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+THUMB_DIR = DOWNLOAD_DIR / "thumbs"
+THUMB_SIZE = int(os.getenv("THUMB_SIZE", "256"))  # longest side, in pixels
+THUMB_CACHE_MB = int(os.getenv("THUMB_CACHE_MB", "256"))
+THUMB_WORKERS = int(os.getenv("THUMB_WORKERS", str(min(2, os.cpu_count() or 1))))
+BROKEN_TTL = 3600.0  # seconds before a file that could not be decoded is tried again
+BROKEN_MAX = 10000
+FFMPEG = shutil.which("ffmpeg")
+
+# Telegram attachment kinds (tg_kind) with a known preview type, whatever their file name
+KIND_PREVIEWS = {"photo": "image", "video": "video", "animation": "video"}
+
+
+def preview_kind(file_name: Optional[str], tg_kind: Optional[str] = None, path: Optional[str] = None) -> Optional[str]:
+    """"image" or "video" if a preview can be made for the file here, else None.
+
+    Records from before file names were kept only have the stored `path`, whose name is tried last.
+    """
+    kind = KIND_PREVIEWS.get(tg_kind)
+    for name in (file_name, os.path.basename(path or "")):
+        if kind is not None:
+            break
+        mime = mimetypes.guess_type(name or "")[0] or ""
+        kind = mime.split("/")[0] if mime.startswith(("image/", "video/")) else None
+    if (kind == "image" and Image is None) or (kind == "video" and FFMPEG is None):
+        return None
+    return kind
+
+
+def render(source: str, dest: str, kind: str, size: int) -> bool:
+    """Writes a JPEG preview of `source`, at most `size` pixels on its longest side, to `dest`.
+
+    Runs in a worker process; returns False if the file cannot be decoded.
+    """
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    try:
+        if kind == "image":
+            with Image.open(source) as image:
+                image.draft("RGB", (size, size))  # JPEGs decode straight at a fraction of full size
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((size, size))
+                image.convert("RGB").save(tmp, "JPEG", quality=80, optimize=True)
+        else:
+            subprocess.run([FFMPEG, "-v", "error", "-y", "-i", source, "-frames:v", "1",
+                            "-vf", f"scale={size}:{size}:force_original_aspect_ratio=decrease",
+                            "-f", "image2", "-c:v", "mjpeg", tmp],
+                           stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, check=True, timeout=60)
+        os.replace(tmp, dest)
+        return True
+    except Exception:
+        return False
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class ThumbnailCache:
+    """Directory of previews named by content hash, trimmed to `max_bytes` least recently used first.
+
+    Recency is tracked in memory; after a restart the oldest files go first.
+    Previews written by another process sharing the directory are picked up
+    when first asked for.
+    """
+
+    def __init__(self, directory: Path = THUMB_DIR, max_bytes: int = THUMB_CACHE_MB << 20, size: int = THUMB_SIZE):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.size = size
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._entries = None  # path -> bytes, least recently used first; scanned on first use
+
+    def path_for(self, digest: str) -> Path:
+        # The size is part of the name, so changing THUMB_SIZE never serves old previews
+        return self.directory / digest[:2] / f"{digest}-{self.size}.jpg"
+
+    def _load(self):
+        found = []
+        for path in self.directory.glob("*/*.jpg"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            found.append((stat.st_mtime, str(path), stat.st_size))
+        self._entries = OrderedDict((path, size) for _, path, size in sorted(found))
+        self.bytes = sum(self._entries.values())
+
+    def get(self, digest: str) -> Optional[Path]:
+        """The preview's path if it is cached, else None."""
+        path = self.path_for(digest)
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            if str(path) in self._entries:
+                self._entries.move_to_end(str(path))
+                return path
+        return path if self.add(path) else None
+
+    def add(self, path: Path) -> bool:
+        """Records a newly written preview, removing the least recently used ones over the limit."""
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            self.bytes += size - self._entries.pop(str(path), 0)
+            self._entries[str(path)] = size
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                old, old_size = self._entries.popitem(last=False)
+                self.bytes -= old_size
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+        return True
+
+
+class WorkerCrashed(Exception):
+    """A worker process exited while building a preview."""
+
+
+class WorkerPool:
+    """`workers` long-lived worker processes, each fed one job at a time over its stdin and stdout.
+
+    Each pool thread owns one process and starts a fresh one if it died.
+    """
+
+    def __init__(self, workers: int):
+        self._threads = ThreadPoolExecutor(workers, thread_name_prefix="thumbnails")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._procs = []
+
+    def _process(self) -> tuple:
+        """This thread's worker process, and whether it was just started."""
+        proc = getattr(self._local, "proc", None)
+        if proc is not None and proc.poll() is None:
+            return proc, False
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, text=True)
+        self._local.proc = proc
+        with self._lock:
+            self._procs = [p for p in self._procs if p.poll() is None] + [proc]
+        return proc, True
+
+    def _run(self, job: list) -> bool:
+        while True:
+            proc, started = self._process()
+            try:
+                proc.stdin.write(json.dumps(job) + "\n")
+                proc.stdin.flush()
+                reply = proc.stdout.readline()
+            except OSError:
+                reply = ""
+            if reply:
+                return reply.strip() == "1"
+            proc.kill()
+            code = proc.wait()
+            # A worker that died while idle is only noticed when it is next used; the job gets a fresh one
+            if started:
+                raise WorkerCrashed(f"exit code {code}")
+
+    def submit(self, source: str, dest: str, kind: str, size: int) -> Future:
+        """The future gives render()'s result, or raises WorkerCrashed."""
+        return self._threads.submit(self._run, [os.path.abspath(source), os.path.abspath(dest), kind, size])
+
+    def shutdown(self):
+        self._threads.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            procs, self._procs = self._procs, []
+        for proc in procs:
+            proc.stdin.close()  # The worker exits at end of input
+            proc.wait()
+
+
+class Thumbnailer:
+    """Builds previews on a pool of worker processes; each one is made once however often it is asked for."""
+
+    def __init__(self, cache: Optional[ThumbnailCache] = None, workers: int = THUMB_WORKERS):
+        self.cache = cache or ThumbnailCache()
+        self.workers = workers
+        self.built = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = {}              # digest -> Future of the preview path
+        self._broken = OrderedDict()    # digest -> when its file could not be decoded, oldest first
+
+    def _executor(self) -> WorkerPool:
+        if self._pool is None:
+            self._pool = WorkerPool(self.workers)
+        return self._pool
+
+    def _is_broken(self, digest: str) -> bool:
+        with self._lock:
+            failed_at = self._broken.get(digest)
+            if failed_at is None:
+                return False
+            if time.monotonic() - failed_at < BROKEN_TTL:
+                return True
+            del self._broken[digest]
+            return False
+
+    def submit(self, source: str, digest: str, kind: str) -> Future:
+        """Starts building the preview of `source` unless it exists; the future gives its path, or None."""
+        future = Future()
+        if self._is_broken(digest):
+            future.set_result(None)
+            return future
+        path = self.cache.get(digest)
+        if path is not None:
+            future.set_result(path)
+            return future
+        with self._lock:
+            if digest in self._pending:
+                return self._pending[digest]
+            self._pending[digest] = future
+            path = self.cache.path_for(digest)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                job = self._executor().submit(str(source), str(path), kind, self.cache.size)
+            except Exception:
+                logger.exception("Could not start a preview of %s", source)
+                del self._pending[digest]
+                future.set_result(None)
+                return future
+        job.add_done_callback(lambda job: self._finished(digest, path, job, future))
+        return future
+
+    def _finished(self, digest: str, path: Path, job: Future, future: Future):
+        decoded = None  # Unknown: the job was cancelled or its worker crashed
+        if not job.cancelled():
+            try:
+                decoded = job.result()
+            except Exception as e:
+                # A crash (say, out of memory) says nothing certain about the file, so it is tried again next time
+                logger.warning("Preview worker failed on %s: %r", digest, e)
+        ok = bool(decoded) and self.cache.add(path)
+        with self._lock:
+            self._pending.pop(digest, None)
+            if ok:
+                self.built += 1
+            else:
+                self.failed += 1
+            if decoded is False:  # Only a file that could not be decoded is remembered
+                self._broken[digest] = time.monotonic()
+                self._broken.move_to_end(digest)
+                while len(self._broken) > BROKEN_MAX:
+                    self._broken.popitem(last=False)
+        if not future.done():  # A waiter may have cancelled it
+            future.set_result(path if ok else None)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+_thumbnailer: Optional[Thumbnailer] = None
+_thumbnailer_lock = threading.Lock()
+
+
+def get_thumbnailer() -> Thumbnailer:
+    """Returns this process's Thumbnailer (shared by the bot and the web app), creating it on first use."""
+    global _thumbnailer
+    with _thumbnailer_lock:
+        if _thumbnailer is None:
+            _thumbnailer = Thumbnailer()
+        return _thumbnailer
+
+
+def serve():
+    """Worker process loop: one [source, dest, kind, size] job per line on stdin, "1" or "0" per line on stdout."""
+    try:
+        for line in sys.stdin:
+            print(int(render(*json.loads(line))), flush=True)
+    except KeyboardInterrupt:
+        pass  # Ctrl+C reaches the whole process group; the parent cleans up
+
+
+if __name__ == "__main__":
+    serve()
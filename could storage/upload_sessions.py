@@ -0,0 +1,312 @@
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Optional
+from blob_store import BlobStore
+from utils import DOWNLOAD_DIR
+
+UPLOAD_DIR = DOWNLOAD_DIR / ".uploads"
+CHUNK_SIZE = 8 * 1024 * 1024
+SESSION_TTL = 24 * 3600
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "4096"))
+EXPIRE_EVERY = 60.0  # seconds between scans for abandoned sessions
+READ_BLOCK = 64 * 1024
+UPLOAD_ID = re.compile(r"[A-Za-z0-9_-]+")  # secrets.token_urlsafe output; ids name files, so nothing else
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadSession:
+    """One in-progress chunked upload: a sparse part file, a small JSON sidecar and a log of received chunks."""
+
+    def __init__(self, upload_id: str, user_id: int, file_name: str, size: int,
+                 chunk_size: int, sha256: Optional[str] = None, received=(), updated: float = None):
+        self.id = upload_id
+        self.user_id = user_id
+        self.file_name = file_name
+        self.size = size
+        self.chunk_size = chunk_size
+        self.sha256 = sha256
+        self.received = set(received)
+        self.updated = updated or time.time()
+        self.lock = threading.Lock()
+        # Whole-file hash, fed in order as chunks arrive; lost (and redone on finalize) after a restart
+        self.hasher = hashlib.sha256()
+        self.hashed_chunks = 0
+
+    @property
+    def chunk_count(self) -> int:
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index: int) -> int:
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def to_json(self) -> dict:
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "file_name": self.file_name,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "sha256": self.sha256,
+            "received": sorted(self.received),
+            "updated": self.updated,
+        }
+
+
+class UploadManager:
+    """Chunked, resumable uploads: init, PUT chunk N, finalize.
+
+    Chunks are streamed straight to their offset in a part file, so memory use
+    does not depend on the file size, and a client can ask which chunks are
+    missing and resume after a dropped connection. Sessions idle for longer
+    than `ttl` seconds are removed, with their files, by the next create()
+    or get() (which also scans for other abandoned ones every EXPIRE_EVERY
+    seconds).
+
+    Everything about a session is on disk, so several web worker processes
+    can serve one upload: a worker that has not seen a session loads it, and
+    each accepted chunk is appended to a log that every worker reads back.
+    """
+
+    def __init__(self, root: Path = UPLOAD_DIR, chunk_size: int = CHUNK_SIZE, ttl: float = SESSION_TTL,
+                 max_size: int = MAX_UPLOAD_MB * 1024 * 1024):
+        self.root = Path(root)
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sessions = {}
+        self._lock = threading.Lock()
+        self._expired_at = 0.0
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._load_sessions()
+        self.expire()
+
+    def _part_path(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.part"
+
+    def _meta_path(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.json"
+
+    def _chunks_path(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.chunks"
+
+    def _load(self, upload_id: str) -> Optional[UploadSession]:
+        try:
+            with open(self._meta_path(upload_id), "r") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        session = UploadSession(data["id"], data["user_id"], data["file_name"], data["size"],
+                                data["chunk_size"], data.get("sha256"), data["received"], data["updated"])
+        self._refresh(session)
+        return session
+
+    def _load_sessions(self):
+        for meta_path in self.root.glob("*.json"):
+            session = self._load(meta_path.stem)
+            if session is not None:
+                self.sessions[session.id] = session
+
+    def _refresh(self, session: UploadSession):
+        """Adds the chunks other processes accepted; the log's mtime is the session's last activity."""
+        path = self._chunks_path(session.id)
+        try:
+            with open(path, "r") as f:
+                # A line without its newline is an append still in progress
+                session.received.update(int(line) for line in f if line.endswith("\n"))
+            session.updated = max(session.updated, os.path.getmtime(path))
+        except FileNotFoundError:
+            pass
+
+    def _save_meta(self, session: UploadSession):
+        tmp_path = self._meta_path(session.id).with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(session.to_json(), f)
+        os.replace(tmp_path, self._meta_path(session.id))
+
+    def _log_chunk(self, session: UploadSession, index: int):
+        # One small O_APPEND write per chunk, so processes appending at once never interleave
+        fd = os.open(self._chunks_path(session.id), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, f"{index}\n".encode())
+        finally:
+            os.close(fd)
+
+    def _discard(self, session: UploadSession):
+        with self._lock:
+            self.sessions.pop(session.id, None)
+        self._remove_files(session.id)
+
+    def _remove_files(self, upload_id: str):
+        # The part file, sidecar, chunk log and any sidecar a crash left half-written
+        for path in self.root.glob(f"{upload_id}.*"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def expire(self) -> int:
+        """Removes abandoned sessions, also those of other processes and files a crash left behind; returns how many."""
+        self._expired_at = time.monotonic()
+        cutoff = time.time() - self.ttl
+        dropped = 0
+        for upload_id in {path.name.split(".")[0] for path in self.root.iterdir()}:
+            with self._lock:
+                session = self.sessions.get(upload_id)
+            if session is not None:
+                self._refresh(session)
+            else:
+                session = self._load(upload_id)
+            if session is not None:
+                updated = session.updated
+            else:
+                # No readable sidecar: judge by when its files were last written
+                updated = max(self._mtimes(upload_id), default=0)
+            if updated < cutoff:
+                with self._lock:
+                    self.sessions.pop(upload_id, None)
+                self._remove_files(upload_id)
+                dropped += 1
+        return dropped
+
+    def _mtimes(self, upload_id: str):
+        for path in self.root.glob(f"{upload_id}.*"):
+            try:
+                yield path.stat().st_mtime
+            except FileNotFoundError:
+                pass
+
+    def _expire_if_due(self):
+        if time.monotonic() - self._expired_at > EXPIRE_EVERY:
+            self.expire()
+
+    def create(self, user_id: int, file_name: str, size: int, sha256: Optional[str] = None) -> UploadSession:
+        if size < 0:
+            raise UploadError("Invalid size")
+        if size > self.max_size:
+            raise UploadError(f"File too large (limit {self.max_size} bytes)")
+        self._expire_if_due()
+        session = UploadSession(secrets.token_urlsafe(12), user_id, os.path.basename(file_name),
+                                size, self.chunk_size, sha256.lower() if sha256 else None)
+        with open(self._part_path(session.id), "wb") as f:
+            f.truncate(size)
+        self._save_meta(session)
+        with self._lock:
+            self.sessions[session.id] = session
+        return session
+
+    def get(self, upload_id: str, user_id: int) -> Optional[UploadSession]:
+        """The user's session, as of the chunks every process has accepted; None if unknown or finished."""
+        if not UPLOAD_ID.fullmatch(upload_id):
+            return None
+        self._expire_if_due()
+        with self._lock:
+            session = self.sessions.get(upload_id)
+        if session is None:
+            # Created by another worker process
+            session = self._load(upload_id)
+            if session is None:
+                return None
+            with self._lock:
+                session = self.sessions.setdefault(upload_id, session)
+        elif not self._meta_path(upload_id).exists():
+            # Finalized or expired by another worker process
+            with self._lock:
+                self.sessions.pop(upload_id, None)
+            return None
+        else:
+            self._refresh(session)
+        if session.updated < time.time() - self.ttl:
+            self._discard(session)
+            return None
+        if session.user_id != user_id:
+            return None
+        return session
+
+    def write_chunk(self, session: UploadSession, index: int, stream: BinaryIO, chunk_sha256: Optional[str] = None):
+        """Streams chunk `index` from `stream` to its offset in the part file.
+
+        If the client sends the chunk's own SHA-256 it is checked before the
+        chunk is accepted. Re-sending an accepted chunk is a no-op.
+        """
+        if not 0 <= index < session.chunk_count:
+            raise UploadError("Chunk index out of range")
+        expected = session.chunk_length(index)
+
+        with session.lock:
+            if index in session.received:
+                while stream.read(READ_BLOCK):
+                    pass
+                return
+            in_order = index == session.hashed_chunks
+            # Hash into a copy so a rejected chunk does not corrupt the whole-file hash
+            file_hasher = session.hasher.copy() if in_order else None
+            chunk_hasher = hashlib.sha256()
+            written = 0
+            with open(self._part_path(session.id), "r+b") as f:
+                f.seek(index * session.chunk_size)
+                while written < expected:
+                    data = stream.read(min(READ_BLOCK, expected - written))
+                    if not data:
+                        break
+                    f.write(data)
+                    chunk_hasher.update(data)
+                    if file_hasher is not None:
+                        file_hasher.update(data)
+                    written += len(data)
+            if written != expected or stream.read(1):
+                raise UploadError(f"Chunk {index} must be exactly {expected} bytes")
+            if chunk_sha256 and chunk_hasher.hexdigest() != chunk_sha256.lower():
+                raise UploadError(f"Chunk {index} failed its checksum")
+
+            self._log_chunk(session, index)
+            session.received.add(index)
+            session.updated = time.time()
+            if file_hasher is not None:
+                session.hasher = file_hasher
+                session.hashed_chunks += 1
+                self._advance_hash(session)
+
+    def _advance_hash(self, session: UploadSession):
+        """Feeds chunks that arrived early into the whole-file hash once the gap before them is filled."""
+        if session.hashed_chunks not in session.received:
+            return
+        with open(self._part_path(session.id), "rb") as f:
+            while session.hashed_chunks in session.received:
+                f.seek(session.hashed_chunks * session.chunk_size)
+                remaining = session.chunk_length(session.hashed_chunks)
+                # Into a copy, so a chunk that cannot be read back leaves the hash where it was
+                hasher = session.hasher.copy()
+                while remaining > 0:
+                    data = f.read(min(READ_BLOCK, remaining))
+                    if not data:
+                        # The part file was truncated or replaced after the chunk was accepted
+                        raise UploadError(f"Chunk {session.hashed_chunks} is missing from the part file")
+                    hasher.update(data)
+                    remaining -= len(data)
+                session.hasher = hasher
+                session.hashed_chunks += 1
+
+    def finalize(self, session: UploadSession, blob_store: BlobStore) -> tuple:
+        """Verifies a complete upload, commits it to the blob store and returns (path, sha256)."""
+        with session.lock:
+            self._refresh(session)
+            missing = session.chunk_count - len(session.received)
+            if session.size and missing:
+                raise UploadError(f"{missing} chunk(s) still missing")
+            self._advance_hash(session)
+            digest = session.hasher.hexdigest()
+            if session.sha256 and digest != session.sha256:
+                self._discard(session)
+                raise UploadError("Checksum mismatch; upload discarded")
+            path = blob_store.commit(self._part_path(session.id), digest)
+            self._discard(session)
+        return path, digest
@@ -1,11 +1,66 @@
+import itertools
 import json
+import os
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Optional
+from journal import Journal
+from search_index import NgramIndex
+from folder_tree import FolderTree
+from sorted_index import SortedViews
+import metrics
 
 USER_DB_FILE = Path("users.json")
+USER_JOURNAL_FILE = Path("users.journal")
+
+def _uid_sort_key(uid_str: str) -> str:
+    """Orders numeric IDs by value (negative group chats first) and any other keys after them."""
+    try:
+        uid = int(uid_str)
+    except ValueError:
+        return "2" + uid_str
+    return f"0{uid + 10 ** 20:021d}" if uid < 0 else f"1{uid:020d}"
+
+# Sort orders for list_users
+SORT_KEYS = {
+    "id": lambda item: _uid_sort_key(item[0]),
+    "name": lambda item: item[1].get("username", "").lower(),
+}
 
 class UserManager:
-    def __init__(self):
+    def __init__(self, compact_interval: float = 30.0, compact_every: int = 1000, background: bool = True):
+        # users.json is the snapshot; every mutation since it was written lives in users.journal
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self.compact_every = compact_every
+        # (uid, folder) -> version, bumped whenever that folder's subfolders change
+        self.folder_versions = {}
+        self._versions = itertools.count(1)
+        self._version_floor = 0  # Every folder's version is at least this; raised on a full reload
+        self.journal = Journal(USER_JOURNAL_FILE)
+        self._batched = None  # Records of the open batch(), not yet in the journal
+        self._load()
+        if self.journal.rotated_path.exists():
+            # Left over from an interrupted compaction; fold it in before accepting writes
+            self.compact()
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._compactor = None
+        if background:
+            self._compactor = threading.Thread(target=self._compact_loop, args=(compact_interval,), daemon=True)
+            self._compactor.start()
+
+    def _load(self, truncate: bool = True):
+        """Builds the in-memory database and indexes from the snapshot and the journal."""
         self.db = self._load_db()
+        self.user_index = NgramIndex()
+        self.views = SortedViews(SORT_KEYS)
+        for uid_str, data in self.db.items():
+            self._index_user(uid_str, data)
+        for record in self.journal.replay(truncate):
+            self._apply(record)
 
     def _load_db(self) -> dict:
         if USER_DB_FILE.exists():
@@ -16,9 +71,180 @@ class UserManager:
                 return {}
         return {}
 
-    def _save_db(self):
-        with open(USER_DB_FILE, "w") as f:
-            json.dump(self.db, f, indent=4)
+    def _write_snapshot(self, data: str):
+        tmp_path = USER_DB_FILE.with_name(USER_DB_FILE.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, USER_DB_FILE)
+
+    def compact(self):
+        """Folds the journal into a fresh users.json snapshot (atomic rename).
+
+        Does nothing while another process sharing the files is compacting.
+        """
+        with self._compact_lock:
+            if not self.journal.try_lock():
+                return
+            try:
+                with self._lock:
+                    if not self.journal.pending and not self.journal.rotated_path.exists():
+                        return
+                    # New appends go to a fresh journal while the snapshot is written
+                    self.journal.rotate()
+                    # Other processes may have appended since our last sync; the snapshot must include that
+                    self.sync()
+                    data = self.export_json(indent=4)
+                self._write_snapshot(data)
+                self.journal.discard_rotated()
+            finally:
+                self.journal.unlock()
+
+    def sync(self) -> int:
+        """Applies the journal records other processes appended since the last sync; returns how many were read.
+
+        Our own records come back too. They are applied again in journal
+        order, so every process ends up with the same state.
+        """
+        with self._lock:
+            records = self.journal.follow()
+            if records is None:
+                # Fell behind by more than one compaction; its snapshot has what we missed
+                self._reload()
+                return len(self.db)
+            for record in records:
+                self._apply(record)
+            return len(records)
+
+    def _reload(self):
+        """Rebuilds memory from the snapshot and the journal; every folder version changes."""
+        self._load(truncate=False)
+        self._version_floor = next(self._versions)
+
+    def _compact_loop(self, interval: float):
+        while not self._stop.is_set():
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.compact()
+            except OSError:
+                pass  # Try again on the next tick; the journal still has everything
+
+    def close(self):
+        """Stops the background compactor and writes a final snapshot."""
+        self._stop.set()
+        self._wake.set()
+        if self._compactor is not None:
+            self._compactor.join()
+        self.compact()
+        self.journal.close()
+
+    def export_json(self, indent: Optional[int] = None) -> str:
+        """Serializes the whole user database (folder trees in their nested form)."""
+        with self._lock:
+            return json.dumps(self.db, indent=indent, default=FolderTree.to_json)
+
+    def _tree(self, user: dict) -> FolderTree:
+        """Returns the user's folder tree, building it from the stored form on first use."""
+        folders = user.get("folders")
+        if not isinstance(folders, FolderTree):
+            folders = user["folders"] = FolderTree.from_json(folders or [])
+        return folders
+
+    def _index_user(self, uid_str: str, data: dict):
+        # The NUL separator keeps a query from matching across the ID/username boundary
+        self.user_index.add(uid_str, f"{uid_str}\0{data.get('username', '')}")
+        self.views.add(None, uid_str, (uid_str, data))
+
+    def _commit(self, record: dict):
+        """Applies a mutation in memory and appends it to the journal."""
+        with self._lock:
+            self._apply(record)
+            if self._batched is not None:
+                self._batched.append(record)
+                return
+            self.journal.append(record)
+            if self.journal.pending >= self.compact_every:
+                self._wake.set()
+
+    @contextmanager
+    def batch(self):
+        """Groups mutations into one journal write, made when the block exits.
+
+        Mutations apply in memory straight away. If the block raises, none of
+        them is written and memory is rebuilt from the snapshot and journal,
+        as FileManager.batch rolls back. Nested batches join the outer one.
+        """
+        with self._lock:
+            if self._batched is not None:
+                yield
+                return
+            self._batched = []
+            try:
+                yield
+                self.journal.append_many(self._batched)
+            except BaseException:
+                if self._batched:
+                    self._reload()
+                raise
+            finally:
+                self._batched = None
+            if self.journal.pending >= self.compact_every:
+                self._wake.set()
+
+    def _apply(self, record: dict):
+        op = record["op"]
+        uid_str = record["uid"]
+        if op == "register":
+            if uid_str not in self.db:
+                self.db[uid_str] = {
+                    "username": record["username"],
+                    "web_password": None,
+                    "current_folder": "/",
+                    "folders": FolderTree()
+                }
+                self._index_user(uid_str, self.db[uid_str])
+            return
+
+        user = self.db.get(uid_str)
+        if user is None:
+            return
+        if op == "set":
+            if record["key"] == "username" and user.get("username") != record["value"]:
+                # Re-index under the new name
+                self.views.remove(None, uid_str, (uid_str, user))
+                self.user_index.remove(uid_str)
+                user["username"] = record["value"]
+                self._index_user(uid_str, user)
+            elif record["key"] != "username":
+                user[record["key"]] = record["value"]
+        elif op == "mkdir":
+            if not self._tree(user).add(record["path"]):
+                return
+            # mkdir -p: every folder along the path may have gained a child
+            path = record["path"]
+            while True:
+                self._bump(uid_str, path)
+                if path == "/":
+                    break
+                path = FolderTree.parent(path)
+        elif op == "rmdir":
+            folder_path = record["path"]
+            if self._tree(user).remove(folder_path):
+                self._bump(uid_str, FolderTree.parent(folder_path))
+            # If current folder was deleted, reset to root
+            current = user.get("current_folder", "/")
+            if current == folder_path or current.startswith(folder_path + "/"):
+                user["current_folder"] = "/"
+
+    def _bump(self, uid_str: str, path: str):
+        # Versions come from one counter, so a folder that is removed and recreated never repeats one
+        self.folder_versions[(uid_str, path)] = next(self._versions)
+
+    def folder_version(self, user_id: int, folder: str) -> int:
+        """Changes whenever a subfolder is created in or removed from the folder."""
+        return max(self.folder_versions.get((str(user_id), folder), 0), self._version_floor)
 
     def register(self, user_id: int, username: str) -> bool:
         """Registers a new user by ID."""
@@ -26,13 +252,7 @@ class UserManager:
         if uid_str in self.db:
             return False
         # Initialize with root folder
-        self.db[uid_str] = {
-            "username": username, 
-            "web_password": None,
-            "current_folder": "/",
-            "folders": ["/"] 
-        }
-        self._save_db()
+        self._commit({"op": "register", "uid": uid_str, "username": username})
         return True
 
     def get_current_folder(self, user_id: int) -> str:
@@ -44,69 +264,56 @@ class UserManager:
     def set_current_folder(self, user_id: int, folder: str):
         uid_str = str(user_id)
         if uid_str in self.db:
-            self.db[uid_str]["current_folder"] = folder
-            self._save_db()
+            self._commit({"op": "set", "uid": uid_str, "key": "current_folder", "value": folder})
 
     def create_folder(self, user_id: int, folder_name: str) -> bool:
         uid_str = str(user_id)
         if uid_str in self.db:
-            folders = self.db[uid_str].get("folders", ["/"])
+            folders = self._tree(self.db[uid_str])
             current = self.db[uid_str].get("current_folder", "/")
-            
-            # Simple path construction
-            if current == "/":
-                new_path = f"/{folder_name}"
-            else:
-                new_path = f"{current}/{folder_name}"
-            
+            new_path = FolderTree.join(current, folder_name)
+
             if new_path not in folders:
-                folders.append(new_path)
-                self.db[uid_str]["folders"] = folders
-                self._save_db()
+                self._commit({"op": "mkdir", "uid": uid_str, "path": new_path})
                 return True
         return False
 
     def get_subfolders(self, user_id: int, current_folder: str) -> list:
         uid_str = str(user_id)
-        subfolders = []
         if uid_str in self.db:
-            all_folders = self.db[uid_str].get("folders", ["/"])
-            # Find direct children
-            for f in all_folders:
-                if f != current_folder and f.startswith(current_folder):
-                    # Check if it's a direct child (no extra slashes)
-                    relative = f[len(current_folder):].lstrip("/")
-                    if "/" not in relative and relative:
-                        subfolders.append(f)
-        return subfolders
+            return self._tree(self.db[uid_str]).subfolders(current_folder)
+        return []
+
+    def page_subfolders(self, user_id: int, current_folder: str, start: int, limit: int) -> tuple:
+        """Returns (paths, total) for one page of a folder's direct subfolders, in name order."""
+        uid_str = str(user_id)
+        if uid_str in self.db:
+            with self._lock:
+                return self._tree(self.db[uid_str]).page(current_folder, start, limit)
+        return [], 0
+
+    def folder_exists(self, user_id: int, folder_path: str) -> bool:
+        uid_str = str(user_id)
+        return uid_str in self.db and folder_path in self._tree(self.db[uid_str])
+
+    def resolve_folder(self, user_id: int, target: str) -> Optional[str]:
+        """Resolves a folder name, path or ".." against the user's current folder."""
+        uid_str = str(user_id)
+        if uid_str in self.db:
+            user = self.db[uid_str]
+            return self._tree(user).resolve(user.get("current_folder", "/"), target)
+        return None
 
     def delete_folder(self, user_id: int, folder_path: str) -> bool:
         """Deletes a folder and all its subfolders."""
         uid_str = str(user_id)
         if uid_str in self.db:
-            folders = self.db[uid_str].get("folders", ["/"])
-            
             # Cannot delete root
             if folder_path == "/":
                 return False
-                
-            # Find all folders to remove (exact match or subfolder)
-            to_remove = []
-            for f in folders:
-                if f == folder_path or f.startswith(folder_path + "/"):
-                    to_remove.append(f)
-            
-            if to_remove:
-                for f in to_remove:
-                    folders.remove(f)
-                
-                # If current folder was deleted, reset to root
-                current = self.db[uid_str].get("current_folder", "/")
-                if current == folder_path or current.startswith(folder_path + "/"):
-                    self.db[uid_str]["current_folder"] = "/"
-                    
-                self.db[uid_str]["folders"] = folders
-                self._save_db()
+
+            if folder_path in self._tree(self.db[uid_str]):
+                self._commit({"op": "rmdir", "uid": uid_str, "path": folder_path})
                 return True
         return False
 
@@ -118,8 +325,7 @@ class UserManager:
         """Sets a password for web login."""
         uid_str = str(user_id)
         if uid_str in self.db:
-            self.db[uid_str]["web_password"] = password
-            self._save_db()
+            self._commit({"op": "set", "uid": uid_str, "key": "web_password", "value": password})
 
     def validate_web_login(self, user_id: str, password: str) -> bool:
         """Validates web login credentials."""
@@ -129,8 +335,7 @@ class UserManager:
         """Sets admin status for a user."""
         uid_str = str(user_id)
         if uid_str in self.db:
-            self.db[uid_str]["is_admin"] = is_admin
-            self._save_db()
+            self._commit({"op": "set", "uid": uid_str, "key": "is_admin", "value": is_admin})
 
     def is_admin(self, user_id: int) -> bool:
         """Checks if a user is an admin."""
@@ -139,6 +344,11 @@ class UserManager:
             return self.db[uid_str].get("is_admin", False)
         return False
 
+    def get_username(self, user_id) -> Optional[str]:
+        """Returns the username for a user ID, or None if unknown."""
+        data = self.db.get(str(user_id))
+        return data.get("username", "Unknown") if data else None
+
     def get_all_users(self) -> list:
         """Returns a list of (user_id, username) tuples."""
         users = []
@@ -146,12 +356,20 @@ class UserManager:
             users.append((uid, data.get("username", "Unknown")))
         return users
 
-    def search_users(self, query: str) -> list:
-        """Search users by ID or username."""
+    def list_users(self, sort: str = "id", descending: bool = False, cursor: Optional[str] = None,
+                   limit: int = 50) -> tuple:
+        """Returns (users, next_cursor): one page of (user_id, username) tuples, sorted by "id" or "name"."""
+        with self._lock:
+            uids, next_cursor = self.views.page(None, sort, lambda: ((uid, (uid, data)) for uid, data in self.db.items()),
+                                                cursor, limit, descending)
+            return [(uid, self.db[uid].get("username", "Unknown")) for uid in uids], next_cursor
+
+    def search_users(self, query: str, limit: Optional[int] = None) -> list:
+        """Search users by ID or username, best matches first."""
         results = []
-        query = query.lower()
-        for uid, data in self.db.items():
-            username = data.get("username", "").lower()
-            if query in uid or query in username:
-                results.append((uid, data.get("username", "Unknown")))
+        for uid in self.user_index.search(query, limit=limit):
+            results.append((uid, self.db[uid].get("username", "Unknown")))
         return results
+
+
+metrics.instrument(UserManager, "storage_call_seconds", "Time spent in storage methods", component="user_manager")
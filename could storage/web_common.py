@@ -0,0 +1,143 @@
+"""Storage, settings and helpers shared by the Flask (app.py) and ASGI (asgi_app.py) web apps.
+
+Nothing here depends on either framework, so each app imports this module
+rather than the other.
+"""
+import os
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
+
+from blob_store import BlobStore
+from http_ranges import etag_matches
+from storage_service import get_storage
+from thumbnails import get_thumbnailer, preview_kind
+from upload_sessions import UploadManager
+
+SECRET_KEY = 'super_secret_key_change_this'
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BULK_CODES = 10000  # codes per bulk request
+# Previews are named by content, but a code can be deleted, so browsers revalidate daily (ETag -> 304)
+THUMB_HEADERS = {'Cache-Control': 'private, max-age=86400'}
+# Served (202) while a preview is being built, so a gallery never waits on one; not cached, so the next view has it
+THUMB_PLACEHOLDER = (b'<svg xmlns="http://www.w3.org/2000/svg" width="64" height="64">'
+                     b'<rect width="64" height="64" fill="#e5e5e5"/></svg>')
+THUMB_PENDING_HEADERS = {'Cache-Control': 'no-store', 'Retry-After': '2'}
+
+# The same managers as the bot's when both run in one process (main.py with WEB_PORT)
+storage = get_storage()
+user_manager = storage.user_manager
+file_manager = storage.file_manager
+upload_manager = UploadManager()
+blob_store = BlobStore()
+thumbnailer = get_thumbnailer()
+
+
+def weak_etag(stat) -> str:
+    """Validator for a file whose content hash is not known yet: changes with its size or mtime."""
+    return f"{int(stat.st_mtime)}-{stat.st_size}"
+
+
+def content_disposition(name: str) -> str:
+    """Attachment header for a user-chosen file name.
+
+    The quoted filename is an ASCII fallback with quotes, backslashes and
+    control characters replaced; names it cannot carry also get filename*.
+    """
+    fallback = "".join(c if " " <= c < "\x7f" and c not in '"\\' else "_" for c in name) or "download"
+    value = f'attachment; filename="{fallback}"'
+    if fallback != name:
+        value += f"; filename*=utf-8''{quote(name, safe='')}"
+    return value
+
+
+def not_modified(headers, validator: str, mtime: float) -> bool:
+    """True if a download request's If-None-Match, or else its If-Modified-Since, says the client's copy is current."""
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        return etag_matches(if_none_match, validator)
+    since = headers.get('If-Modified-Since')
+    if not since:
+        return False
+    try:
+        return int(mtime) <= parsedate_to_datetime(since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def format_timestamp(value):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(value)) if value else ''
+
+
+def admin_file_row(file: dict) -> dict:
+    # Owner names are looked up per row, so the cost follows the page size, not the user count
+    return dict(file, owner_name=user_manager.get_username(file["owner"]) or "Unknown", thumb=thumb_url(file["code"]))
+
+
+def preview_source(code):
+    """(stored file, content hash, preview kind) for a file that can have a preview, else None.
+
+    The hash is None while a file from before hashes were recorded is being hashed.
+    """
+    record = file_manager.get_file_record(code)
+    if not record:
+        return None
+    path = record.get("path")
+    kind = preview_kind(record.get("file_name") or record.get("name"), record.get("tg_kind"), path)
+    if not (kind and path and os.path.exists(path)):
+        return None
+    return path, file_manager.get_content_hash(code), kind
+
+
+def thumb_url(code):
+    """Preview URL for file lists, or None for files that have none (checked by name, without opening the file)."""
+    record = file_manager.get_file_record(code)
+    if record and preview_kind(record.get("file_name") or record.get("name"), record.get("tg_kind"), record.get("path")):
+        return f"/thumb/{code}"
+    return None
+
+
+def admin_file_delta(cursor):
+    """Changes since `cursor` for the admin table; "reset" means the cursor cannot be served and pages must be reloaded."""
+    changes, cursor = file_manager.get_changes(cursor)
+    if changes is None:
+        return {"reset": True, "cursor": cursor}
+    return {
+        "reset": False,
+        "upserts": [admin_file_row(change) for change in changes.values() if change],
+        "deletes": [code for code, change in changes.items() if change is None],
+        "cursor": cursor
+    }
+
+
+def bulk_files(user_id: int, data) -> tuple:
+    """Runs one bulk file operation from a JSON body; returns (response dict, status).
+
+    {"op": "move" | "copy", "codes": [...], "folder": "/path"}, {"op": "delete", "codes": [...]}
+    or {"op": "tag", "codes": [...], "add": [...], "remove": [...]}. Codes the user does
+    not own are skipped; the whole operation is one commit.
+    """
+    if not isinstance(data, dict):
+        return {"error": "JSON object expected"}, 400
+    op, codes = data.get("op"), data.get("codes")
+    if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+        return {"error": "codes must be a list of file codes"}, 400
+    if len(codes) > MAX_BULK_CODES:
+        return {"error": f"at most {MAX_BULK_CODES} codes per request"}, 400
+    if op in ("move", "copy"):
+        folder = data.get("folder")
+        if not isinstance(folder, str) or not user_manager.folder_exists(user_id, folder):
+            return {"error": "folder must be one of your folders"}, 400
+        if op == "move":
+            return {"op": op, "count": file_manager.move_files(codes, user_id, folder)}, 200
+        copies = file_manager.copy_files(codes, user_id, folder)
+        return {"op": op, "count": len(copies), "codes": copies}, 200
+    if op == "delete":
+        return {"op": op, "count": file_manager.delete_files(codes, user_id)}, 200
+    if op == "tag":
+        add, remove = data.get("add", []), data.get("remove", [])
+        if not all(isinstance(tags, list) and all(isinstance(tag, str) for tag in tags) for tags in (add, remove)):
+            return {"error": "add and remove must be lists of tags"}, 400
+        return {"op": op, "count": file_manager.tag_files(codes, user_id, add, remove)}, 200
+    return {"error": "op must be move, copy, delete or tag"}, 400
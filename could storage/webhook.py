@@ -0,0 +1,142 @@
+import asyncio
+import hmac
+import json
+import logging
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    """ASGI app that receives Telegram webhook updates and feeds them to a PTB Application.
+
+    Updates go into a bounded queue drained by `workers` concurrent tasks, each
+    running the Application's normal handlers. When `max_pending` updates are
+    already waiting, new ones get a 503 so Telegram backs off and redelivers
+    them later, instead of the bot buffering without limit.
+
+    Serve it with any ASGI server (see run_webhook); the lifespan events
+    initialize and stop the Application and, if `webhook_url` is given,
+    register the webhook with Telegram.
+    """
+
+    def __init__(self, application: Application, path: str = "/telegram", secret_token: Optional[str] = None,
+                 webhook_url: Optional[str] = None, workers: int = 8, max_pending: int = 256):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.webhook_url = webhook_url
+        self.workers = workers
+        self.max_pending = max_pending
+        self.accepted = 0
+        self.rejected = 0
+        self._queue = None
+        self._tasks = []
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._handle(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.start()
+                except Exception as e:
+                    logger.exception("Webhook startup failed")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        await self.application.initialize()
+        await self.application.start()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.webhook_url:
+            await self.application.bot.set_webhook(
+                url=self.webhook_url.rstrip("/") + self.path,
+                secret_token=self.secret_token,
+                max_connections=self.workers,
+                allowed_updates=Update.ALL_TYPES,
+            )
+
+    async def stop(self):
+        # Finish what was already accepted; Telegram has been told it was delivered
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.application.stop()
+        await self.application.shutdown()
+
+    async def _worker(self):
+        while True:
+            data = await self._queue.get()
+            try:
+                await self.application.process_update(Update.de_json(data, self.application.bot))
+            except Exception:
+                update_id = data.get("update_id") if isinstance(data, dict) else None
+                logger.exception("Failed to process update %s", update_id)
+            finally:
+                self._queue.task_done()
+
+    async def _handle(self, scope, receive, send):
+        if scope["path"] != self.path:
+            return await self._respond(send, 404)
+        if scope["method"] != "POST":
+            return await self._respond(send, 405)
+        if self.secret_token:
+            headers = dict(scope["headers"])
+            given = headers.get(b"x-telegram-bot-api-secret-token", b"")
+            if not hmac.compare_digest(given, self.secret_token.encode()):
+                return await self._respond(send, 403)
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return await self._respond(send, 400)
+        if not isinstance(data, dict):
+            return await self._respond(send, 400)
+
+        try:
+            self._queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return await self._respond(send, 503, [(b"retry-after", b"1")])
+        self.accepted += 1
+        await self._respond(send, 200)
+
+    @staticmethod
+    async def _respond(send, status: int, headers=()):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-length", b"0"), *headers]})
+        await send({"type": "http.response.body", "body": b""})
+
+
+def run_webhook(application: Application, listen: str = "0.0.0.0", port: int = 8443, **kwargs):
+    """Serves a WebhookServer with uvicorn until interrupted; kwargs go to WebhookServer."""
+    import uvicorn  # Only needed in webhook mode
+
+    server = WebhookServer(application, **kwargs)
+    uvicorn.run(server, host=listen, port=port, lifespan="on", log_level="warning")